@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for Splash. They are not run as a part of the test suite;
+run individual modules, e.g.::
+
+    python -m splash.benchmark.lua_conversion
+"""
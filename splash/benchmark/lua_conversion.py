@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Lua <-> Python data conversion throughput.
+
+It converts a table similar to a scraped result returned from ``main``
+(a list of rows, each row is a dict with a nested list) and reports
+how many rows per second are converted in each direction.
+"""
+from __future__ import absolute_import
+import json
+import time
+import optparse
+
+from splash.lua import get_new_runtime, LuaConverter
+
+
+def get_rows(num_rows):
+    return [
+        {
+            "id": i,
+            "title": u"Item %d" % i,
+            "url": "http://example.com/items/%d" % i,
+            "price": i * 1.5,
+            "in_stock": bool(i % 2),
+            "tags": ["foo", "bar", "baz"],
+        }
+        for i in range(num_rows)
+    ]
+
+
+def _best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(num_rows=10000, repeat=5):
+    """ Run the benchmark; return a dict with results """
+    lua = get_new_runtime()
+    converter = LuaConverter(lua)
+    rows = get_rows(num_rows)
+    lua_rows = converter.python2lua(rows)
+
+    python2lua_time = _best_time(lambda: converter.python2lua(rows), repeat)
+    lua2python_time = _best_time(lambda: converter.lua2python(lua_rows), repeat)
+    assert converter.lua2python(lua_rows) == rows
+
+    return {
+        "rows": num_rows,
+        "python2lua": {
+            "time": python2lua_time,
+            "rows_per_second": num_rows / python2lua_time,
+        },
+        "lua2python": {
+            "time": lua2python_time,
+            "rows_per_second": num_rows / lua2python_time,
+        },
+    }
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("-n", "--rows", type="int", default=10000,
+        help="number of rows in a converted table (default: %default)")
+    op.add_option("-r", "--repeat", type="int", default=5,
+        help="number of runs; the best time is reported (default: %default)")
+    opts, _ = op.parse_args()
+    print(json.dumps(run(opts.rows, opts.repeat), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks for code which runs for each request or each subresource:
+HAR building, HAR serialization of Qt objects, Lua <-> Python conversion,
+Lua runtime creation, QVariant conversion, request middlewares, Adblock
+filters, render options parsing and JSON encoding of results.
+
+Benchmarks use synthetic payloads similar to real ones and don't need
+network access or running servers. Each benchmark is run several times;
+the best time per operation is reported as JSON::
+
+    python -m splash.benchmark.micro
+    python -m splash.benchmark.micro -b har_log -b json_encoder
+"""
+from __future__ import absolute_import
+import os
+import json
+import shutil
+import timeit
+import optparse
+import tempfile
+from datetime import datetime, timedelta
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from PyQt4.QtCore import QVariant, QString, QUrl
+from PyQt4.QtNetwork import QNetworkRequest, QNetworkAccessManager
+
+from splash import lua
+from splash.har import qt as har_qt
+from splash.har.log import HarLog
+from splash.qtutils import qt2py
+from splash.render_options import RenderOptions
+from splash.request_middleware import (
+    AllowedDomainsMiddleware,
+    AllowedSchemesMiddleware,
+    ResourceTypeMiddleware,
+    ResourcePriorityMiddleware,
+    AdblockRulesRegistry,
+)
+from splash.utils import BinaryCapsule, SplashJSONEncoder
+from splash.benchmark.lua_conversion import get_rows
+
+
+class SkipBenchmark(Exception):
+    """ Raised by a benchmark setup function if it can't be run """
+
+
+# name => setup function which returns a callable to benchmark
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def get_urls(num_urls):
+    exts = ['js', 'css', 'png', 'jpg', 'woff', 'html', 'json', '']
+    return [
+        "http://cdn%d.example.com/static/path/to/resource%d.%s?v=%d&lang=en" % (
+            i % 5, i, exts[i % len(exts)], i)
+        for i in range(num_urls)
+    ]
+
+
+def get_request(url):
+    request = QNetworkRequest(QUrl(url))
+    request.setRawHeader("User-Agent", "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/538.1 "
+                                       "(KHTML, like Gecko) splash Safari/538.1")
+    request.setRawHeader("Accept", "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8")
+    request.setRawHeader("Accept-Language", "en-US,en;q=0.8")
+    request.setRawHeader("Accept-Encoding", "gzip, deflate")
+    request.setRawHeader("Referer", "http://example.com/catalog/page/2?sort=price")
+    request.setRawHeader("Cookie", "; ".join(
+        "cookie%d=value%d%s" % (i, i, "x" * 20) for i in range(10)
+    ))
+    return request
+
+
+def _har_entry(i, url, start_time):
+    """ A HAR entry similar to ones created by the network manager """
+    return {
+        '_tmp': {
+            'start_time': start_time,
+            'request_start_sending_time': start_time,
+            'request_sent_time': start_time,
+            'response_start_time': start_time,
+            'state': 'finished',
+        },
+        "startedDateTime": start_time.isoformat() + 'Z',
+        "request": {
+            "method": "GET",
+            "url": url,
+            "httpVersion": "HTTP/1.1",
+            "cookies": [{"name": "cookie%d" % n, "value": "value"} for n in range(5)],
+            "queryString": [{"name": "v", "value": unicode(i)}],
+            "headers": [{"name": "Header%d" % n, "value": "value %d" % n} for n in range(8)],
+            "headersSize": 600,
+            "bodySize": -1,
+        },
+        "response": {
+            "status": 200,
+            "statusText": "OK",
+            "headers": [{"name": "Header%d" % n, "value": "value %d" % n} for n in range(10)],
+            "cookies": [],
+            "content": {"size": 5000 + i, "mimeType": "text/html"},
+            "redirectURL": "",
+            "headersSize": 400,
+            "bodySize": 5000 + i,
+            "ok": True,
+        },
+        "cache": {},
+        "timings": {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1,
+                    "send": 0, "wait": 20, "receive": 5},
+        "time": 25,
+    }
+
+
+@benchmark
+def har_log(num_entries=100):
+    """ Build a HAR log of a page with subresources and convert it to dict """
+    urls = get_urls(num_entries)
+    start_time = datetime.utcnow()
+
+    def run():
+        har_log = HarLog()
+        har_log.store_timing("_onStarted")
+        for i, url in enumerate(urls):
+            entry = har_log.get_mutable_entry(i, create=True)
+            entry.update(_har_entry(i, url, start_time + timedelta(milliseconds=i)))
+            if i == 0:
+                har_log.store_url(url)
+                har_log.store_title(u"Page title")
+        har_log.store_timing("onContentLoad")
+        har_log.store_timing("onLoad")
+        return har_log.todict()
+    return run
+
+
+@benchmark
+def har_qt_request():
+    """ Serialize headers, cookies and query of a QNetworkRequest to HAR """
+    request = get_request(get_urls(1)[0])
+
+    def run():
+        har_qt.headers2har(request)
+        har_qt.headers_size(request)
+        har_qt.request_cookies2har(request)
+        har_qt.querystring2har(request.url())
+    return run
+
+
+def _get_lua_converter():
+    if not lua.is_supported():
+        raise SkipBenchmark("Lua is not supported")
+    return lua.LuaConverter(lua.get_new_runtime())
+
+
+@benchmark
+def python2lua(num_rows=100):
+    """ Convert a scraped result to Lua """
+    converter = _get_lua_converter()
+    rows = get_rows(num_rows)
+    return lambda: converter.python2lua(rows)
+
+
+@benchmark
+def lua2python(num_rows=100):
+    """ Convert a scraped result returned from Lua to Python """
+    converter = _get_lua_converter()
+    lua_rows = converter.python2lua(get_rows(num_rows))
+    return lambda: converter.lua2python(lua_rows)
+
+
+@benchmark
+def lua_runtime_new():
+    """ Create a Lua runtime for a script without a pool """
+    if not lua.is_supported():
+        raise SkipBenchmark("Lua is not supported")
+    from splash.qtrender_lua import _PreparedRuntime
+    return lambda: _PreparedRuntime("")
+
+
+@benchmark
+def lua_runtime_pooled():
+    """
+    Take a Lua runtime from a pool which was refilled while the event loop
+    was idle. Refilling the pool costs as much as ``lua_runtime_new``,
+    so this is a gain in request latency, not in CPU time.
+    """
+    if not lua.is_supported():
+        raise SkipBenchmark("Lua is not supported")
+    from splash.qtrender_lua import LuaRuntimePool
+    pool = LuaRuntimePool(size=1, call_later=lambda delay, func: None)
+    pool._refill()
+
+    def run():
+        runtime = pool.get()
+        pool._runtimes.append(runtime)  # refilled in idle time
+    return run
+
+
+@benchmark
+def qt2py_result(num_rows=100):
+    """ Convert a JS result (a list of objects) from QVariant """
+    value = QVariant([
+        {
+            QString(u"title"): QString(u"Item %d" % i),
+            QString(u"url"): QString(u"http://example.com/items/%d" % i),
+            QString(u"price"): i * 1.5,
+            QString(u"tags"): [QString(u"foo"), QString(u"bar")],
+        }
+        for i in range(num_rows)
+    ])
+    return lambda: qt2py(value)
+
+
+@benchmark
+def request_middlewares(num_requests=100):
+    """ Process subresource requests with request middlewares """
+    middlewares = [
+        AllowedSchemesMiddleware(['http', 'https', 'data', 'about']),
+        ResourceTypeMiddleware(),
+        AllowedDomainsMiddleware(),
+        ResourcePriorityMiddleware(),
+    ]
+    render_options = RenderOptions({
+        'url': 'http://example.com/catalog/page/2',
+        'allowed_domains': 'example.com,example.net',
+        'deprioritize': 'image,font',
+        'uid': 1,
+    })
+    requests = [get_request(url) for url in get_urls(num_requests)]
+
+    def run():
+        for request in requests:
+            request = QNetworkRequest(request)  # middlewares change requests
+            for middleware in middlewares:
+                request = middleware.process(request, render_options,
+                                             QNetworkAccessManager.GetOperation, None)
+    return run
+
+
+@benchmark
+def adblock_filter(num_rules=2000, num_urls=100):
+    """ Check subresource URLs against Adblock filters """
+    path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(path, 'easylist.txt'), 'w') as f:
+            for i in range(num_rules):
+                f.write("||tracker%d.example.org^\n" % i)
+                f.write("/banners/%d/*$domain=example.com\n" % i)
+            f.write("@@||cdn0.example.com/static/*\n")
+        registry = AdblockRulesRegistry(path)
+    finally:
+        shutil.rmtree(path)
+    if not registry.filter_is_known('easylist'):
+        raise SkipBenchmark("adblockparser is not installed")
+
+    urls = get_urls(num_urls)
+    options = {'domain': 'example.com'}
+
+    def run():
+        for url in urls:
+            registry.get_blocking_filter(['easylist'], url, options)
+    return run
+
+
+class _Request(object):
+    """ A minimal stand-in for twisted.web.server.Request """
+    def __init__(self, method='GET', args=None, headers=None, body=''):
+        self.method = method
+        self.args = args or {}
+        self.headers = headers or {}
+        self.content = StringIO(body)
+
+    def getHeader(self, name):
+        return self.headers.get(name.lower())
+
+
+@benchmark
+def render_options_get():
+    """ Parse render options from GET arguments """
+    request = _Request(args={
+        'url': ['http://example.com/catalog/page/2?sort=price'],
+        'wait': ['0.5'],
+        'timeout': ['30'],
+        'images': ['0'],
+        'filters': ['easylist'],
+        'html': ['1'],
+        'png': ['1'],
+        'width': ['320'],
+    })
+    return lambda: RenderOptions.fromrequest(request)
+
+
+@benchmark
+def render_options_json():
+    """ Parse render options from a JSON POST request with a Lua script """
+    body = json.dumps({
+        'url': 'http://example.com/catalog/page/2?sort=price',
+        'lua_source': "function main(splash)\n%s\nend\n" % (
+            "  splash:go(splash.args.url)\n  splash:wait(0.5)\n" * 20),
+        'headers': {'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en'},
+        'wait': 0.5,
+        'timeout': 30,
+    })
+    request = _Request('POST', headers={'content-type': 'application/json'}, body=body)
+    return lambda: RenderOptions.fromrequest(request)
+
+
+@benchmark
+def json_encoder():
+    """ Encode a render.json-like result """
+    start_time = datetime.utcnow()
+    result = {
+        "url": "http://example.com/catalog/page/2?sort=price",
+        "title": u"Catalog – page 2",
+        "html": u"<html><body>%s</body></html>" % (u"<div class='item'>élément</div>" * 3000),
+        "png": BinaryCapsule(os.urandom(200 * 1024)),
+        "har": {"log": {"entries": [
+            _har_entry(i, url, start_time)["request"]
+            for i, url in enumerate(get_urls(100))
+        ]}},
+    }
+    return lambda: json.dumps(result, cls=SplashJSONEncoder)
+
+
+def run_benchmark(name, repeat=5, min_time=0.2):
+    """
+    Run a benchmark; return a dict with the best time per operation.
+    The number of operations per run is chosen so that a run takes
+    at least ``min_time`` seconds.
+    """
+    try:
+        func = BENCHMARKS[name]()
+    except SkipBenchmark as e:
+        return {"skipped": str(e)}
+
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    best = min(timer.repeat(repeat, number)) / number
+    return {
+        "number": number,
+        "time": best,
+        "ops_per_second": 1.0 / best,
+    }
+
+
+def run(names=None, repeat=5, min_time=0.2):
+    """ Run benchmarks; return a dict with results """
+    return OrderedDict(
+        (name, run_benchmark(name, repeat, min_time))
+        for name in (names or BENCHMARKS.keys())
+    )
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("-b", "--benchmark", action="append", dest="names", metavar="NAME",
+        help="benchmark to run; can be used several times (default: all). "
+             "Benchmarks: %s" % ", ".join(BENCHMARKS))
+    op.add_option("-r", "--repeat", type="int", default=5,
+        help="number of runs; the best time is reported (default: %default)")
+    op.add_option("-t", "--min-time", type="float", default=0.2,
+        help="minimum duration of a run, seconds (default: %default)")
+    op.add_option("-o", "--output", metavar="FILE",
+        help="write results to FILE instead of stdout")
+    opts, _ = op.parse_args()
+
+    for name in opts.names or []:
+        if name not in BENCHMARKS:
+            op.error("unknown benchmark: %s" % name)
+
+    text = json.dumps(run(opts.names, opts.repeat, opts.min_time), indent=2)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Render throughput and latency under load.
+
+A mock server (:mod:`splash.tests.mockserver`) with configurable synthetic
+pages and a Splash server are started; Splash is then sent requests
+to several endpoints, either at a fixed concurrency (each of ``concurrency``
+clients sends a new request when the previous one is finished) or at
+a fixed rate (open loop: requests are sent on schedule regardless of
+how many requests are in progress, and latency is measured from
+the scheduled time).
+
+Results (throughput, status codes and latency percentiles per endpoint
+and per page) are printed as JSON, so results of different runs can be
+compared. Output of the started servers is discarded unless ``--log-file``
+is passed::
+
+    python -m splash.benchmark.rendering -n 500 -c 20 -o before.json
+    python -m splash.benchmark.rendering -n 500 --rate 10 -e render.json
+"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import itertools
+import threading
+from Queue import Queue
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from subprocess import Popen, STDOUT
+
+import requests
+
+from splash.tests.utils import get_ephemeral_port, get_testenv, _wait_for_port
+
+
+# name => arguments of a synthetic page (see SyntheticPage in mockserver)
+PAGES = OrderedDict([
+    ("simple", {}),
+    ("subresources", {"subresources": 20}),
+    ("heavy-js", {"js": 200}),
+    ("slow", {"delay": 0.5, "subresources": 5, "resource_delay": 0.5}),
+    ("redirects", {"redirects": 3}),
+    ("large-dom", {"dom": 10000}),
+])
+
+ENDPOINTS = ["render.html", "render.png", "render.json"]
+
+
+def parse_page(spec):
+    """
+    Parse a page specification: either a name from :data:`PAGES`
+    or a list of synthetic page arguments, e.g. ``subresources=50,js=100``.
+
+    >>> parse_page("heavy-js")
+    {'js': 200}
+    >>> sorted(parse_page("subresources=50,js=100").items())
+    [('js', '100'), ('subresources', '50')]
+    """
+    if spec in PAGES:
+        return PAGES[spec]
+    try:
+        return dict(item.split("=", 1) for item in spec.split(","))
+    except ValueError:
+        raise ValueError("Invalid page: %r" % spec)
+
+
+def percentile(sorted_values, percent):
+    """
+    >>> percentile([1, 2, 3], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not sorted_values:
+        return None
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    """
+    Return a dict with throughput, status code counts and
+    latency percentiles for a list of results.
+    """
+    latencies = sorted(result["latency"] for result in results)
+    statuses = Counter(result["status"] for result in results)
+    return {
+        "requests": len(results),
+        "errors": sum(n for status, n in statuses.items() if status != "200"),
+        "statuses": dict(statuses),
+        "throughput": len(results) / elapsed if elapsed else None,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def _grouped(results, key):
+    groups = OrderedDict()
+    for result in results:
+        groups.setdefault(result[key], []).append(result)
+    return groups
+
+
+class LoadGenerator(object):
+    """
+    Send render requests to Splash and collect their latencies.
+    ``jobs`` is a list of ``(endpoint, page name, params)`` tuples.
+    """
+    def __init__(self, splash_url, jobs, timeout=60):
+        self.splash_url = splash_url.rstrip("/")
+        self.jobs = jobs
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+
+    def send(self, job, scheduled_time=None):
+        endpoint, page, params = job
+        start_time = time.time()
+        if scheduled_time is None:
+            scheduled_time = start_time
+        try:
+            resp = requests.get("%s/%s" % (self.splash_url, endpoint),
+                                params=params, timeout=self.timeout + 10)
+            status = str(resp.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        result = {
+            "endpoint": endpoint,
+            "page": page,
+            "status": status,
+            "latency": time.time() - scheduled_time,
+        }
+        with self._lock:
+            self.results.append(result)
+
+    def run_closed(self, num_requests, concurrency):
+        """ Send requests from ``concurrency`` clients """
+        queue = Queue()
+
+        def worker():
+            while True:
+                job = queue.get()
+                try:
+                    self.send(job)
+                finally:
+                    queue.task_done()
+
+        for _ in range(concurrency):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+        for job in itertools.islice(itertools.cycle(self.jobs), num_requests):
+            queue.put(job)
+        queue.join()
+
+    def run_open(self, num_requests, rate):
+        """ Send ``rate`` requests per second """
+        start_time = time.time()
+        threads = []
+        jobs = itertools.islice(itertools.cycle(self.jobs), num_requests)
+        for i, job in enumerate(jobs):
+            scheduled_time = start_time + i / float(rate)
+            time.sleep(max(scheduled_time - time.time(), 0))
+            thread = threading.Thread(target=self.send, args=(job, scheduled_time))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+def get_jobs(mock_url, endpoints, pages, render_args):
+    jobs = []
+    for endpoint in endpoints:
+        for name in pages:
+            page_args = sorted(parse_page(name).items())
+            params = dict(render_args)
+            params["url"] = mock_url("synthetic?" + "&".join(
+                "%s=%s" % item for item in page_args
+            ))
+            jobs.append((endpoint, name, params))
+    return jobs
+
+
+def run(endpoints=ENDPOINTS, pages=PAGES.keys(), num_requests=200,
+        concurrency=10, rate=None, warmup=10, slots=None, splash_url=None,
+        render_args=None, timeout=60, log_file=None, mock_host="localhost"):
+    """
+    Run the benchmark; return a dict with results.
+    Output of the started servers is appended to ``log_file``
+    (it is discarded if ``log_file`` is None). The mock server is always
+    started locally; ``mock_host`` is a host name Splash uses to reach it,
+    which is not ``localhost`` if Splash at ``splash_url`` runs on
+    another machine or in a container.
+    """
+    render_args = dict(render_args or {})
+    render_args.setdefault("timeout", timeout)
+    with open(log_file or os.devnull, "a") as log:
+        with _mock_server(log, mock_host) as mock_url, \
+                _splash(splash_url, slots, log) as url:
+            jobs = get_jobs(mock_url, endpoints, pages, render_args)
+
+            if warmup:
+                LoadGenerator(url, jobs, timeout).run_closed(warmup, concurrency)
+
+            generator = LoadGenerator(url, jobs, timeout)
+            start_time = time.time()
+            if rate:
+                generator.run_open(num_requests, rate)
+            else:
+                generator.run_closed(num_requests, concurrency)
+            elapsed = time.time() - start_time
+
+    results = generator.results
+    return {
+        "config": {
+            "endpoints": list(endpoints),
+            "pages": OrderedDict((name, parse_page(name)) for name in pages),
+            "requests": num_requests,
+            "mode": "open" if rate else "closed",
+            "concurrency": None if rate else concurrency,
+            "rate": rate,
+            "slots": slots,
+            "splash_url": splash_url,
+            "mock_host": mock_host,
+            "render_args": render_args,
+        },
+        "elapsed": elapsed,
+        "total": summarize(results, elapsed),
+        "endpoints": OrderedDict(
+            (endpoint, summarize(items, elapsed))
+            for endpoint, items in _grouped(results, "endpoint").items()
+        ),
+        "pages": OrderedDict(
+            (page, summarize(items, elapsed))
+            for page, items in _grouped(results, "page").items()
+        ),
+    }
+
+
+@contextmanager
+def _process(args, ports, log):
+    """
+    Start a server process, wait until it listens on all ``ports``
+    and kill it on exit. Process output goes to ``log`` file:
+    a pipe which nobody reads would block the process when it is full.
+    """
+    proc = Popen([sys.executable, '-u', '-m'] + args,
+                 stdout=log, stderr=STDOUT, env=get_testenv())
+    try:
+        for port in ports:
+            _wait_for_port(port)
+        yield proc
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@contextmanager
+def _mock_server(log, host="localhost"):
+    """
+    Start a mock server; yield a function which returns its URLs
+    (with ``host`` as a host name).
+    """
+    http_port, https_port, proxy_port = [get_ephemeral_port() for _ in range(3)]
+    args = [
+        'splash.tests.mockserver',
+        '--http-port', str(http_port),
+        '--https-port', str(https_port),
+        '--proxy-port', str(proxy_port),
+    ]
+    with _process(args, [http_port, https_port, proxy_port], log):
+        yield lambda path: "http://%s:%d/gzip/%s" % (host, http_port, path.lstrip('/'))
+
+
+@contextmanager
+def _splash(splash_url, slots, log):
+    """ Start a Splash server unless ``splash_url`` is passed """
+    if splash_url is not None:
+        yield splash_url
+        return
+    port = get_ephemeral_port()
+    cache_path = tempfile.mkdtemp()
+    args = [
+        'splash.server',
+        '--port', str(port),
+        '--proxy-portnum', str(get_ephemeral_port()),
+        '--cache-path', cache_path,
+        '--verbosity', '1',
+    ]
+    if slots is not None:
+        args += ["--slots", str(slots)]
+    try:
+        with _process(args, [port], log):
+            yield "http://localhost:%d/" % port
+    finally:
+        shutil.rmtree(cache_path)
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("-e", "--endpoints", default=",".join(ENDPOINTS),
+        help="comma-separated list of endpoints (default: %default)")
+    op.add_option("-p", "--page", action="append", dest="pages", metavar="PAGE",
+        help="page to render: one of %s or synthetic page arguments, "
+             "e.g. 'subresources=50,js=100'; can be used several times "
+             "(default: all named pages)" % ", ".join(PAGES))
+    op.add_option("-n", "--requests", type="int", default=200,
+        help="number of requests (default: %default)")
+    op.add_option("-c", "--concurrency", type="int", default=10,
+        help="number of concurrent clients (default: %default)")
+    op.add_option("-r", "--rate", type="float",
+        help="send requests at a fixed rate (requests per second) "
+             "instead of using a fixed number of clients")
+    op.add_option("-w", "--warmup", type="int", default=10,
+        help="number of requests sent before measurements (default: %default)")
+    op.add_option("-a", "--render-arg", action="append", dest="render_args",
+        default=[], metavar="NAME=VALUE",
+        help="additional argument for all render requests, e.g. 'wait=0.5'")
+    op.add_option("--timeout", type="float", default=60,
+        help="render timeout, seconds (default: %default)")
+    op.add_option("--slots", type="int",
+        help="number of render slots of the started Splash server")
+    op.add_option("--splash-url",
+        help="use a running Splash server instead of starting a new one")
+    op.add_option("--mock-host", default="localhost",
+        help="host name of this machine as seen by Splash; use it with "
+             "--splash-url if Splash runs on another machine or in a "
+             "container (default: %default)")
+    op.add_option("-o", "--output", metavar="FILE",
+        help="write results to FILE instead of stdout")
+    op.add_option("--log-file", metavar="FILE",
+        help="append output of the started servers to FILE (default: discard it)")
+    opts, _ = op.parse_args()
+
+    result = run(
+        endpoints=opts.endpoints.split(","),
+        pages=opts.pages or PAGES.keys(),
+        num_requests=opts.requests,
+        concurrency=opts.concurrency,
+        rate=opts.rate,
+        warmup=opts.warmup,
+        slots=opts.slots,
+        splash_url=opts.splash_url,
+        render_args=dict(arg.split("=", 1) for arg in opts.render_args),
+        timeout=opts.timeout,
+        log_file=opts.log_file,
+        mock_host=opts.mock_host,
+    )
+    text = json.dumps(result, indent=2)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
-import os
 import base64
 import copy
 import pprint
+import json
+import time
 import weakref
 import functools
+import itertools
 from PyQt4.QtWebKit import QWebPage, QWebSettings, QWebView
 from PyQt4.QtCore import (Qt, QUrl, QBuffer, QSize, QTimer, QObject,
                           pyqtSlot)
@@ -15,12 +17,133 @@ from twisted.internet import defer
 from twisted.python import log
 from splash import defaults
 from splash.qtutils import qurl2ascii, OPERATION_QT_CONSTANTS, qt2py, WrappedSignal
+from splash.utils import instance_counter
 from splash.har.qt import cookies2har
 from splash.har.utils import without_private
+from splash.js_profiles import js_profile_cache
 
 from .qwebpage import SplashQWebPage
 
 
+# JS code which checks if an element matching a CSS selector exists
+_ELEMENT_EXISTS_JS = """
+(function(selector){
+    try {
+        return document.querySelector(selector) === null ? "missing" : "found";
+    } catch (e) {
+        return "invalid";
+    }
+})(%s)
+"""
+
+# JS code which checks CSS selector syntax without looking at the document
+_VALID_SELECTOR_JS = """
+(function(selector){
+    try {
+        document.createDocumentFragment().querySelector(selector);
+        return true;
+    } catch (e) {
+        return false;
+    }
+})(%s)
+"""
+
+# JS code which calls window.__splash_selector_watcher.found(waiterId)
+# when an element matching a CSS selector appears. MutationObserver is
+# used when available; older WebKit versions fall back to mutation events.
+_WATCH_SELECTOR_JS = """
+(function(waiterId, selector){
+    var waiters = window.__splash_selector_waiters = window.__splash_selector_waiters || {};
+    var Observer = window.MutationObserver || window.WebKitMutationObserver;
+    var observer = null;
+    var events = ["DOMNodeInserted", "DOMSubtreeModified"];
+
+    function stop() {
+        delete waiters[waiterId];
+        if (observer !== null) {
+            observer.disconnect();
+        } else {
+            events.forEach(function(name){
+                document.removeEventListener(name, check, true);
+            });
+        }
+    }
+
+    function check() {
+        if (document.querySelector(selector) !== null) {
+            stop();
+            window.__splash_selector_watcher.found(waiterId);
+        }
+    }
+
+    waiters[waiterId] = stop;
+    if (Observer) {
+        observer = new Observer(check);
+        observer.observe(document, {childList: true, subtree: true, attributes: true});
+    } else {
+        events.forEach(function(name){
+            document.addEventListener(name, check, true);
+        });
+    }
+    check();
+})(%s, %s)
+"""
+
+_CANCEL_SELECTOR_WATCH_JS = """
+(function(waiterId){
+    var waiters = window.__splash_selector_waiters || {};
+    if (waiters[waiterId]) {
+        waiters[waiterId]();
+    }
+})(%s)
+"""
+
+# JS code which compiles a function (see BrowserTab.call_js_function)
+# and stores it in window.__splash_js_functions
+_REGISTER_JS_FUNCTION_JS = """
+(function(funcId, func_text){
+    var funcs = window.__splash_js_functions = window.__splash_js_functions || {};
+    try {
+        var func = eval("(" + func_text + ")");
+        if (typeof func !== "function") {
+            throw new TypeError("'" + func_text + "' is not a function");
+        }
+        funcs[funcId] = func;
+        return {error: false};
+    }
+    catch(e){
+        return {
+            error: true,
+            error_repr: e.toString(),
+        }
+    }
+})(%s, %s)
+"""
+
+# JS code which calls a function stored in window.__splash_js_functions
+_CALL_JS_FUNCTION_JS = """
+(function(funcId){
+    var funcs = window.__splash_js_functions || {};
+    var func = funcs[funcId];
+    if (typeof func !== "function") {
+        return {missing: true};
+    }
+    try{
+        return {
+            result: func.apply(window, [%s]),
+            error: false,
+        }
+    }
+    catch(e){
+        return {
+            error: true,
+            error_repr: e.toString(),
+        }
+    }
+})(%s)
+"""
+
+
 def skip_if_closing(meth):
     @functools.wraps(meth)
     def wrapped(self, *args, **kwargs):
@@ -39,13 +162,15 @@ class BrowserTab(QObject):
     and waits until either a callback or an errback is called, then destroys
     a BrowserTab.
 
-    XXX: currently cookies are not shared between "browser tabs".
+    Extra tabs can be created using :meth:`new_tab`; cookies are not shared
+    between tabs unless requested explicitly.
     """
 
     def __init__(self, network_manager, splash_proxy_factory, verbosity,
                  render_options):
         """ Create a new browser tab. """
         QObject.__init__(self)
+        instance_counter.track(self)
         self.deferred = defer.Deferred()
         self.network_manager = network_manager
         self.verbosity = verbosity
@@ -55,8 +180,16 @@ class BrowserTab(QObject):
         self._timers_to_cancel_on_redirect = weakref.WeakKeyDictionary()  # timer: callback
         self._timers_to_cancel_on_error = weakref.WeakKeyDictionary()  # timer: callback
         self._js_console = None
+        self._selector_watcher = _SelectorWatcher()
+        self._selector_waiter_ids = itertools.count()
+        self._selector_waits = {}  # waiter id => selector
         self._history = []
         self._autoload_scripts = []
+        self._child_tabs = []
+        self._js_functions = {}  # function id => source
+        self._js_function_ids = itertools.count()
+        self._registered_js_functions = set()
+        self.js_time = 0.0  # seconds spent evaluating JS code
 
         self._init_webpage(verbosity, network_manager, splash_proxy_factory,
                            render_options)
@@ -69,6 +202,10 @@ class BrowserTab(QObject):
         self.web_page.setNetworkAccessManager(network_manager)
         self.web_page.splash_proxy_factory = splash_proxy_factory
         self.web_page.render_options = render_options
+        # parsed once: ResourcePriorityMiddleware checks it for every request
+        self.web_page.deprioritized_resources = frozenset(
+            render_options.get_deprioritized_resources()
+        )
 
         self._set_default_webpage_options(self.web_page)
         self._setup_webpage_events()
@@ -136,6 +273,44 @@ class BrowserTab(QObject):
     def set_images_enabled(self, enabled):
         self.web_page.settings().setAttribute(QWebSettings.AutoLoadImages, enabled)
 
+    def set_blocked_resources(self, resource_types):
+        """
+        Set a list of resource types (e.g. 'image', 'font') which
+        shouldn't be downloaded.
+        """
+        self.web_page.blocked_resources = frozenset(resource_types or [])
+
+    def set_download_limits(self, max_response_size=0, max_render_bytes=0):
+        """
+        Set byte budgets for a single response and for all responses
+        of this tab; responses which exceed them are aborted.
+        0 means "no limit".
+        """
+        self.web_page.max_response_size = max_response_size
+        self.web_page.max_render_bytes = max_render_bytes
+
+    def new_tab(self, share_cookies=False):
+        """
+        Create a new browser tab with the same network manager, proxy
+        and render options. The new tab is closed when this tab is closed.
+        If ``share_cookies`` is True the new tab uses the cookiejar
+        of this tab.
+        """
+        tab = BrowserTab(
+            network_manager=self.network_manager,
+            splash_proxy_factory=self.web_page.splash_proxy_factory,
+            verbosity=self.verbosity,
+            render_options=self.web_page.render_options,
+        )
+        tab.set_download_limits(
+            max_response_size=self.web_page.max_response_size,
+            max_render_bytes=self.web_page.max_render_bytes,
+        )
+        if share_cookies:
+            tab.web_page.cookiejar = self.web_page.cookiejar
+        self._child_tabs.append(tab)
+        return tab
+
     def set_viewport(self, size):
         """
         Set viewport size.
@@ -276,6 +451,9 @@ class BrowserTab(QObject):
         self.web_page.deleteLater()
         self.web_view.deleteLater()
         self._cancel_all_timers()
+        for tab in self._child_tabs:
+            tab.close()
+        self._child_tabs = []
 
     @skip_if_closing
     def _on_load_finished(self, ok):
@@ -285,6 +463,7 @@ class BrowserTab(QObject):
 
         if self.web_page.is_ok(ok):  # or maybe_redirect:
             self.logger.log("loadFinished: ok", min_level=2)
+            self._check_selector_waits()
         else:
             self._cancel_timers(self._timers_to_cancel_on_error)
 
@@ -375,6 +554,146 @@ class BrowserTab(QObject):
             self._timers_to_cancel_on_redirect[timer] = onredirect
         if onerror:
             self._timers_to_cancel_on_error[timer] = onerror
+        return timer
+
+    def wait_for_network_idle(self, idle_time_ms, callback, max_time_ms=None,
+                              onerror=None):
+        """
+        Wait until there are no active network requests for idle_time_ms,
+        then run callback(True). If max_time_ms is not None and the network
+        doesn't become idle in max_time_ms then callback(False) is called.
+
+        If onerror is callable then in case of a render error waiting is
+        cancelled and this callable is called.
+        """
+        web_page = self.web_page
+        idle_timer = QTimer()
+        idle_timer.setSingleShot(True)
+        idle_timer.setInterval(idle_time_ms)
+        max_timer = [None]
+
+        def on_active_requests_changed(count):
+            if count:
+                idle_timer.stop()
+            else:
+                idle_timer.start()
+
+        def cleanup():
+            web_page.activeRequestsChanged.disconnect(on_active_requests_changed)
+            self._timers_to_cancel_on_error.pop(idle_timer, None)
+            self._cancel_timer(idle_timer)
+            if max_timer[0] is not None:
+                self._cancel_timer(max_timer[0])
+
+        def done(idle):
+            self.logger.log("network is %s" % ("idle" if idle else "still active"), min_level=2)
+            cleanup()
+            callback(idle)
+
+        def error():
+            cleanup()
+            if callable(onerror):
+                onerror()
+
+        idle_timer.timeout.connect(functools.partial(done, True))
+        web_page.activeRequestsChanged.connect(on_active_requests_changed)
+        self._active_timers.add(idle_timer)
+        if onerror:
+            self._timers_to_cancel_on_error[idle_timer] = error
+
+        self.logger.log("waiting for network idle (%sms)" % idle_time_ms, min_level=2)
+        if max_time_ms is not None:
+            max_timer[0] = self.wait(max_time_ms, functools.partial(done, False))
+        on_active_requests_changed(web_page.active_request_count())
+
+    def validate_selector(self, selector):
+        """ Raise ValueError if CSS selector is invalid. """
+        if not isinstance(selector, basestring) or \
+                not self.runjs(_VALID_SELECTOR_JS % json.dumps(selector)):
+            raise ValueError("Invalid CSS selector: %r" % selector)
+
+    def element_exists(self, selector):
+        """
+        Return True if there is an element matching CSS selector
+        in the main frame. Raise ValueError if selector is invalid.
+        """
+        res = self.runjs(_ELEMENT_EXISTS_JS % json.dumps(selector))
+        if res == "invalid":
+            raise ValueError("Invalid CSS selector: %r" % selector)
+        return res == "found"
+
+    def wait_for_selector(self, selector, callback, timeout_ms=None, onerror=None):
+        """
+        Wait until an element matching CSS selector appears in the main
+        frame, then run callback(True). If timeout_ms is not None and the
+        element doesn't appear in timeout_ms then callback(False) is called.
+
+        If onerror is callable then in case of a render error waiting is
+        cancelled and this callable is called.
+
+        Instead of polling DOM is watched using MutationObserver;
+        Python is notified by JS code as soon as the element appears.
+        The watcher is installed again when the page navigates
+        to another URL or is reloaded.
+        Raise ValueError if selector is invalid.
+        """
+        self.validate_selector(selector)
+        if self.element_exists(selector):
+            callback(True)
+            return
+
+        waiter_id = next(self._selector_waiter_ids)
+        timer = QTimer()
+        timer.setSingleShot(True)
+        finished = []
+
+        def cleanup():
+            self._selector_watcher.callbacks.pop(waiter_id, None)
+            self._selector_waits.pop(waiter_id, None)
+            self._timers_to_cancel_on_error.pop(timer, None)
+            self._cancel_timer(timer)
+            self.runjs(_CANCEL_SELECTOR_WATCH_JS % waiter_id)
+
+        def done(found):
+            if finished or self._closing:
+                return
+            finished.append(True)
+            self.logger.log("selector %r is %s" % (selector, "found" if found else "not found"),
+                            min_level=2)
+            cleanup()
+            callback(found)
+
+        def error():
+            finished.append(True)
+            cleanup()
+            if callable(onerror):
+                onerror()
+
+        timer.timeout.connect(functools.partial(done, False))
+        self._active_timers.add(timer)
+        if onerror:
+            self._timers_to_cancel_on_error[timer] = error
+        self._selector_watcher.callbacks[waiter_id] = functools.partial(done, True)
+        self._selector_waits[waiter_id] = selector
+
+        self.logger.log("waiting for selector %r" % selector, min_level=2)
+        self._watch_selector(waiter_id, selector)
+        if timeout_ms is not None and waiter_id in self._selector_watcher.callbacks:
+            timer.start(timeout_ms)
+
+    def _watch_selector(self, waiter_id, selector):
+        frame = self.web_page.mainFrame()
+        frame.addToJavaScriptWindowObject('__splash_selector_watcher', self._selector_watcher)
+        self.runjs(_WATCH_SELECTOR_JS % (waiter_id, json.dumps(selector)))
+
+    def _check_selector_waits(self):
+        """
+        Check selectors of all active wait_for_selector calls; this
+        handles pages where DOM changes are not seen by a watcher.
+        """
+        for waiter_id, selector in list(self._selector_waits.items()):
+            if self.element_exists(selector):
+                self._selector_watcher.found(waiter_id)
 
     def _on_wait_timeout(self, timer, callback):
         self.logger.log("wait timeout for %s" % id(timer), min_level=2)
@@ -426,11 +745,10 @@ class BrowserTab(QObject):
     def run_js_files(self, folder):
         """
         Load all JS libraries from ``folder`` folder to the current frame.
+        Files are read from :data:`splash.js_profiles.js_profile_cache`.
         """
-        for jsfile in os.listdir(folder):
-            if jsfile.endswith('.js'):
-                filename = os.path.join(folder, jsfile)
-                self.run_js_file(filename)
+        for script in js_profile_cache.get_scripts(folder):
+            self.runjs(script)
 
     def autoload(self, js_source):
         """ Execute JS code before each page load """
@@ -441,8 +759,12 @@ class BrowserTab(QObject):
         self._autoload_scripts = []
 
     def _on_javascript_window_object_cleared(self):
+        self._registered_js_functions.clear()
         for script in self._autoload_scripts:
-            self.web_page.mainFrame().evaluateJavaScript(script)
+            self._evaluate_js(script)
+        # watchers of the previous page are gone; watch the new page
+        for waiter_id, selector in list(self._selector_waits.items()):
+            self._watch_selector(waiter_id, selector)
 
     def http_get(self, url, callback, headers=None, follow_redirects=True):
         """ Send a GET request; call a callback with the reply as an argument. """
@@ -452,14 +774,96 @@ class BrowserTab(QObject):
             follow_redirects=follow_redirects
         )
 
+    def http_get_many(self, urls, callback, on_reply, headers=None,
+                      follow_redirects=True, concurrency=defaults.HTTP_GET_MANY_CONCURRENCY):
+        """
+        Send GET requests to ``urls``, at most ``concurrency`` at time.
+        ``on_reply(index, reply)`` is called for each reply (the reply is
+        deleted afterwards); ``callback()`` is called when all
+        requests are finished.
+        """
+        urls = list(urls)
+        pending = iter(enumerate(urls))
+        finished = [0]
+
+        def send_next():
+            for index, url in pending:
+                self.http_client.get(url,
+                    callback=functools.partial(reply_received, index),
+                    headers=headers,
+                    follow_redirects=follow_redirects,
+                )
+                return
+
+        def reply_received(index, reply):
+            on_reply(index, reply)
+            finished[0] += 1
+            if finished[0] == len(urls):
+                callback()
+            else:
+                send_next()
+
+        if not urls:
+            callback()
+            return
+        for _ in range(min(concurrency, len(urls))):
+            send_next()
+
     def runjs(self, js_source):
         """
         Run JS code in page context and return the result.
         Only string results are supported.
         """
-        frame = self.web_page.mainFrame()
-        res = frame.evaluateJavaScript(js_source)
-        return qt2py(res)
+        return qt2py(self._evaluate_js(js_source))
+
+    def _evaluate_js(self, js_source):
+        start_time = time.time()
+        try:
+            return self.web_page.mainFrame().evaluateJavaScript(js_source)
+        finally:
+            self.js_time += time.time() - start_time
+
+    def register_js_function(self, source):
+        """
+        Register source code of a JS function and return its id
+        which can be passed to :meth:`call_js_function`.
+        """
+        func_id = next(self._js_function_ids)
+        self._js_functions[func_id] = source
+        return func_id
+
+    def call_js_function(self, func_id, args):
+        """
+        Call a function registered using :meth:`register_js_function`
+        with a list of JSON-serializable arguments. The function is compiled
+        once per page. Return a dict with "result" key or
+        with "error" and "error_repr" keys.
+        """
+        args_text = json.dumps(args, ensure_ascii=False, encoding="utf8")[1:-1]
+        call_script = _CALL_JS_FUNCTION_JS % (args_text, func_id)
+
+        if func_id not in self._registered_js_functions:
+            res = self._register_js_function(func_id)
+            if res["error"]:
+                return res
+        res = self.runjs(call_script)
+
+        if isinstance(res, dict) and res.get("missing"):
+            # page scripts removed the function; compile it again
+            res = self._register_js_function(func_id)
+            if res["error"]:
+                return res
+            res = self.runjs(call_script)
+        return res
+
+    def _register_js_function(self, func_id):
+        func_text = json.dumps([self._js_functions[func_id]], ensure_ascii=False, encoding='utf8')[1:-1]
+        res = self.runjs(_REGISTER_JS_FUNCTION_JS % (func_id, func_text))
+        if not isinstance(res, dict):
+            return {"error": True, "error_repr": "unknown error: %r" % (res,)}
+        if not res["error"]:
+            self._registered_js_functions.add(func_id)
+        return res
 
     def store_har_timing(self, name):
         self.web_page.har_log.store_timing(name)
@@ -670,6 +1074,23 @@ class _SplashHttpClient(QObject):
         reply.deleteLater()
 
 
+class _SelectorWatcher(QObject):
+    """
+    An object exposed to JS; JS code calls its ``found`` method when
+    an element which BrowserTab.wait_for_selector waits for appears.
+    """
+    def __init__(self, parent=None):
+        self.callbacks = {}  # waiter id => callback
+        super(_SelectorWatcher, self).__init__(parent)
+
+    @pyqtSlot(int)
+    def found(self, waiter_id):
+        callback = self.callbacks.pop(waiter_id, None)
+        if callback is not None:
+            # don't run Python callbacks from inside JS code
+            QTimer.singleShot(0, callback)
+
+
 class _JavascriptConsole(QObject):
     def __init__(self, parent=None):
         self.messages = []
@@ -6,6 +6,13 @@ WAIT_TIME = 0.0
 MAX_TIMEOUT = 60.0
 MAX_WAIT_TIME = 10.0
 
+# wait_for=network_idle: how long there should be no active requests
+NETWORK_IDLE_TIME = 0.5
+
+# maximum time to wait for network idle or for a CSS selector
+# when no limit is given
+WAIT_FOR_MAX_TIME = 10.0
+
 # png rendering options
 VIEWPORT = '1024x768'
 VIEWPORT_FALLBACK = VIEWPORT  # do not set it to 'full'
@@ -18,6 +25,19 @@ MAX_HEIGTH = 1080
 
 AUTOLOAD_IMAGES = 1
 
+# resource types which are loaded after all other resources
+DEPRIORITIZED_RESOURCES = ['image', 'media']
+# deprioritized requests wait for more important ones at most this long
+DEPRIORITIZED_MAX_DELAY = 5.0  # seconds
+
+# resource types which are not loaded at all
+BLOCKED_RESOURCES = []
+
+# byte budgets for a single response and for all responses of a render;
+# 0 means "no limit"
+MAX_RESPONSE_SIZE = 0
+MAX_RENDER_BYTES = 0
+
 # defaults for render.json endpoint
 DO_HTML = 0
 DO_IFRAMES = 0
@@ -26,6 +46,8 @@ SHOW_SCRIPT = 0
 SHOW_CONSOLE = 0
 SHOW_HISTORY = 0
 SHOW_HAR = 0
+SHOW_TIMINGS = 0
+SHOW_STATS = 0
 
 # servers
 SPLASH_PORT = 8050
@@ -37,6 +59,11 @@ MANHOLE_PASSWORD = 'admin'
 # pool options
 SLOTS = 50
 
+# limits for outgoing requests shared by all slots; 0 means "no limit"
+MAX_REQUESTS_PER_HOST = 0
+MAX_REQUESTS_PER_PROXY = 0
+HOST_REQUEST_DELAY = 0.0  # seconds between requests to the same host
+
 # disk cache options - don't enable it unless you know what you're doing
 CACHE_ENABLED = False
 CACHE_SIZE = 50  # MB
@@ -46,5 +73,46 @@ CACHE_PATH = '.splash-cache'
 ALLOWED_SCHEMES = ['http', 'https', 'data', 'ftp', 'sftp', 'ws', 'wss']
 JS_CROSS_DOMAIN_ENABLED = False
 
+# number of pre-initialized Lua runtimes kept for /execute endpoint
+LUA_RUNTIME_POOL_SIZE = 2
+
+# number of compiled Lua scripts to keep in memory
+LUA_CHUNK_CACHE_SIZE = 100
+
+# limits for sandboxed Lua scripts; requests can only lower them
+LUA_MAX_INSTRUCTIONS = 1000000
+LUA_MAX_CPU_TIME = None  # seconds; None or 0 means no limit
+
+# maximum number of extra browser tabs a Lua script can open
+LUA_MAX_TABS = 10
+
+# default number of concurrent requests for splash:http_get_many
+HTTP_GET_MANY_CONCURRENCY = 5
+
 # logging
 VERBOSITY = 1
+
+# format of per-request stats log records: 'json', 'text' or 'none'
+STATS_LOG_FORMAT = 'json'
+
+# event loop monitoring: how often to check the loop lag and
+# how long the loop can be blocked before a stack trace is logged, seconds
+EVENT_LOOP_MONITOR_INTERVAL = 0.1
+SLOW_CALLBACK_THRESHOLD = 1.0
+
+# /debug/profile endpoint: default and maximum profiling time, seconds
+PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 300
+
+# per-client render accounting: a request header with a client key
+# (disabled by default) and a maximum number of distinct client keys
+# reported in metrics
+CLIENT_KEY_HEADER = None
+MAX_CLIENT_KEYS = 100
+
+# request throttling metrics are reported for this many hosts and proxies;
+# other hosts and proxies are reported as "other"
+MAX_THROTTLE_METRIC_KEYS = 100
+
+# how often to sample process-wide stats (memory, load, open files), seconds
+PROCESS_STATS_INTERVAL = 5.0
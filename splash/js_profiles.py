@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of JS profiles.
+
+A JS profile is a folder with ``.js`` files which are executed in page
+context before the user's script (``js=<profile>`` argument). Files are
+read and decoded once; they are reloaded only when the profile folder
+or one of its files is modified.
+"""
+from __future__ import absolute_import
+import os
+import time
+
+
+class BadJsProfile(IOError):
+    """ Raised when a file of a JS profile is not valid UTF-8 """
+
+
+class _JsProfile(object):
+    __slots__ = ['scripts', 'mtimes', 'checked_at']
+
+    def __init__(self, scripts, mtimes, checked_at):
+        self.scripts = scripts
+        self.mtimes = mtimes
+        self.checked_at = checked_at
+
+
+class JsProfileCache(object):
+    """
+    A cache of JS profile sources, keyed by profile folder.
+
+    Modification times of a folder and its files are checked at most once
+    per ``check_interval`` seconds, so a typical request doesn't touch
+    the filesystem at all.
+    """
+
+    def __init__(self, check_interval=1.0, clock=time.time):
+        self.check_interval = check_interval
+        self._clock = clock
+        self._profiles = {}  # folder => _JsProfile
+
+    def get_scripts(self, folder):
+        """
+        Return a tuple with source code (unicode) of all ``.js`` files
+        from ``folder``. Raise OSError or IOError if the folder
+        can't be read, and :class:`BadJsProfile` if a file can't
+        be decoded.
+        """
+        now = self._clock()
+        profile = self._profiles.get(folder)
+        if profile is not None and now - profile.checked_at < self.check_interval:
+            return profile.scripts
+
+        try:
+            mtimes = self._get_mtimes(folder)
+            if profile is None or profile.mtimes != mtimes:
+                profile = _JsProfile(self._load(folder, mtimes), mtimes, now)
+                self._profiles[folder] = profile
+        except (IOError, OSError):
+            self._profiles.pop(folder, None)
+            raise
+        profile.checked_at = now
+        return profile.scripts
+
+    def exists(self, folder):
+        """ Return True if ``folder`` is a readable JS profile """
+        try:
+            self.get_scripts(folder)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def clear(self):
+        self._profiles.clear()
+
+    def _get_mtimes(self, folder):
+        mtimes = [(None, os.stat(folder).st_mtime)]
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.js'):
+                mtimes.append((name, os.stat(os.path.join(folder, name)).st_mtime))
+        return tuple(mtimes)
+
+    def _load(self, folder, mtimes):
+        scripts = []
+        for name, mtime in mtimes[1:]:
+            with open(os.path.join(folder, name), 'rb') as f:
+                data = f.read()
+            try:
+                scripts.append(data.decode('utf-8'))
+            except UnicodeDecodeError as e:
+                raise BadJsProfile("%s is not a valid UTF-8 file: %s" % (name, e))
+        return tuple(scripts)
+
+
+js_profile_cache = JsProfileCache()
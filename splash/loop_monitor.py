@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop monitoring.
+
+All render slots share a single event loop, so a single slow callback
+(a large PNG encoding, a huge ``toHtml`` call, a big JSON dump) delays
+all other renders. :class:`EventLoopMonitor` measures how late timers
+are fired and logs stack traces of callbacks which block the loop.
+"""
+from __future__ import absolute_import
+import sys
+import time
+import thread
+import threading
+import traceback
+from collections import deque
+
+from twisted.python import log
+
+from splash import defaults, metrics
+
+
+class EventLoopMonitor(object):
+    """
+    A timer is scheduled every ``interval`` seconds; the difference
+    between the time it is scheduled to and the time it is actually fired
+    is the event loop lag.
+
+    If ``slow_callback_threshold`` is set, a watchdog thread checks
+    that timers are fired; when the loop is blocked for more than
+    ``slow_callback_threshold`` seconds the stack trace of the main
+    thread is captured and logged. The watchdog only reads timestamps
+    most of the time, so the monitor is cheap enough to be always on.
+    """
+
+    def __init__(self, interval=defaults.EVENT_LOOP_MONITOR_INTERVAL,
+                 slow_callback_threshold=defaults.SLOW_CALLBACK_THRESHOLD,
+                 history_size=1000, clock=time.time):
+        self.interval = interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self.lags = deque(maxlen=history_size)
+        self.slow_callbacks = 0
+        self.last_slow_callback = None
+        self._clock = clock
+        self._reactor = None
+        self._call = None
+        self._expected = None
+        self._last_tick = None
+        self._reported_tick = None
+        self._main_thread_id = thread.get_ident()  # the thread with the event loop
+        self._running = False
+
+    def start(self):
+        from twisted.internet import reactor
+        self._reactor = reactor
+        self._running = True
+        self._last_tick = self._clock()
+        self._schedule()
+
+        if self.slow_callback_threshold:
+            watchdog = threading.Thread(target=self._watchdog, name="splash-loop-watchdog")
+            watchdog.daemon = True
+            watchdog.start()
+
+    def stop(self):
+        self._running = False
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def get_stats(self):
+        """ Return a dict with lag percentiles and slow callback info """
+        lags = sorted(self.lags)
+        return {
+            "lag": {
+                "p50": _percentile(lags, 50),
+                "p90": _percentile(lags, 90),
+                "p99": _percentile(lags, 99),
+                "max": lags[-1] if lags else 0.0,
+                "samples": len(lags),
+            },
+            "slow_callbacks": self.slow_callbacks,
+            "last_slow_callback": self.last_slow_callback,
+        }
+
+    def _schedule(self):
+        self._expected = self._clock() + self.interval
+        self._call = self._reactor.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        now = self._clock()
+        lag = max(now - self._expected, 0.0)
+        self.lags.append(lag)
+        metrics.EVENT_LOOP_LAG.observe(lag)
+        self._last_tick = now
+        if self._running:
+            self._schedule()
+
+    def _watchdog(self):
+        while self._running:
+            time.sleep(self.slow_callback_threshold / 2.0)
+            self._check_blocked()
+
+    def _check_blocked(self):
+        """
+        Capture a stack trace of the main thread if the event loop
+        is blocked. Called from the watchdog thread.
+        """
+        last_tick = self._last_tick
+        blocked = self._clock() - last_tick - self.interval
+        if blocked < self.slow_callback_threshold or self._reported_tick == last_tick:
+            return
+        self._reported_tick = last_tick  # report each block only once
+
+        frame = sys._current_frames().get(self._main_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        self.slow_callbacks += 1
+        self.last_slow_callback = {
+            "blocked": blocked,
+            "timestamp": last_tick,
+            "stack": stack,
+        }
+        metrics.SLOW_CALLBACKS.inc()
+        # the message is logged when the event loop is free again
+        self._reactor.callFromThread(
+            log.msg,
+            "Event loop is blocked for more than %.2fs:\n%s" % (blocked, stack),
+            system="loop-monitor",
+        )
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
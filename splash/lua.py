@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import os
+import hashlib
+import binascii
 import functools
 import datetime
+from collections import OrderedDict
 from twisted.python import log
+from splash import defaults
 try:
     import lupa
 except ImportError:
@@ -60,44 +64,144 @@ def get_new_runtime(**kwargs):
     return lua
 
 
-def get_main(lua, script):
+def get_main(lua, script, chunk_cache=None):
     """
     Get "main" function and its global environment from a ``script``.
+    If ``chunk_cache`` (a LuaChunkCache instance) is passed then
+    the script is compiled only if it is not in cache already.
     """
-    main = _get_entrypoint(lua, script)
+    if chunk_cache is None:
+        main = _get_entrypoint(lua, script)
+    else:
+        chunk = chunk_cache.get(lua, script, sandboxed=False)
+        func = _load_chunk(lua, chunk, "<python>", "b")
+        func()
+        main = lua.globals()["main"]
     _check_main(main)
     return main, lua.eval("_G")
 
 
-def get_main_sandboxed(lua, script):
+def get_main_sandboxed(lua, script, chunk_cache=None):
     """
     Get "main" function and its (sandboxed) global environment
     from a ``script``.
+    If ``chunk_cache`` (a LuaChunkCache instance) is passed then
+    the script is compiled only if it is not in cache already.
     """
-    env = _execute_in_sandbox(lua, script)
+    if chunk_cache is None:
+        env = _execute_in_sandbox(lua, script)
+    else:
+        chunk = chunk_cache.get(lua, script, sandboxed=True)
+        env = _execute_in_sandbox(lua, chunk, mode="b")
     main = env["main"]
     _check_main(main)
     return main, env
 
 
-def _execute_in_sandbox(lua, script):
+def _execute_in_sandbox(lua, script, mode="t"):
     """
     Execute ``script`` in ``lua`` runtime using ``sandbox``.
     Return a (sandboxed) global environment for the executed script.
+    ``mode`` is "t" for source code and "b" for precompiled chunks.
 
     "sandbox" module should be importable in the environment.
-    It should provide ``sandbox.run(untrusted_code)`` method and
+    It should provide ``sandbox.run(untrusted_code, mode)`` method and
     ``sandbox.env`` table with a global environment.
     See ``splash/lua_modules/sandbox.lua``.
     """
     sandbox = lua.eval("require('sandbox')")
-    result = sandbox.run(script)
+    result = sandbox.run(script, mode)
     if result is not True:
         ok, res = result
         raise lupa.LuaError(res)
     return sandbox.env
 
 
+def _load_chunk(lua, chunk, chunkname, mode):
+    """
+    Load Lua source code or a precompiled chunk using Lua ``load`` function;
+    return the resulting Lua function.
+    """
+    result = lua.globals()["load"](chunk, chunkname, mode)
+    if isinstance(result, tuple):
+        func, message = result
+        raise lupa.LuaSyntaxError(message)
+    return result
+
+
+class LuaChunkCache(object):
+    """
+    LRU cache of compiled Lua scripts.
+
+    Scripts are compiled to Lua bytecode (using ``string.dump``) which can
+    be loaded into any Lua runtime, so only scripts which are seen
+    for the first time are parsed and compiled.
+
+    Sandboxed and non-sandboxed scripts are cached separately because
+    they are compiled with different chunk names.
+    """
+
+    # Lupa decodes Lua strings returned to Python, so bytecode
+    # is hex-encoded before leaving Lua.
+    _DUMP_HEX = """
+    local hex = {}
+    for i = 0, 255 do
+      hex[string.char(i)] = string.format("%02x", i)
+    end
+    return function(func)
+      return (string.gsub(string.dump(func), ".", hex))
+    end
+    """
+
+    def __init__(self, max_size=defaults.LUA_CHUNK_CACHE_SIZE):
+        self.max_size = max_size
+        self._chunks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, lua, script, sandboxed):
+        """
+        Return a precompiled chunk for ``script``;
+        compile it using ``lua`` runtime if it is not cached yet.
+        """
+        if isinstance(script, unicode):
+            script = script.encode('utf8')
+        key = (hashlib.sha1(script).hexdigest(), sandboxed)
+
+        chunk = self._chunks.pop(key, None)
+        if chunk is not None:
+            self.hits += 1
+            self._chunks[key] = chunk  # most recently used chunks go last
+            return chunk
+
+        self.misses += 1
+        chunk = self._compile(lua, script, sandboxed)
+        if self.max_size > 0:
+            if len(self._chunks) >= self.max_size:
+                self._chunks.popitem(last=False)
+                self.evictions += 1
+            self._chunks[key] = chunk
+        return chunk
+
+    def get_stats(self):
+        return {
+            "size": len(self._chunks),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _compile(self, lua, script, sandboxed):
+        # Chunk names are the same as chunk names of scripts executed
+        # without cache, to keep error messages the same.
+        chunkname = None if sandboxed else "<python>"
+        func = _load_chunk(lua, script, chunkname, "t")
+        dump_hex = lua.execute(self._DUMP_HEX)
+        return binascii.unhexlify(dump_hex(func))
+
+
 def _get_entrypoint(lua, script):
     """
     Execute a script and return its "main" function.
@@ -118,118 +222,163 @@ def _check_main(main):
         raise ValueError("'main' is not a function")
 
 
-def lua2python(lua, obj, binary=True, strict=True, max_depth=100, sparse_limit=10):
-    """ Recursively convert Lua data to Python objects """
-
-    def l2p(obj, depth):
-        if depth <= 0:
-            raise ValueError("Can't convert Lua object to Python: depth limit is reached")
-
-        if isinstance(obj, dict):
-            return {
-                l2p(key, depth-1): l2p(value, depth-1)
-                for key, value in obj.iteritems()
-            }
-
-        if isinstance(obj, list):
-            return [l2p(el, depth-1) for el in obj]
-
-        if isinstance(obj, tuple):
-            return tuple([l2p(el, depth-1) for el in obj])
-
-        if isinstance(obj, set):
-            return {l2p(el, depth-1) for el in obj}
-
-        if lupa.lua_type(obj) == 'table':
-            if _is_table_a_list(lua, obj):
-                res = []
-                prev_key = 0
-                for key, value in obj.items():
-                    if not isinstance(key, int):
-                        raise ValueError("Can't build a Python list from Lua table: invalid key %r" % key)
-                    if key <= prev_key:
-                        raise ValueError("Can't build a Python list from Lua table: bad index %s" % key)
-
-                    filler_size = key - prev_key - 1
-                    if filler_size > sparse_limit:
-                        raise ValueError("Lua table is too sparse. Try not to use nil values.")
-                    res.extend([None] * filler_size)
-                    res.append(l2p(value, depth-1))
-                    prev_key = key
-                return res
-            else:
-                return {
-                    l2p(key, depth-1): l2p(value, depth-1)
-                    for key, value in obj.items()
-                }
+class LuaConverter(object):
+    """
+    Lua <-> Python data converter bound to a Lua runtime.
+
+    Lua helper functions (getmetatable, setmetatable) and a metatable
+    used to mark list tables are looked up once, so create a single
+    converter per runtime and reuse it.
+    """
+    _SCALAR_TYPES = (bool, int, long, float, str)
+
+    def __init__(self, lua):
+        self.lua = lua
+        _globals = lua.globals()
+        self._getmetatable = _globals["getmetatable"]
+        self._setmetatable = _globals["setmetatable"]
+        self._list_metatable = lua.table(__metatable="list")
 
-        if strict and lupa.lua_type(obj) is not None:
-            raise ValueError(
-                "Lua %s objects are not allowed." % lupa.lua_type(obj)
-            )
+    def lua2python(self, obj, binary=True, strict=True, max_depth=100, sparse_limit=10):
+        """ Recursively convert Lua data to Python objects """
+        scalar_types = self._SCALAR_TYPES
+        getmetatable = self._getmetatable
+        lua_type = lupa.lua_type
 
-        if binary and isinstance(obj, unicode):
-            obj = obj.encode('utf8')
+        def l2p(obj, depth):
+            if depth <= 0:
+                raise ValueError("Can't convert Lua object to Python: depth limit is reached")
 
-        return obj
+            if obj is None or isinstance(obj, scalar_types):
+                return obj
 
-    return l2p(obj, depth=max_depth)
+            if isinstance(obj, unicode):
+                return obj.encode('utf8') if binary else obj
 
+            if isinstance(obj, dict):
+                return {
+                    l2p(key, depth-1): l2p(value, depth-1)
+                    for key, value in obj.iteritems()
+                }
 
-def _mark_table_as_list(lua, tbl):
-    mt = lua.table(__metatable="list")
-    lua.eval("setmetatable")(tbl, mt)
-    return tbl
+            if isinstance(obj, list):
+                return [l2p(el, depth-1) for el in obj]
+
+            if isinstance(obj, tuple):
+                return tuple([l2p(el, depth-1) for el in obj])
+
+            if isinstance(obj, set):
+                return {l2p(el, depth-1) for el in obj}
+
+            obj_type = lua_type(obj)
+            if obj_type == 'table':
+                if getmetatable(obj) == "list":
+                    res = []
+                    prev_key = 0
+                    for key, value in obj.items():
+                        if not isinstance(key, int):
+                            raise ValueError("Can't build a Python list from Lua table: invalid key %r" % key)
+                        if key <= prev_key:
+                            raise ValueError("Can't build a Python list from Lua table: bad index %s" % key)
+
+                        filler_size = key - prev_key - 1
+                        if filler_size > sparse_limit:
+                            raise ValueError("Lua table is too sparse. Try not to use nil values.")
+                        if filler_size:
+                            res.extend([None] * filler_size)
+                        res.append(l2p(value, depth-1))
+                        prev_key = key
+                    return res
+                else:
+                    return {
+                        l2p(key, depth-1): l2p(value, depth-1)
+                        for key, value in obj.items()
+                    }
+
+            if strict and obj_type is not None:
+                raise ValueError("Lua %s objects are not allowed." % obj_type)
+
+            return obj
+
+        return l2p(obj, depth=max_depth)
+
+    def python2lua(self, obj, max_depth=100):
+        """
+        Recursively convert Python object to a Lua data structure.
+        Parts that can't be converted to Lua types are passed as-is.
+
+        For Lua runtimes with restrictive attribute filters it means such values
+        are passed as "capsules" which Lua code can send back to Python as-is, but
+        can't access otherwise.
+        """
+        scalar_types = self._SCALAR_TYPES
+        table_from = self.lua.table_from
+        setmetatable = self._setmetatable
+        list_metatable = self._list_metatable
+
+        def p2l(obj, depth):
+            if depth <= 0:
+                raise ValueError("Can't convert Python object to Lua: depth limit is reached")
+
+            if obj is None or isinstance(obj, scalar_types):
+                return obj
+
+            if isinstance(obj, unicode):
+                # lupa encodes/decodes strings automatically,
+                # but this doesn't apply to nested table keys.
+                return obj.encode('utf8')
+
+            if isinstance(obj, dict):
+                return table_from({
+                    p2l(key, depth-1): p2l(value, depth-1)
+                    for key, value in obj.iteritems()
+                })
+
+            if isinstance(obj, list):
+                tbl = table_from([p2l(el, depth-1) for el in obj])
+                setmetatable(tbl, list_metatable)
+                return tbl
+
+            if isinstance(obj, datetime.datetime):
+                return obj.isoformat() + 'Z'
+                # XXX: maybe return datetime encoded to Lua standard? E.g.:
+
+                # tm = obj.timetuple()
+                # return python2lua(lua, {
+                #     '_jstype': 'Date',
+                #     'year': tm.tm_year,
+                #     'month': tm.tm_mon,
+                #     'day': tm.tm_mday,
+                #     'yday': tm.tm_yday,
+                #     'wday': tm.tm_wday,  # fixme: in Lua Sunday is 1, in Python Monday is 0
+                #     'hour': tm.tm_hour,
+                #     'min': tm.tm_min,
+                #     'sec': tm.tm_sec,
+                #     'isdst': tm.tm_isdst,  # fixme: isdst can be -1 in Python
+                # }, max_depth)
+
+            return obj
+
+        return p2l(obj, depth=max_depth)
 
 
-def _is_table_a_list(lua, tbl):
-    mt = lua.eval("getmetatable")(tbl)
-    return mt == "list"
+def lua2python(lua, obj, binary=True, strict=True, max_depth=100, sparse_limit=10):
+    """
+    Recursively convert Lua data to Python objects.
+    Use :class:`LuaConverter` to convert many objects for the same runtime.
+    """
+    return LuaConverter(lua).lua2python(
+        obj,
+        binary=binary,
+        strict=strict,
+        max_depth=max_depth,
+        sparse_limit=sparse_limit
+    )
 
 
 def python2lua(lua, obj, max_depth=100):
     """
     Recursively convert Python object to a Lua data structure.
-    Parts that can't be converted to Lua types are passed as-is.
-
-    For Lua runtimes with restrictive attribute filters it means such values
-    are passed as "capsules" which Lua code can send back to Python as-is, but
-    can't access otherwise.
-    """
-    if max_depth <= 0:
-        raise ValueError("Can't convert Python object to Lua: depth limit is reached")
-
-    if isinstance(obj, dict):
-        return lua.table_from({
-            python2lua(lua, key, max_depth-1): python2lua(lua, value, max_depth-1)
-            for key, value in obj.iteritems()
-        })
-
-    if isinstance(obj, list):
-        tbl = lua.table_from([python2lua(lua, el, max_depth-1) for el in obj])
-        return _mark_table_as_list(lua, tbl)
-
-    if isinstance(obj, unicode):
-        # lupa encodes/decodes strings automatically,
-        # but this doesn't apply to nested table keys.
-        return obj.encode('utf8')
-
-    if isinstance(obj, datetime.datetime):
-        return obj.isoformat() + 'Z'
-        # XXX: maybe return datetime encoded to Lua standard? E.g.:
-
-        # tm = obj.timetuple()
-        # return python2lua(lua, {
-        #     '_jstype': 'Date',
-        #     'year': tm.tm_year,
-        #     'month': tm.tm_mon,
-        #     'day': tm.tm_mday,
-        #     'yday': tm.tm_yday,
-        #     'wday': tm.tm_wday,  # fixme: in Lua Sunday is 1, in Python Monday is 0
-        #     'hour': tm.tm_hour,
-        #     'min': tm.tm_min,
-        #     'sec': tm.tm_sec,
-        #     'isdst': tm.tm_isdst,  # fixme: isdst can be -1 in Python
-        # }, max_depth)
-
-    return obj
+    Use :class:`LuaConverter` to convert many objects for the same runtime.
+    """
+    return LuaConverter(lua).python2lua(obj, max_depth=max_depth)
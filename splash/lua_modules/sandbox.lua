@@ -187,14 +187,60 @@ end
 sandbox.instruction_limit = 1e6
 sandbox.instruction_count = 0
 
+-- The debug hook is called once per this number of instructions;
+-- calling it for every instruction makes all Lua code several times slower.
+-- Because of that instruction_count is only updated in steps of
+-- instruction_hook_step: it is a number of instructions rounded down,
+-- and the limit is checked with this precision.
+sandbox.instruction_hook_step = 1000
+
+-- Maximum CPU time (in seconds) Lua code can use; nil means "no limit".
+-- Only the time when Lua code is running is counted:
+-- Python code calls sandbox.start_cpu_timer / sandbox.stop_cpu_timer
+-- when a script is resumed / suspended and when Lua calls a Python command.
+sandbox.cpu_time_limit = nil
+sandbox.cpu_time_used = 0
+sandbox._cpu_timer_started = nil
+
+function sandbox.start_cpu_timer()
+  sandbox._cpu_timer_started = os.clock()
+end
+
+-- Stop the timer; return true if it was running.
+function sandbox.stop_cpu_timer()
+  if sandbox._cpu_timer_started == nil then
+    return false
+  end
+  sandbox.cpu_time_used = sandbox.cpu_time_used + (os.clock() - sandbox._cpu_timer_started)
+  sandbox._cpu_timer_started = nil
+  return true
+end
+
+local function _cpu_time_used()
+  if sandbox._cpu_timer_started == nil then
+    return sandbox.cpu_time_used
+  end
+  return sandbox.cpu_time_used + (os.clock() - sandbox._cpu_timer_started)
+end
+
 function sandbox.enable_instruction_limit()
+  local step = sandbox.instruction_hook_step
   local function _debug_step(event, line)
-    sandbox.instruction_count = sandbox.instruction_count + 1
+    sandbox.instruction_count = sandbox.instruction_count + step
     if sandbox.instruction_count > sandbox.instruction_limit then
-      error("script uses too much CPU", 2)
+      error(string.format(
+        "script uses too much CPU: more than %d instructions executed",
+        sandbox.instruction_limit
+      ), 2)
+    end
+    if sandbox.cpu_time_limit ~= nil and _cpu_time_used() > sandbox.cpu_time_limit then
+      error(string.format(
+        "script uses too much CPU: more than %gs of CPU time used",
+        sandbox.cpu_time_limit
+      ), 2)
     end
   end
-  debug.sethook(_debug_step, '', 1)
+  debug.sethook(_debug_step, '', step)
 end
 
 
@@ -217,13 +263,19 @@ end
 -- call the runtime becomes restricted in CPU and memory, and
 -- "string":methods() like "foo":upper() stop working.
 --
-function sandbox.run(untrusted_code)
+-- `mode` is "t" (default) for source code and "b" for chunks precompiled
+-- by Splash; it must never be "b" for chunks received from users.
+--
+function sandbox.run(untrusted_code, mode)
   sandbox.fix_metatables()
   sandbox.enable_instruction_limit()
   sandbox.enable_memory_limit()
-  local untrusted_function, message = load(untrusted_code, nil, 't', sandbox.env)
+  local untrusted_function, message = load(untrusted_code, nil, mode or 't', sandbox.env)
   if not untrusted_function then return nil, message end
-  return pcall(untrusted_function)
+  sandbox.start_cpu_timer()
+  local result = table.pack(pcall(untrusted_function))
+  sandbox.stop_cpu_timer()
+  return table.unpack(result, 1, result.n)
 end
 
 return sandbox
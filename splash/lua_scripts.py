@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Named Lua scripts stored on the server.
+
+Scripts are loaded from ``--lua-scripts-path`` folder at startup
+(``<name>.lua`` files) and can be registered later using ``/scripts``
+endpoint. Scripts are compiled when they are loaded, so syntax errors
+are detected before the first request, and a compiled version is used
+by ``/execute?script=<name>``.
+"""
+from __future__ import absolute_import
+import os
+import re
+import codecs
+
+from twisted.python import log
+
+from splash.lua import get_new_runtime, LuaChunkCache
+from splash.render_options import BadOption
+
+
+class LuaScriptExists(BadOption):
+    """ Raised when a script with the same name is already registered """
+
+
+class LuaScriptRegistry(object):
+    """ A collection of named Lua scripts """
+
+    NAME_RE = re.compile(r"^[\w-]+\Z")
+
+    def __init__(self, path, sandboxed, max_size=1000):
+        self.path = path
+        self.sandboxed = sandboxed
+        self.max_size = max_size
+        self.chunk_cache = LuaChunkCache(max_size=max_size)
+        self._scripts = {}  # name => source
+
+    def load(self):
+        """ Load all scripts from the folder """
+        for filename in sorted(os.listdir(self.path)):
+            name, ext = os.path.splitext(filename)
+            if ext != '.lua' or not self.NAME_RE.match(name):
+                continue
+            with codecs.open(os.path.join(self.path, filename), 'r', 'utf8') as f:
+                source = f.read().encode('utf8')
+            try:
+                self._add(name, source)
+            except BadOption as e:
+                log.msg("WARNING: Lua script %r is not loaded: %s" % (filename, e))
+        log.msg("Lua scripts loaded: %s" % ", ".join(self.names()))
+
+    def names(self):
+        return sorted(self._scripts.keys())
+
+    def get(self, name):
+        """ Return source code of a script """
+        if name not in self._scripts:
+            raise BadOption("Lua script %r is not found" % name)
+        return self._scripts[name]
+
+    def register(self, name, source, overwrite=False):
+        """
+        Compile a script and save it to the folder. An existing script
+        is replaced only if ``overwrite`` is True.
+        """
+        if isinstance(source, unicode):
+            source = source.encode('utf8')
+        self._check(name, source)
+        if name in self._scripts and not overwrite:
+            raise LuaScriptExists("Lua script %r already exists" % name)
+
+        # the file is written first: a script registered in memory
+        # but not saved would be lost on restart
+        filename = os.path.join(self.path, name + '.lua')
+        tmp_filename = filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as f:
+                f.write(source)
+            os.rename(tmp_filename, filename)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        self._scripts[name] = source
+
+    def _check(self, name, source):
+        if not self.NAME_RE.match(name):
+            raise BadOption("Invalid Lua script name: %r" % name)
+        if name not in self._scripts and len(self._scripts) >= self.max_size:
+            raise BadOption("Too many Lua scripts")
+        try:
+            self.chunk_cache.get(get_new_runtime(), source, self.sandboxed)
+        except Exception as e:
+            raise BadOption("Lua script %r can't be compiled: %s" % (name, e))
+
+    def _add(self, name, source):
+        self._check(name, source)
+        self._scripts[name] = source
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics exposed at ``/metrics`` endpoint in Prometheus
+text format.
+
+Metrics are aggregated in memory when events happen (a render is
+finished, a response is received, etc.); ``/metrics`` only formats
+the current values, so it is cheap to scrape it often.
+"""
+from __future__ import absolute_import
+import bisect
+
+from splash import defaults
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple => value
+
+    def _check_labels(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s: expected labels %r, got %r" % (
+                self.name, self.labelnames, labels))
+
+    def clear(self):
+        self._values.clear()
+
+    def get(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def samples(self):
+        """ Return a list of (suffix, labels dict, value) tuples """
+        return [
+            ('', dict(zip(self.labelnames, labels)), value)
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Counter(_Metric):
+    """ A value which only goes up """
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        labels = tuple(labels)
+        if labels not in self._values:
+            self._check_labels(labels)
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels=(), value=0):
+        """ Set a value of a counter which is maintained elsewhere """
+        self._check_labels(labels)
+        self._values[tuple(labels)] = value
+
+
+class Gauge(_Metric):
+    """ A value which can go up and down """
+    type = 'gauge'
+
+    def set(self, labels=(), value=0):
+        self._check_labels(labels)
+        self._values[tuple(labels)] = value
+
+
+class Histogram(_Metric):
+    """ A distribution of observed values, with cumulative buckets """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=()):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        labels = tuple(labels)
+        data = self._values.get(labels)
+        if data is None:
+            self._check_labels(labels)
+            # [counts per bucket (the last one is +Inf), sum]
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def get(self, labels=()):
+        """ Return (count, sum) tuple """
+        data = self._values.get(tuple(labels))
+        if data is None:
+            return 0, 0.0
+        return sum(data[0]), data[1]
+
+    def samples(self):
+        samples = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(float(bound)))
+                samples.append(('_bucket', bucket_labels, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry(object):
+    """ A collection of metrics which can be rendered together """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=()):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Return all metrics in Prometheus text format """
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP %s %s" % (metric.name, _escape(metric.help)))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append("%s%s%s %s" % (
+                    metric.name, suffix, _format_labels(labels), _format_value(value)
+                ))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(text, quotes=False):
+    text = text.replace('\\', r'\\').replace('\n', r'\n')
+    if quotes:
+        text = text.replace('"', r'\"')
+    return text
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, _escape(unicode(value).encode('utf8'), quotes=True))
+        for name, value in sorted(labels.items())
+    )
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, (int, long)):
+        return str(value)
+    return repr(float(value))
+
+
+TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(10))  # 1KB ... 256MB
+INSTRUCTION_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+registry = MetricsRegistry()
+
+RENDER_TIME = registry.histogram(
+    'splash_render_duration_seconds',
+    'Time spent processing render requests, including queue wait time.',
+    ['endpoint', 'outcome'], TIME_BUCKETS)
+QUEUE_WAIT_TIME = registry.histogram(
+    'splash_queue_wait_seconds',
+    'Time render requests spent waiting for a free slot.',
+    buckets=TIME_BUCKETS)
+SLOTS = registry.gauge(
+    'splash_slots', 'Number of render slots.')
+ACTIVE_SLOTS = registry.gauge(
+    'splash_active_slots', 'Number of render slots which are busy.')
+QUEUE_DEPTH = registry.gauge(
+    'splash_queue_depth', 'Number of render requests waiting for a slot.')
+RENDER_NETWORK_REQUESTS = registry.histogram(
+    'splash_render_network_requests',
+    'Number of network requests sent by a render.',
+    buckets=COUNT_BUCKETS)
+RENDER_NETWORK_BYTES = registry.histogram(
+    'splash_render_network_bytes',
+    'Number of bytes downloaded by a render.',
+    buckets=BYTES_BUCKETS)
+LUA_INSTRUCTIONS = registry.histogram(
+    'splash_lua_instructions',
+    'Number of Lua instructions executed by a sandboxed script.',
+    buckets=INSTRUCTION_BUCKETS)
+NETWORK_RESPONSES = registry.counter(
+    'splash_network_responses_total',
+    'Number of network responses received, by HTTP cache usage.',
+    ['cache'])
+CACHE_REQUESTS = registry.counter(
+    'splash_cache_requests_total',
+    'Number of lookups in internal caches.',
+    ['cache', 'result'])
+EVENT_LOOP_LAG = registry.histogram(
+    'splash_event_loop_lag_seconds',
+    'Delay of timer callbacks caused by a busy event loop.',
+    buckets=LAG_BUCKETS)
+INSTANCES = registry.gauge(
+    'splash_instances',
+    'Number of live instances of tracked classes.',
+    ['class'])
+SLOW_CALLBACKS = registry.counter(
+    'splash_slow_callbacks_total',
+    'Number of times the event loop was blocked for longer than '
+    'the slow callback threshold.')
+THROTTLE_QUEUE_WAIT_TIME = registry.histogram(
+    'splash_throttle_queue_wait_seconds',
+    'Time network requests spent waiting for per-host or per-proxy limits.',
+    ['kind', 'key'], TIME_BUCKETS)
+
+
+CLIENT_RENDERS = registry.counter(
+    'splash_client_renders_total',
+    'Number of renders, by client key.',
+    ['client'])
+CLIENT_RENDER_TIME = registry.counter(
+    'splash_client_render_seconds_total',
+    'Wall time of renders, by client key.',
+    ['client'])
+CLIENT_JS_TIME = registry.counter(
+    'splash_client_js_seconds_total',
+    'Time spent evaluating JavaScript, by client key.',
+    ['client'])
+CLIENT_NETWORK_REQUESTS = registry.counter(
+    'splash_client_network_requests_total',
+    'Number of network requests sent by renders, by client key.',
+    ['client'])
+CLIENT_NETWORK_BYTES = registry.counter(
+    'splash_client_network_bytes_total',
+    'Number of bytes downloaded by renders, by client key.',
+    ['client'])
+CLIENT_BLOCKED_REQUESTS = registry.counter(
+    'splash_client_blocked_requests_total',
+    'Number of network requests blocked by filters, by client key.',
+    ['client'])
+CLIENT_LUA_INSTRUCTIONS = registry.counter(
+    'splash_client_lua_instructions_total',
+    'Number of Lua instructions executed by sandboxed scripts, by client key.',
+    ['client'])
+
+# client keys which have their own label values; renders of other clients
+# are counted as "other" to keep the number of time series bounded
+_client_keys = set()
+
+# the same for hosts and proxies in request throttling metrics
+_throttle_keys = set()
+
+
+def _bounded_label(value, known_values, max_values):
+    if value in known_values:
+        return value
+    if len(known_values) >= max_values:
+        return 'other'
+    known_values.add(value)
+    return value
+
+
+def _client_label(client_key, max_client_keys):
+    return _bounded_label(client_key, _client_keys, max_client_keys)
+
+
+def observe_throttle_wait(key, wait_time,
+                          max_keys=defaults.MAX_THROTTLE_METRIC_KEYS):
+    """
+    Record a time a network request spent waiting in
+    :class:`splash.request_throttling.RequestThrottler` queue.
+    ``key`` is a ``(kind, value)`` tuple, e.g. ``('host', 'example.com')``.
+    """
+    kind, value = key
+    label = _bounded_label(key, _throttle_keys, max_keys)
+    if label == 'other':
+        value = 'other'
+    THROTTLE_QUEUE_WAIT_TIME.observe(wait_time, [kind, value])
+
+
+def observe_render_stats(stats, client_key=None,
+                         max_client_keys=defaults.MAX_CLIENT_KEYS):
+    """
+    Record per-render statistics returned by
+    :meth:`splash.qtrender.RenderScript.get_stats`. If ``client_key``
+    is not None the statistics are also aggregated per client.
+    """
+    RENDER_NETWORK_REQUESTS.observe(stats['network_requests'])
+    RENDER_NETWORK_BYTES.observe(stats['network_bytes'])
+    lua_instructions = stats.get('lua_instructions')
+    if lua_instructions is not None:
+        LUA_INSTRUCTIONS.observe(lua_instructions)
+
+    if client_key is None:
+        return
+    labels = [_client_label(client_key, max_client_keys)]
+    CLIENT_RENDERS.inc(labels)
+    CLIENT_RENDER_TIME.inc(labels, stats['wall_time'])
+    CLIENT_JS_TIME.inc(labels, stats['js_time'])
+    CLIENT_NETWORK_REQUESTS.inc(labels, stats['network_requests'])
+    CLIENT_NETWORK_BYTES.inc(labels, stats['network_bytes'])
+    CLIENT_BLOCKED_REQUESTS.inc(labels, stats['blocked_requests'])
+    if lua_instructions is not None:
+        CLIENT_LUA_INSTRUCTIONS.inc(labels, lua_instructions)
@@ -1,27 +1,43 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import time
 from datetime import datetime
 from contextlib import contextmanager
 
+import sip
+from PyQt4.QtCore import QIODevice, pyqtSignal
 from PyQt4.QtNetwork import (
     QNetworkAccessManager,
+    QNetworkProxy,
     QNetworkProxyQuery,
+    QNetworkReply,
     QNetworkRequest,
     QNetworkCookieJar
 )
 from PyQt4.QtWebKit import QWebFrame
 from twisted.python import log
 
-from splash.qtutils import qurl2ascii, OPERATION_NAMES, REQUEST_ERRORS
-from splash import har
+from splash.qtutils import (
+    qurl2ascii,
+    get_content_type_resource_type,
+    get_request_webpage,
+    is_navigation_request,
+    OPERATION_NAMES,
+    REQUEST_ERRORS,
+)
+from splash import har, metrics
 from splash.har import qt as har_qt
 from splash.request_middleware import (
     AdblockMiddleware,
     AllowedDomainsMiddleware,
     AllowedSchemesMiddleware,
     RequestLoggingMiddleware,
+    ResourceTypeMiddleware,
+    ResourcePriorityMiddleware,
     AdblockRulesRegistry,
 )
+from splash.request_throttling import RequestThrottler, DeprioritizedRequests
+from splash.utils import instance_counter
 
 
 class ProxiedQNetworkAccessManager(QNetworkAccessManager):
@@ -41,19 +57,27 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
     REQUEST_FINISHED = "finished"
     REQUEST_HEADERS_RECEIVED = "headers"
 
-    def __init__(self, verbosity):
+    def __init__(self, verbosity, throttler=None):
         super(ProxiedQNetworkAccessManager, self).__init__()
         self.sslErrors.connect(self._sslErrors)
         self.finished.connect(self._finished)
         self.verbosity = verbosity
         self._next_id = 0
 
+        if throttler is not None and not throttler.is_enabled():
+            throttler = None
+        self.throttler = throttler
+
         assert self.proxyFactory() is None, "Standard QNetworkProxyFactory is not supported"
 
     def _sslErrors(self, reply, errors):
         reply.ignoreSslErrors()
 
     def _finished(self, reply):
+        if isinstance(reply.parent(), _DelayedNetworkReply):
+            # A placeholder may still read data from this reply;
+            # the reply is deleted together with the placeholder.
+            return
         reply.deleteLater()
 
     def createRequest(self, operation, request, outgoingData=None):
@@ -112,30 +136,169 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
                 "time": 0,
             })
 
-        with self._proxyApplied(request):
-            reply = super(ProxiedQNetworkAccessManager, self).createRequest(
+        proxy = self._getProxy(request)
+        deprioritized = self._getDeprioritizedRequests(request)
+        if deprioritized is not None and outgoingData is None and \
+                request.priority() == QNetworkRequest.LowPriority and \
+                deprioritized.should_wait():
+            reply = self._createDeprioritizedReply(operation, request, proxy, deprioritized)
+        else:
+            reply = self._startRequest(operation, request, proxy, outgoingData)
+
+        if har_entry is not None:
+            har_entry["response"].update(har_qt.reply2har(reply))
+
+        instance_counter.track_qobject(reply, "QNetworkReply")
+        reply.error.connect(self._handleError)
+        reply.finished.connect(self._handleFinished)
+        reply.metaDataChanged.connect(self._handleMetaData)
+        reply.downloadProgress.connect(self._handleDownloadProgress)
+
+        web_page = get_request_webpage(request)
+        if web_page is not None:
+            web_page.on_request_started(self._getRequestId(request))
+
+        return reply
+
+    def _startRequest(self, operation, request, proxy, outgoingData=None):
+        """ Send a request, applying per-host and per-proxy limits """
+        throttling_keys = self._getThrottlingKeys(request, proxy, outgoingData)
+        if throttling_keys:
+            reply = self._createThrottledReply(operation, request, proxy, throttling_keys)
+        else:
+            reply = self._createReply(operation, request, proxy, outgoingData)
+
+        deprioritized = self._getDeprioritizedRequests(request)
+        if deprioritized is not None and request.priority() == QNetworkRequest.HighPriority:
+            deprioritized.started()
+            state = {'finished': False}
+
+            def finished(*args):
+                if not state['finished']:
+                    state['finished'] = True
+                    deprioritized.finished()
+
+            reply.finished.connect(finished)
+            reply.destroyed.connect(finished)
+        return reply
+
+    def _getDeprioritizedRequests(self, request):
+        """
+        Return a DeprioritizedRequests object of the web page the request
+        is made for, or None if the page doesn't deprioritize anything.
+        """
+        web_page = get_request_webpage(request)
+        if web_page is None or not getattr(web_page, 'deprioritized_resources', None):
+            return None
+        if web_page.deprioritized_requests is None:
+            web_page.deprioritized_requests = DeprioritizedRequests()
+        return web_page.deprioritized_requests
+
+    def _createDeprioritizedReply(self, operation, request, proxy, deprioritized):
+        """
+        Return a placeholder reply for a low-priority request; the request
+        is sent when high-priority requests of the page are finished.
+        """
+        delayed_reply = _DelayedNetworkReply(operation, request, parent=self)
+        created_time = time.time()
+
+        def start():
+            if sip.isdeleted(delayed_reply) or delayed_reply.isFinished():
+                return
+            wait_time = time.time() - created_time
+            self.log("Deprioritized request to {url} waited %0.3fs" % wait_time,
+                     request, min_level=3)
+            har_entry = self._harEntry(request)
+            if har_entry is not None:
+                har_entry["timings"]["blocked"] = int(wait_time * 1000)
+            delayed_reply.attach(self._startRequest(operation, request, proxy))
+
+        self.log("Request to {url} is deprioritized", request, min_level=3)
+        deprioritized.add(start)
+        delayed_reply.cancelled.connect(lambda: deprioritized.remove(start))
+        return delayed_reply
+
+    def _createReply(self, operation, request, proxy, outgoingData=None):
+        with self._proxyApplied(proxy):
+            return super(ProxiedQNetworkAccessManager, self).createRequest(
                 operation, request, outgoingData
             )
-            if har_entry is not None:
-                har_entry["response"].update(har_qt.reply2har(reply))
 
-            reply.error.connect(self._handleError)
-            reply.finished.connect(self._handleFinished)
-            reply.metaDataChanged.connect(self._handleMetaData)
-            reply.downloadProgress.connect(self._handleDownloadProgress)
+    def _createThrottledReply(self, operation, request, proxy, keys):
+        """
+        Return a reply for a request which is subject to per-host and
+        per-proxy limits. If the request can't be sent immediately
+        a placeholder reply is returned; it starts forwarding data
+        when the request leaves the queue.
+        """
+        state = {'released': False}
 
-        return reply
+        def release(*args):
+            if not state['released']:
+                state['released'] = True
+                self.throttler.release(keys)
 
-    @contextmanager
-    def _proxyApplied(self, request):
+        def start(wait_time):
+            delayed_reply = state.get('delayed_reply')
+            if delayed_reply is not None and sip.isdeleted(delayed_reply):
+                release()
+                return
+
+            reply = self._createReply(operation, request, proxy)
+            reply.finished.connect(release)
+            reply.destroyed.connect(release)
+            state['reply'] = reply
+
+            if delayed_reply is not None:
+                self.log("Request to {url} waited %0.3fs in queue" % wait_time, reply, min_level=3)
+                har_entry = self._harEntry(request)
+                if har_entry is not None:
+                    har_entry["timings"]["blocked"] = int(wait_time * 1000)
+                delayed_reply.attach(reply)
+
+        waiter = self.throttler.acquire(keys, start)
+        if 'reply' in state:  # request is started immediately
+            return state['reply']
+
+        self.log("Request to {url} is queued", request, min_level=3)
+        delayed_reply = _DelayedNetworkReply(operation, request, parent=self)
+        delayed_reply.cancelled.connect(lambda: self.throttler.cancel(waiter))
+        state['delayed_reply'] = delayed_reply
+        return delayed_reply
+
+    def _getThrottlingKeys(self, request, proxy, outgoingData):
         """
-        This context manager temporary sets a proxy based on request options.
+        Return a list of throttling keys for the request or None if
+        the request shouldn't be throttled. Requests with a body are
+        not throttled because WebKit may discard the body device while
+        the request is waiting in queue.
         """
-        old_proxy = self.proxy()
+        if self.throttler is None or outgoingData is not None:
+            return None
+        url = request.url()
+        host = unicode(url.host()).lower()
+        if not host or str(url.scheme()).lower() not in ('http', 'https'):
+            return None
+
+        keys = [('host', host)]
+        if proxy is not None and proxy.type() != QNetworkProxy.NoProxy:
+            keys.append(('proxy', '%s:%s' % (proxy.hostName(), proxy.port())))
+        return keys
+
+    def _getProxy(self, request):
+        """ Return a proxy to use for the request based on request options """
         splash_proxy_factory = self._getWebPageAttribute(request, 'splash_proxy_factory')
         if splash_proxy_factory:
             proxy_query = QNetworkProxyQuery(request.url())
-            proxy = splash_proxy_factory.queryProxy(proxy_query)[0]
+            return splash_proxy_factory.queryProxy(proxy_query)[0]
+
+    @contextmanager
+    def _proxyApplied(self, proxy):
+        """
+        This context manager temporary sets a proxy.
+        """
+        old_proxy = self.proxy()
+        if proxy is not None:
             self.setProxy(proxy)
         try:
             yield
@@ -178,6 +341,61 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
         if cookiejar is not None:
             cookiejar.fill_from_reply(reply)
 
+    def _handle_blocked_content_type(self, reply):
+        """
+        Abort the reply if its Content-Type belongs to a blocked
+        resource type. Return True if the reply is aborted.
+        Documents loaded into frames are never aborted: e.g. a page
+        served as text/plain must be rendered even if 'other' is blocked.
+        """
+        blocked_resources = self._getWebPageAttribute(reply.request(), "blocked_resources")
+        if not blocked_resources:
+            return False
+        if is_navigation_request(reply.request()):
+            return False
+
+        content_type = reply.header(QNetworkRequest.ContentTypeHeader)
+        if content_type.isNull():
+            return False
+
+        resource_type = get_content_type_resource_type(unicode(content_type.toString()))
+        if resource_type not in blocked_resources:
+            return False
+
+        self.log("Aborted {url} because of Content-Type (%s)" % resource_type, reply)
+        self._countBlockedRequest(reply.request())
+        reply.abort()
+        return True
+
+    def _handle_download_limits(self, reply, received, total, har_entry):
+        """
+        Abort the reply if it exceeds ``max_response_size`` or if
+        the render exceeds ``max_render_bytes``.
+        Return True if the reply is aborted.
+        """
+        web_page = get_request_webpage(reply.request())
+        if web_page is None:
+            return False
+
+        request_id = self._getRequestId(reply.request())
+        render_bytes = web_page.track_download_progress(request_id, received)
+        if not (web_page.max_response_size or web_page.max_render_bytes):
+            return False
+
+        max_size = web_page.max_response_size
+        if max_size and (received > max_size or total > max_size):
+            reason = "response is larger than max_response_size (%d bytes)" % max_size
+        elif web_page.max_render_bytes and render_bytes > web_page.max_render_bytes:
+            reason = "render exceeded max_render_bytes (%d bytes)" % web_page.max_render_bytes
+        else:
+            return False
+
+        if har_entry is not None:
+            har_entry["comment"] = "Aborted: %s" % reason
+        self.log("Aborted {url}: %s" % reason, reply, min_level=1)
+        reply.abort()
+        return True
+
     def _getRequestId(self, request=None):
         if request is None:
             request = self.sender().request()
@@ -234,10 +452,19 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
 
             har_entry["response"].update(har_qt.reply2har(reply))
 
+        web_page = get_request_webpage(reply.request())
+        if web_page is not None:
+            web_page.on_request_finished(self._getRequestId(reply.request()))
+
+        from_cache = reply.attribute(QNetworkRequest.SourceIsFromCacheAttribute).toBool()
+        metrics.NETWORK_RESPONSES.inc(["hit" if from_cache else "miss"])
+
         self.log("Finished downloading {url}", reply)
 
     def _handleMetaData(self):
         reply = self.sender()
+        if self._handle_blocked_content_type(reply):
+            return
         self._handle_reply_cookies(reply)
 
         har_entry = self._harEntry()
@@ -261,6 +488,9 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
         if har_entry is not None:
             har_entry["response"]["bodySize"] = int(received)
 
+        if self._handle_download_limits(self.sender(), received, total, har_entry):
+            return
+
         if total == -1:
             total = '?'
         self.log("Downloaded %d/%s of {url}" % (received, total), self.sender(), min_level=4)
@@ -291,6 +521,11 @@ class ProxiedQNetworkAccessManager(QNetworkAccessManager):
     def _getRenderOptions(self, request):
         return self._getWebPageAttribute(request, 'render_options')
 
+    def _countBlockedRequest(self, request):
+        web_page = get_request_webpage(request)
+        if web_page is not None:
+            web_page.on_request_blocked()
+
     def log(self, msg, reply=None, min_level=2):
         if self.verbosity < min_level:
             return
@@ -312,13 +547,24 @@ class SplashQNetworkAccessManager(ProxiedQNetworkAccessManager):
 
     * proxy support;
     * request middleware support;
+    * request blocking and prioritization by resource type;
+    * per-host and per-proxy request limits;
     * additional logging.
 
     """
     adblock_rules = None
 
-    def __init__(self, filters_path, allowed_schemes, verbosity):
-        super(SplashQNetworkAccessManager, self).__init__(verbosity=verbosity)
+    def __init__(self, filters_path, allowed_schemes, verbosity,
+                 max_requests_per_host=0, max_requests_per_proxy=0,
+                 host_request_delay=0.0):
+        throttler = RequestThrottler(
+            limits={'host': max_requests_per_host, 'proxy': max_requests_per_proxy},
+            delays={'host': host_request_delay},
+        )
+        super(SplashQNetworkAccessManager, self).__init__(
+            verbosity=verbosity,
+            throttler=throttler,
+        )
 
         self.request_middlewares = []
         if self.verbosity >= 2:
@@ -329,6 +575,8 @@ class SplashQNetworkAccessManager(ProxiedQNetworkAccessManager):
                 AllowedSchemesMiddleware(allowed_schemes, verbosity=verbosity)
             )
 
+        self.request_middlewares.append(ResourceTypeMiddleware(verbosity=verbosity))
+
         self.request_middlewares.append(AllowedDomainsMiddleware(verbosity=verbosity))
 
         if filters_path is not None:
@@ -337,9 +585,109 @@ class SplashQNetworkAccessManager(ProxiedQNetworkAccessManager):
                 AdblockMiddleware(self.adblock_rules, verbosity=verbosity)
             )
 
+        self.request_middlewares.append(ResourcePriorityMiddleware(verbosity=verbosity))
+
     def createRequest(self, operation, request, outgoingData=None):
         render_options = self._getRenderOptions(request)
         if render_options:
             for filter in self.request_middlewares:
                 request = filter.process(request, render_options, operation, outgoingData)
+            if request.url().isEmpty():  # dropped by a middleware
+                self._countBlockedRequest(request)
         return super(SplashQNetworkAccessManager, self).createRequest(operation, request, outgoingData)
+
+
+class _DelayedNetworkReply(QNetworkReply):
+    """
+    A placeholder reply for a request waiting in the throttling queue.
+    When the request is started, the real reply is attached and its
+    signals, metadata and data are forwarded through this object.
+    The real reply becomes a child of the placeholder, so it stays alive
+    until the placeholder is deleted.
+    """
+    REPLY_ATTRIBUTES = [
+        QNetworkRequest.HttpStatusCodeAttribute,
+        QNetworkRequest.HttpReasonPhraseAttribute,
+        QNetworkRequest.RedirectionTargetAttribute,
+        QNetworkRequest.ConnectionEncryptedAttribute,
+        QNetworkRequest.SourceIsFromCacheAttribute,
+    ]
+
+    cancelled = pyqtSignal()
+
+    def __init__(self, operation, request, parent=None):
+        super(_DelayedNetworkReply, self).__init__(parent)
+        self.setRequest(request)
+        self.setUrl(request.url())
+        self.setOperation(operation)
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+        self._reply = None
+        self._aborted = False
+
+    def attach(self, reply):
+        """ Start forwarding everything from ``reply`` """
+        self._reply = reply
+        reply.setParent(self)
+        reply.metaDataChanged.connect(self._onMetaDataChanged)
+        reply.readyRead.connect(self.readyRead)
+        reply.downloadProgress.connect(self.downloadProgress)
+        reply.uploadProgress.connect(self.uploadProgress)
+        reply.sslErrors.connect(self.sslErrors)
+        reply.error.connect(self._onError)
+        reply.finished.connect(self._onFinished)
+
+    def abort(self):
+        if self._hasReply():
+            self._reply.abort()
+            return
+        if self._aborted:
+            return
+        self._aborted = True
+        self.cancelled.emit()
+        self.setError(QNetworkReply.OperationCanceledError, "Operation canceled")
+        self.setFinished(True)
+        self.error.emit(QNetworkReply.OperationCanceledError)
+        self.finished.emit()
+
+    def ignoreSslErrors(self):
+        if self._hasReply():
+            self._reply.ignoreSslErrors()
+
+    def isSequential(self):
+        return True
+
+    def _hasReply(self):
+        return self._reply is not None and not sip.isdeleted(self._reply)
+
+    def bytesAvailable(self):
+        available = super(_DelayedNetworkReply, self).bytesAvailable()
+        if self._hasReply():
+            available += self._reply.bytesAvailable()
+        return available
+
+    def readData(self, maxlen):
+        if not self._hasReply():
+            return b''
+        return bytes(self._reply.read(maxlen))
+
+    def _copyMetaData(self):
+        self.setUrl(self._reply.url())
+        for name, value in self._reply.rawHeaderPairs():
+            self.setRawHeader(name, value)
+        for attribute in self.REPLY_ATTRIBUTES:
+            value = self._reply.attribute(attribute)
+            if not value.isNull():
+                self.setAttribute(attribute, value)
+
+    def _onMetaDataChanged(self):
+        self._copyMetaData()
+        self.metaDataChanged.emit()
+
+    def _onError(self, error_id):
+        self.setError(error_id, self._reply.errorString())
+        self.error.emit(error_id)
+
+    def _onFinished(self):
+        self._copyMetaData()
+        self.setFinished(True)
+        self.finished.emit()
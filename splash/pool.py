@@ -1,26 +1,38 @@
 from __future__ import absolute_import
 from twisted.internet import defer
 from twisted.python import log
+from splash import defaults, metrics
+from splash.utils import Timings
 
 
 class RenderPool(object):
     """A pool of renders. The number of slots determines how many
     renders will be run in parallel, at the most."""
 
-    def __init__(self, slots, network_manager, splash_proxy_factory_cls, js_profiles_path, verbosity=1):
+    def __init__(self, slots, network_manager, splash_proxy_factory_cls, js_profiles_path, verbosity=1,
+                 stats_log_format=defaults.STATS_LOG_FORMAT,
+                 client_key_header=defaults.CLIENT_KEY_HEADER):
         self.network_manager = network_manager
         self.splash_proxy_factory_cls = splash_proxy_factory_cls or (lambda profile_name: None)
         self.js_profiles_path = js_profiles_path
+        self.slots = slots
         self.active = set()
         self.queue = defer.DeferredQueue()
         self.verbosity = verbosity
+        self.stats_log_format = stats_log_format
+        self.client_key_header = client_key_header
         for n in range(slots):
             self._wait_for_render(None, n, log=False)
 
-    def render(self, rendercls, render_options, proxy, **kwargs):
+    def render(self, rendercls, render_options, proxy, timings=None,
+               client_key=None, **kwargs):
         splash_proxy_factory = self.splash_proxy_factory_cls(proxy)
         pool_d = defer.Deferred()
-        self.queue.put((rendercls, render_options, splash_proxy_factory, kwargs, pool_d))
+        if timings is None:
+            timings = Timings()
+        timings.start("queue")
+        self.queue.put((rendercls, render_options, splash_proxy_factory, kwargs,
+                        pool_d, timings, client_key))
         self.log("[%s] queued" % render_options.get_uid())
         return pool_d
 
@@ -32,18 +44,23 @@ class RenderPool(object):
         d.addBoth(self._wait_for_render, slot)
         return _
 
-    def _start_render(self, (rendercls, render_options, splash_proxy_factory, kwargs, pool_d), slot):
+    def _start_render(self, (rendercls, render_options, splash_proxy_factory, kwargs,
+                             pool_d, timings, client_key), slot):
         self.log("initializing SLOT %d" % (slot, ))
-        render = rendercls(
-            network_manager=self.network_manager,
-            splash_proxy_factory=splash_proxy_factory,
-            render_options=render_options,
-            verbosity=self.verbosity,
-        )
+        timings.stop("queue")
+        metrics.QUEUE_WAIT_TIME.observe(timings.get("queue"))
+        with timings.measure("tab"):
+            render = rendercls(
+                network_manager=self.network_manager,
+                splash_proxy_factory=splash_proxy_factory,
+                render_options=render_options,
+                verbosity=self.verbosity,
+                timings=timings,
+            )
         self.active.add(render)
         render.deferred.chainDeferred(pool_d)
         pool_d.addErrback(self._error, render, slot)
-        pool_d.addBoth(self._close_render, render, slot)
+        pool_d.addBoth(self._close_render, render, slot, client_key)
 
         self.log("[%s] SLOT %d is starting" % (render_options.get_uid(), slot))
         try:
@@ -60,11 +77,12 @@ class RenderPool(object):
         self.log("[%s] SLOT %d finished with an error %s" % (uid, slot, render))
         return _
 
-    def _close_render(self, _, render, slot):
+    def _close_render(self, _, render, slot, client_key=None):
         uid = render.render_options.get_uid()
         self.log("[%s] SLOT %d is closing %s" % (uid, slot, render))
         self.active.remove(render)
         render.deferred.cancel()
+        metrics.observe_render_stats(render.get_stats(), client_key)
         render.close()
         self.log("[%s] SLOT %d done with %s" % (uid, slot, render))
         return _
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand profilers for a running Splash process
+(see ``/debug/profile`` endpoint).
+
+:class:`SamplingProfiler` periodically captures the stack of the main
+thread from a background thread and returns "collapsed stacks" which can
+be turned into a flame graph. :class:`CProfileProfiler` uses cProfile
+and returns pstats report. Nothing is running when profilers are not
+active.
+"""
+from __future__ import absolute_import
+import os
+import sys
+import time
+import thread
+import threading
+import cProfile
+import pstats
+from cStringIO import StringIO
+from collections import defaultdict
+
+
+def collapse_stack(frame):
+    """
+    Return a stack as a single string:
+    ``outer (file.py:func);...;inner (file.py:func)``.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s:%d)" % (
+            code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+        ))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler(object):
+    """
+    A profiler which captures a stack of ``thread_id`` thread every
+    ``interval`` seconds.
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread.get_ident() if thread_id is None else thread_id
+        self.samples = defaultdict(int)  # collapsed stack => count
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="splash-profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.samples[collapse_stack(frame)] += 1
+
+    def get_result(self):
+        """ Return collapsed stacks, most frequent first """
+        items = sorted(self.samples.items(), key=lambda item: (-item[1], item[0]))
+        return "".join("%s %d\n" % item for item in items)
+
+    def _run(self):
+        while self._running:
+            self.sample()
+            time.sleep(self.interval)
+
+
+class CProfileProfiler(object):
+    """
+    A wrapper for cProfile. It only profiles code executed in a thread
+    which calls :meth:`start`, i.e. the event loop thread.
+    """
+    def __init__(self, sort='cumulative', limit=100):
+        self.sort = sort
+        self.limit = limit
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def get_result(self):
+        out = StringIO()
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.sort_stats(self.sort).print_stats(self.limit)
+        return out.getvalue()
@@ -22,9 +22,12 @@ SPLASH_RESOURCES = {
 
 # Note the http header use '-' instead of '_' for the parameter names
 HTML_PARAMS = ['baseurl', 'timeout', 'wait', 'proxy', 'allowed-domains',
-               'viewport', 'js', 'js-source', 'images', 'filters']
+               'viewport', 'js', 'js-source', 'images', 'filters', 'deprioritize',
+               'block-resources', 'max-response-size', 'max-render-bytes',
+               'wait-for', 'network-idle-time', 'wait-for-selector']
 PNG_PARAMS = ['width', 'height']
-JSON_PARAMS = ['html', 'png', 'iframes', 'script', 'console', 'history', 'har']
+JSON_PARAMS = ['html', 'png', 'iframes', 'script', 'console', 'history', 'har',
+               'timings', 'stats']
 
 HOP_BY_HOP_HEADERS = [
     'Connection',
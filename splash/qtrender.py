@@ -1,10 +1,13 @@
 from __future__ import absolute_import
 import abc
 import json
+import time
 import functools
 import pprint
 from splash import defaults
+from splash.render_options import BadOption
 from splash.browser_tab import BrowserTab
+from splash.utils import Timings, instance_counter
 
 
 class RenderError(Exception):
@@ -29,13 +32,21 @@ class RenderScript(object):
 
     default_min_log_level = 2
 
-    def __init__(self, network_manager, splash_proxy_factory, render_options, verbosity):
+    def __init__(self, network_manager, splash_proxy_factory, render_options,
+                 verbosity, timings=None):
+        instance_counter.track(self)
+        self.start_time = time.time()
+        self.timings = Timings() if timings is None else timings
         self.tab = BrowserTab(
             network_manager=network_manager,
             splash_proxy_factory=splash_proxy_factory,
             verbosity=verbosity,
             render_options=render_options,
         )
+        self.tab.set_download_limits(
+            max_response_size=render_options.get_max_response_size(),
+            max_render_bytes=render_options.get_max_render_bytes(),
+        )
         self.render_options = render_options
         self.verbosity = verbosity
         self.deferred = self.tab.deferred
@@ -56,6 +67,21 @@ class RenderScript(object):
     def return_error(self, error=None):
         self.tab.return_error(error)
 
+    def get_stats(self):
+        """
+        Return a dict with resources used by this render so far;
+        it is called by a Pool before the render is closed.
+        Times are in seconds.
+        """
+        web_page = self.tab.web_page
+        return {
+            "network_requests": web_page.request_count,
+            "network_bytes": web_page.bytes_received,
+            "blocked_requests": web_page.blocked_request_count,
+            "js_time": self.tab.js_time,
+            "wall_time": time.time() - self.start_time,
+        }
+
     def close(self):
         """
         This method is called by a Pool after the rendering is done and
@@ -79,10 +105,22 @@ class DefaultRenderScript(RenderScript):
     """
     def start(self, url, baseurl=None, wait=None, viewport=None,
                   js_source=None, js_profile=None, images=None, console=False,
-                  headers=None, http_method='GET', body=None):
+                  headers=None, http_method='GET', body=None,
+                  block_resources=None, wait_for=None, network_idle_time=None,
+                  wait_for_selector=None):
 
         self.url = url
         self.wait_time = defaults.WAIT_TIME if wait is None else wait
+        self.wait_for = wait_for
+        if network_idle_time is None:
+            network_idle_time = defaults.NETWORK_IDLE_TIME
+        self.network_idle_time = network_idle_time
+        self.wait_for_selector = wait_for_selector
+        if wait_for_selector is not None:
+            try:
+                self.tab.validate_selector(wait_for_selector)
+            except ValueError as e:
+                raise BadOption(str(e))
         self.js_source = js_source
         self.js_profile = js_profile
         self.console = console
@@ -91,9 +129,13 @@ class DefaultRenderScript(RenderScript):
         if images is not None:
             self.tab.set_images_enabled(images)
 
+        if block_resources:
+            self.tab.set_blocked_resources(block_resources)
+
         if self.viewport != 'full':
             self.tab.set_viewport(self.viewport)
 
+        self.timings.start("navigation")
         self.tab.go(
             url=url,
             callback=self.on_goto_load_finished,
@@ -113,8 +155,37 @@ class DefaultRenderScript(RenderScript):
         """
         pass
 
+    @stop_on_error
     def on_goto_load_finished(self):
-        if self.wait_time == 0:
+        self.timings.stop("navigation")
+        self.timings.start("wait")
+        if self.wait_for_selector:
+            max_time = self.wait_time or defaults.WAIT_FOR_MAX_TIME
+            max_time_ms = int(max_time * 1000)
+            self.log("loadFinished; waiting for %r (max %sms)" % (
+                self.wait_for_selector, max_time_ms))
+            try:
+                self.tab.wait_for_selector(
+                    selector=self.wait_for_selector,
+                    timeout_ms=max_time_ms,
+                    callback=lambda found: self._loadFinishedOK(),
+                    onerror=self.on_goto_load_error,
+                )
+            except ValueError as e:
+                raise BadOption(str(e))
+        elif self.wait_for == 'network_idle':
+            idle_time_ms = int(self.network_idle_time * 1000)
+            max_time = self.wait_time or defaults.WAIT_FOR_MAX_TIME
+            max_time_ms = int(max_time * 1000)
+            self.log("loadFinished; waiting for network idle (%sms, max %sms)" % (
+                idle_time_ms, max_time_ms))
+            self.tab.wait_for_network_idle(
+                idle_time_ms=idle_time_ms,
+                max_time_ms=max_time_ms,
+                callback=lambda idle: self._loadFinishedOK(),
+                onerror=self.on_goto_load_error,
+            )
+        elif self.wait_time == 0:
             self.log("loadFinished; not waiting")
             self._loadFinishedOK()
         else:
@@ -127,11 +198,14 @@ class DefaultRenderScript(RenderScript):
             )
 
     def on_goto_load_error(self):
+        self.timings.stop("navigation")
+        self.timings.stop("wait")
         self.return_error(RenderError())
 
     @stop_on_error
     def _loadFinishedOK(self):
         self.log("_loadFinishedOK")
+        self.timings.stop("wait")
 
         if self.tab._closing:
             self.log("loadFinishedOK is ignored because RenderScript is closing", min_level=3)
@@ -162,12 +236,14 @@ class DefaultRenderScript(RenderScript):
     def _prepare_render(self):
         if self.viewport == 'full':
             self.tab.set_viewport(self.viewport)
-        self.js_output, self.js_console_output = self._runjs(self.js_source, self.js_profile)
+        with self.timings.measure("js"):
+            self.js_output, self.js_console_output = self._runjs(self.js_source, self.js_profile)
 
 
 class HtmlRender(DefaultRenderScript):
     def get_result(self):
-        return self.tab.html()
+        with self.timings.measure("html"):
+            return self.tab.html()
 
 
 class PngRender(DefaultRenderScript):
@@ -178,7 +254,8 @@ class PngRender(DefaultRenderScript):
         return super(PngRender, self).start(**kwargs)
 
     def get_result(self):
-        return self.tab.png(self.width, self.height)
+        with self.timings.measure("png"):
+            return self.tab.png(self.width, self.height)
 
 
 class JsonRender(DefaultRenderScript):
@@ -188,7 +265,7 @@ class JsonRender(DefaultRenderScript):
         self.height = kwargs.pop('height')
         self.include = {
             inc: kwargs.pop(inc)
-            for inc in ['html', 'png', 'iframes', 'script', 'history', 'har']
+            for inc in ['html', 'png', 'iframes', 'script', 'history', 'har', 'timings', 'stats']
         }
         self.include['console'] = kwargs.get('console')
         super(JsonRender, self).start(**kwargs)
@@ -197,7 +274,8 @@ class JsonRender(DefaultRenderScript):
         res = {}
 
         if self.include['png']:
-            res['png'] = self.tab.png(self.width, self.height, b64=True)
+            with self.timings.measure("png"):
+                res['png'] = self.tab.png(self.width, self.height, b64=True)
 
         if self.include['script'] and self.js_output:
             res['script'] = self.js_output
@@ -205,21 +283,30 @@ class JsonRender(DefaultRenderScript):
         if self.include['console'] and self.js_console_output:
             res['console'] = self.js_console_output
 
-        res.update(self.tab.iframes_info(
-            children=self.include['iframes'],
-            html=self.include['html'],
-        ))
+        with self.timings.measure("html"):
+            res.update(self.tab.iframes_info(
+                children=self.include['iframes'],
+                html=self.include['html'],
+            ))
 
         if self.include['history']:
             res['history'] = self.tab.history()
 
         if self.include['har']:
-            res['har'] = self.tab.har()
+            with self.timings.measure("har"):
+                res['har'] = self.tab.har()
+
+        if self.include['timings']:
+            res['timings'] = self.timings.todict()
+
+        if self.include['stats']:
+            res['stats'] = self.get_stats()
 
         return res
 
 
 class HarRender(DefaultRenderScript):
     def get_result(self):
-        return json.dumps(self.tab.har())
+        with self.timings.measure("har"):
+            return json.dumps(self.tab.har())
 
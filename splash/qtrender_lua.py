@@ -1,24 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import os
-import json
+import copy
 import functools
 import itertools
+from contextlib import contextmanager
 
 import lupa
 
+from splash import defaults
 from splash.qtrender import RenderScript, stop_on_error
 from splash.lua import (
     get_new_runtime,
     get_main,
     get_main_sandboxed,
-    lua2python,
-    python2lua,
+    LuaConverter,
 )
 from splash.har.qt import reply2har
 from splash.render_options import BadOption
-from splash.utils import truncated, BinaryCapsule
-from splash.qtutils import REQUEST_ERRORS_SHORT
+from splash.utils import truncated, BinaryCapsule, instance_counter
+from splash.qtutils import REQUEST_ERRORS_SHORT, BLOCKABLE_RESOURCE_TYPES
 
 
 class ScriptError(BadOption):
@@ -35,10 +36,11 @@ class ScriptError(BadOption):
 
 
 class _AsyncBrowserCommand(object):
-    def __init__(self, id, name, kwargs):
+    def __init__(self, id, name, kwargs, target=None):
         self.id = id
         self.name = name
         self.kwargs = kwargs
+        self.target = target  # an object to call method on; tab by default
 
     def __repr__(self):
         kwargs = self.kwargs.copy()
@@ -58,11 +60,15 @@ class _ImmediateResult(object):
 def command(async=False, table_argument=False):
     """ Decorator for marking methods as commands available to Lua """
     def decorator(meth):
+        if async:
+            meth = binds_commands_to_tab(meth)
         if not table_argument:
             meth = lupa.unpacks_lua_table_method(meth)
-        meth = exceptions_as_return_values(
-            can_raise(
-                emits_lua_objects(meth)
+        meth = pauses_cpu_timer(
+            exceptions_as_return_values(
+                can_raise(
+                    emits_lua_objects(meth)
+                )
             )
         )
         meth._is_command = True
@@ -71,6 +77,20 @@ def command(async=False, table_argument=False):
     return decorator
 
 
+def binds_commands_to_tab(meth):
+    """
+    This decorator makes _AsyncBrowserCommand objects returned by a method
+    run in the browser tab of the object the method is called on.
+    """
+    @functools.wraps(meth)
+    def wrapper(self, *args, **kwargs):
+        res = meth(self, *args, **kwargs)
+        if isinstance(res, _AsyncBrowserCommand) and res.target is None:
+            res.target = self.tab
+        return res
+    return wrapper
+
+
 def emits_lua_objects(meth):
     """
     This decorator makes method convert results to
@@ -79,7 +99,19 @@ def emits_lua_objects(meth):
     @functools.wraps(meth)
     def wrapper(self, *args, **kwargs):
         res = meth(self, *args, **kwargs)
-        return python2lua(self.lua, res)
+        return self._converter.python2lua(res)
+    return wrapper
+
+
+def pauses_cpu_timer(meth):
+    """
+    Decorator for methods called from Lua: time spent in them
+    is not counted towards the Lua CPU time limit.
+    """
+    @functools.wraps(meth)
+    def wrapper(self, *args, **kwargs):
+        with self._cpu_timer_paused():
+            return meth(self, *args, **kwargs)
     return wrapper
 
 
@@ -88,6 +120,22 @@ def is_command(meth):
     return getattr(meth, '_is_command', False)
 
 
+def get_commands(cls):
+    """
+    Return a ``{name: metadata}`` dict with Lua commands
+    exposed by a class.
+    """
+    commands = {}
+    for name in dir(cls):
+        value = getattr(cls, name)
+        if is_command(value):
+            commands[name] = {
+                'is_async': getattr(value, '_is_async'),
+                'returns_error_flag': getattr(value, '_returns_error_flag', False),
+            }
+    return commands
+
+
 def can_raise(meth):
     """
     Decorator for preserving Python exceptions raised in Python
@@ -137,40 +185,23 @@ class _WrappedJavascriptFunction(object):
         :param str source: function source code
         """
         self.lua = splash.lua
+        self._converter = splash._converter
         self.tab = splash.tab
         self.source = source
+        self.func_id = self.tab.register_js_function(source)
         self._exceptions = splash._exceptions
+        self._cpu_timer_paused = splash._cpu_timer_paused
 
+    @pauses_cpu_timer
     @exceptions_as_return_values
     @can_raise
     @emits_lua_objects
     def __call__(self, *args):
-        args = lua2python(self.lua, args)
-        args_text = json.dumps(args, ensure_ascii=False, encoding="utf8")[1:-1]
-        func_text = json.dumps([self.source], ensure_ascii=False, encoding='utf8')[1:-1]
-        wrapper_script = """
-        (function(func_text){
-            try{
-                var func = eval("(" + func_text + ")");
-                return {
-                    result: func(%(args)s),
-                    error: false,
-                }
-            }
-            catch(e){
-                return {
-                    error: true,
-                    error_repr: e.toString(),
-                }
-            }
-        })(%(func_text)s)
-        """ % {"func_text": func_text, "args": args_text}
-
-        # print(wrapper_script)
-        res = self.tab.runjs(wrapper_script)
+        args = self._converter.lua2python(args)
+        res = self.tab.call_js_function(self.func_id, list(args))
 
         if not isinstance(res, dict):
-            raise ScriptError("[lua] unknown error during JS function call: %r; %r" % (res, wrapper_script))
+            raise ScriptError("[lua] unknown error during JS function call: %r; %r" % (res, self.source))
 
         if res["error"]:
             raise ScriptError("[lua] error during JS function call: %r" % (res.get("error_repr", "<unknown error>"),))
@@ -185,10 +216,15 @@ class Splash(object):
     """
     _result_content_type = None
     _attribute_whitelist = ['commands', 'args']
+    _commands = {}  # filled by get_commands after the class is created
 
     def __init__(self, tab, return_func, render_options, sandboxed,
                  lua_package_path,
-                 lua_sandbox_allowed_modules):
+                 lua_sandbox_allowed_modules,
+                 lua_runtime_pool=None,
+                 lua_chunk_cache=None,
+                 lua_max_instructions=None,
+                 lua_max_cpu_time=None):
         """
         :param splash.browser_tab.BrowserTab tab: BrowserTab object
         :param callable return_func: function that continues the script
@@ -197,27 +233,34 @@ class Splash(object):
         :param str lua_package_path: paths to add to Lua package.path
         :param iterable lua_sandbox_allowed_modules: a list of modules allowed
             to be required from a sandbox
+        :param LuaRuntimePool lua_runtime_pool: a pool to take
+            a pre-initialized Lua runtime from (optional)
+        :param splash.lua.LuaChunkCache lua_chunk_cache: a cache of
+            compiled scripts (optional)
+        :param int lua_max_instructions: maximum number of Lua instructions
+            a sandboxed script can execute
+        :param float lua_max_cpu_time: maximum CPU time (in seconds)
+            a sandboxed script can use; 0 or None means "no limit"
         """
         self.tab = tab
         self.sandboxed = sandboxed
-        self.lua = self._create_runtime(lua_package_path)
+        self.lua_chunk_cache = lua_chunk_cache
+        # the runtime is kept to count runtimes in use in /debug and /metrics
+        self._runtime = runtime = self._create_runtime(lua_package_path, lua_runtime_pool)
+        self.lua = runtime.lua
+        self._converter = runtime.converter
+        self.commands = runtime.commands
+        self._sandbox = runtime.sandbox
         self._setup_lua_sandbox(lua_sandbox_allowed_modules)
-        self._return = return_func
+        self._setup_lua_limits(lua_max_instructions, lua_max_cpu_time)
+        self._return_func = return_func
 
         self._exceptions = []
         self._command_ids = itertools.count()
+        self._result_handlers = {}  # cmd_id => function
+        self._children = set()  # Splash objects for extra tabs
 
-        self.args = python2lua(self.lua, render_options.data)
-
-        commands = {}
-        for name in dir(self):
-            value = getattr(self, name)
-            if is_command(value):
-                commands[name] = self.lua.table_from({
-                    'is_async': getattr(value, '_is_async'),
-                    'returns_error_flag': getattr(value, '_returns_error_flag', False),
-                })
-        self.commands = python2lua(self.lua, commands)
+        self.args = self.python2lua(render_options.data)
 
     @command(async=True)
     def wait(self, time, cancel_on_redirect=False, cancel_on_error=True):
@@ -243,6 +286,74 @@ class Splash(object):
             onerror = error if cancel_on_error else False,
         ))
 
+    @command(async=True)
+    def wait_for_network_idle(self, idle_time=None, timeout=None, cancel_on_error=True):
+        if idle_time is None:
+            idle_time = defaults.NETWORK_IDLE_TIME
+        idle_time = float(idle_time)
+        if idle_time < 0:
+            raise BadOption("splash:wait_for_network_idle idle_time can't be negative")
+
+        if timeout is None:
+            timeout = defaults.WAIT_FOR_MAX_TIME
+        timeout = float(timeout)
+        if timeout < 0:
+            raise BadOption("splash:wait_for_network_idle timeout can't be negative")
+
+        cmd_id = next(self._command_ids)
+
+        def callback(idle):
+            if idle:
+                self._return(cmd_id, True)
+            else:
+                self._return(cmd_id, None, 'timeout')
+
+        def error():
+            self._return(cmd_id, None, 'error')
+
+        return _AsyncBrowserCommand(cmd_id, "wait_for_network_idle", dict(
+            idle_time_ms = idle_time*1000,
+            max_time_ms = timeout*1000,
+            callback = callback,
+            onerror = error if cancel_on_error else None,
+        ))
+
+    @command(async=True)
+    def wait_for_selector(self, selector, timeout=None, cancel_on_error=True):
+        if selector is None:
+            raise ScriptError("'selector' is required for splash:wait_for_selector")
+
+        if timeout is None:
+            timeout = defaults.WAIT_FOR_MAX_TIME
+        timeout = float(timeout)
+        if timeout < 0:
+            raise BadOption("splash:wait_for_selector timeout can't be negative")
+
+        try:
+            self.tab.validate_selector(selector)
+            if self.tab.element_exists(selector):
+                return _ImmediateResult(True)
+        except ValueError as e:
+            raise ScriptError(str(e))
+
+        cmd_id = next(self._command_ids)
+
+        def callback(found):
+            if found:
+                self._return(cmd_id, True)
+            else:
+                self._return(cmd_id, None, 'timeout')
+
+        def error():
+            self._return(cmd_id, None, 'error')
+
+        return _AsyncBrowserCommand(cmd_id, "wait_for_selector", dict(
+            selector = selector,
+            timeout_ms = timeout*1000,
+            callback = callback,
+            onerror = error if cancel_on_error else None,
+        ))
+
     @command(async=True)
     def go(self, url, baseurl=None, headers=None):
         if url is None:
@@ -324,6 +435,55 @@ class Splash(object):
             follow_redirects=follow_redirects,
         ))
 
+    @command(async=True, table_argument=True)
+    def http_get_many(self, urls, options=None):
+        if lupa.lua_type(urls) != 'table':
+            raise ScriptError("splash:http_get_many() requires a table of URLs")
+        urls = self.lua2python(urls, max_depth=2)
+        options = self.lua2python(options, max_depth=3) or {}
+        if not isinstance(options, dict):
+            raise ScriptError("splash:http_get_many() options must be a table")
+
+        unknown_options = set(options) - {'headers', 'follow_redirects', 'concurrency'}
+        if unknown_options:
+            raise ScriptError("splash:http_get_many() got unknown options: %s" % sorted(unknown_options))
+
+        concurrency = options.get('concurrency', defaults.HTTP_GET_MANY_CONCURRENCY)
+        if not isinstance(concurrency, (int, float)) or concurrency < 1:
+            raise ScriptError("splash:http_get_many() concurrency must be a positive number")
+
+        if isinstance(urls, dict):
+            keys = sorted(urls.keys())
+        else:
+            keys = range(1, len(urls) + 1)
+            urls = dict(zip(keys, urls))
+        is_list = keys == range(1, len(keys) + 1)
+        if not all(isinstance(urls[key], basestring) for key in keys):
+            raise ScriptError("splash:http_get_many() URLs must be strings")
+        if not keys:
+            return _ImmediateResult(self.python2lua([]))
+
+        cmd_id = next(self._command_ids)
+        results = [None] * len(keys)
+
+        def on_reply(index, reply):
+            results[index] = reply2har(reply, include_content=True, binary_content=True)
+
+        def callback():
+            if is_list:
+                self._return(cmd_id, self.python2lua(results))
+            else:
+                self._return(cmd_id, self.python2lua(dict(zip(keys, results))))
+
+        return _AsyncBrowserCommand(cmd_id, "http_get_many", dict(
+            urls=[urls[key] for key in keys],
+            callback=callback,
+            on_reply=on_reply,
+            headers=options.get('headers'),
+            follow_redirects=options.get('follow_redirects', True),
+            concurrency=int(concurrency),
+        ))
+
     @command(async=True)
     def autoload(self, source_or_url=None, source=None, url=None):
         if len([a for a in [source_or_url, source, url] if a is not None]) != 1:
@@ -375,6 +535,44 @@ class Splash(object):
             errback=error,
         ))
 
+    @command()
+    def new_tab(self, share_cookies=False):
+        if len(self._children) >= defaults.LUA_MAX_TABS:
+            raise ScriptError("splash:new_tab() can't open more than %d tabs" % defaults.LUA_MAX_TABS)
+        child = self._create_child(self.tab.new_tab(share_cookies=bool(share_cookies)))
+        self._children.add(child)
+        return child._get_wrapper()
+
+    @command(async=True, table_argument=True)
+    def parallel(self, funcs):
+        if lupa.lua_type(funcs) != 'table':
+            raise ScriptError("splash:parallel() argument must be a table of functions")
+        funcs = self.lua2python(funcs, strict=False, max_depth=2)
+        if any(lupa.lua_type(func) != 'function' for func in funcs.values()):
+            raise ScriptError("splash:parallel() argument must be a table of functions")
+
+        keys = sorted(funcs.keys())
+        is_list = keys == range(1, len(keys) + 1)
+        if not keys:
+            return _ImmediateResult(self.python2lua([]))
+
+        cmd_id = next(self._command_ids)
+        runner = _ParallelRunner(self, [
+            self._create_coroutine(funcs[key])() for key in keys
+        ])
+
+        def callback(results, error):
+            if error is not None:
+                self._return(cmd_id, None, error)
+            elif is_list:
+                self._return(cmd_id, self.python2lua(results))
+            else:
+                self._return(cmd_id, self.python2lua(dict(zip(keys, results))))
+
+        return _AsyncBrowserCommand(cmd_id, "run", dict(
+            callback=callback,
+        ), target=runner)
+
     @command()
     def lock_navigation(self):
         self.tab.lock_navigation()
@@ -446,6 +644,22 @@ class Splash(object):
         if enabled is not None:
             self.tab.set_images_enabled(int(enabled))
 
+    @command(table_argument=True)
+    def set_resource_filter(self, resource_types=None):
+        if resource_types is None:
+            resource_types = []
+        elif isinstance(resource_types, basestring):
+            resource_types = [t for t in resource_types.split(',') if t]
+        else:
+            resource_types = self.lua2python(resource_types, max_depth=2)
+            if isinstance(resource_types, dict):
+                resource_types = resource_types.values()
+
+        unknown_types = [t for t in resource_types if t not in BLOCKABLE_RESOURCE_TYPES]
+        if unknown_types:
+            raise ScriptError("splash:set_resource_filter() got invalid resource types: %s" % unknown_types)
+        self.tab.set_blocked_resources(resource_types)
+
     @command()
     def status_code(self):
         return self.tab.last_http_status()
@@ -469,14 +683,25 @@ class Splash(object):
         """
         splash_obj = self._get_wrapper()
         if self.sandboxed:
-            main, env = get_main_sandboxed(self.lua, lua_source)
-            main_coro = self._sandbox.create_coroutine(main)
-            return main_coro(splash_obj)
+            main, env = get_main_sandboxed(self.lua, lua_source, self.lua_chunk_cache)
         else:
-            main, env = get_main(self.lua, lua_source)
-            return main.coroutine(splash_obj)
+            main, env = get_main(self.lua, lua_source, self.lua_chunk_cache)
+        return self._create_coroutine(main)(splash_obj)
+
+    def _create_coroutine(self, func):
+        """
+        Return a function which starts Lua function ``func``
+        as a coroutine. In sandbox the coroutine has instruction limit enabled.
+        """
+        if self.sandboxed:
+            return self._sandbox.create_coroutine(func)
+        return func.coroutine
 
     def instruction_count(self):
+        """
+        Return a number of Lua instructions executed by a sandboxed script,
+        rounded down to the sandbox instruction hook step (1000).
+        """
         if not self.sandboxed:
             return -1
         try:
@@ -485,59 +710,92 @@ class Splash(object):
             print(e)
             return -1
 
+    def _create_child(self, tab):
+        """
+        Return a Splash object for another browser tab. It shares
+        Lua runtime, command ids and result handlers with this object.
+        """
+        child = copy.copy(self)
+        child.tab = tab
+        return child
+
     def _get_wrapper(self):
         """ Return a Lua wrapper for this object. """
         wrapper = self.lua.eval("require('splash')")
         return wrapper.create(self)
 
-    @property
-    def _sandbox(self):
-        return self.lua.eval("require('sandbox')")
-
     def run_async_command(self, cmd):
         """ Execute _AsyncCommand """
-        meth = getattr(self.tab, cmd.name)
+        target = self.tab if cmd.target is None else cmd.target
+        meth = getattr(target, cmd.name)
         return meth(**cmd.kwargs)
 
+    def resume(self, coro, args):
+        """
+        Resume a Lua coroutine; return the value it yields.
+        Time spent in Lua code is counted towards the CPU time limit.
+        """
+        if not self.sandboxed:
+            return coro.send(args)
+        self._sandbox.start_cpu_timer()
+        try:
+            return coro.send(args)
+        finally:
+            self._sandbox.stop_cpu_timer()
+
+    @contextmanager
+    def _cpu_timer_paused(self):
+        """
+        Stop counting CPU time while Python code is running
+        (e.g. when a synchronous command like splash:png() is called).
+        """
+        running = self.sandboxed and self._sandbox.stop_cpu_timer()
+        try:
+            yield
+        finally:
+            if running:
+                self._sandbox.start_cpu_timer()
+
+    def _return(self, cmd_id, *args):
+        """ Send a result of an async command to a waiting coroutine """
+        handler = self._result_handlers.pop(cmd_id, None)
+        if handler is None:
+            handler = self._return_func
+        handler(cmd_id, *args)
+
     def lua2python(self, obj, **kwargs):
         kwargs.setdefault("binary", True)
         kwargs.setdefault("strict", True)
-        return lua2python(self.lua, obj, **kwargs)
+        return self._converter.lua2python(obj, **kwargs)
 
     def python2lua(self, obj, **kwargs):
-        return python2lua(self.lua, obj, **kwargs)
+        return self._converter.python2lua(obj, **kwargs)
 
-    def _create_runtime(self, lua_package_path):
+    def _create_runtime(self, lua_package_path, lua_runtime_pool=None):
         """
-        Return a restricted Lua runtime.
+        Return a _PreparedRuntime with a restricted Lua runtime.
         Currently it only allows accessing attributes of this object.
         """
-        attribute_handlers=(self._attr_getter, self._attr_setter)
-        runtime = get_new_runtime(attribute_handlers=attribute_handlers)
-        self._setup_lua_paths(runtime, lua_package_path)
-        return runtime
-
-    def _setup_lua_paths(self, lua, lua_package_path):
-        default_path = os.path.abspath(
-            os.path.join(
-                os.path.dirname(__file__),
-                'lua_modules'
-            )
-        ) + "/?.lua"
-        if lua_package_path:
-            packages_path = ";".join([default_path, lua_package_path])
+        if lua_runtime_pool is not None:
+            runtime = lua_runtime_pool.get()
         else:
-            packages_path = default_path
-
-        lua.execute("""
-        package.path = "{packages_path};" .. package.path
-        """.format(packages_path=packages_path))
+            runtime = _PreparedRuntime(lua_package_path)
+        runtime.attribute_filter.owner = self
+        return runtime
 
     def _setup_lua_sandbox(self, allowed_modules):
         self._sandbox["allowed_require_names"] = self.python2lua(
             {name: True for name in allowed_modules}
         )
 
+    def _setup_lua_limits(self, max_instructions, max_cpu_time):
+        if max_instructions is None:
+            max_instructions = defaults.LUA_MAX_INSTRUCTIONS
+        if max_cpu_time is None:
+            max_cpu_time = defaults.LUA_MAX_CPU_TIME
+        self._sandbox["instruction_limit"] = max_instructions
+        self._sandbox["cpu_time_limit"] = max_cpu_time or None  # 0 => no limit
+
     def _attr_getter(self, obj, attr_name):
 
         if not isinstance(attr_name, basestring):
@@ -546,29 +804,210 @@ class Splash(object):
         if isinstance(attr_name, basestring) and attr_name.startswith("_"):
             raise AttributeError("Access to private attribute %r is not allowed" % attr_name)
 
-        if obj is not self:
+        if obj is not self and obj not in self._children:
             raise AttributeError("Access to object %r is not allowed" % obj)
 
-        value = getattr(obj, attr_name)
-        if not is_command(value) and not attr_name in self._attribute_whitelist:
+        if attr_name not in self._commands and attr_name not in self._attribute_whitelist:
             raise AttributeError("Access to private attribute %r is not allowed" % attr_name)
 
-        return value
+        return getattr(obj, attr_name)
 
     def _attr_setter(self, obj, attr_name, value):
         raise AttributeError("Direct writing to Python objects is not allowed")
 
 
+Splash._commands = get_commands(Splash)
+
+
+class _ParallelRunner(object):
+    """
+    Runner for splash:parallel. It resumes Lua coroutines as results of
+    their async commands arrive, so that commands started by different
+    coroutines (e.g. page loads in different tabs) run concurrently.
+    """
+    def __init__(self, splash, coroutines):
+        self.splash = splash
+        self.coroutines = coroutines
+        self.results = [None] * len(coroutines)
+        self._running = len(coroutines)
+        self._callback = None
+        self._finished = False
+
+    def run(self, callback):
+        """
+        Start all coroutines; ``callback(results, error)`` is called
+        when all of them are finished or when one of them fails.
+        """
+        self._callback = callback
+        for index in range(len(self.coroutines)):
+            self._dispatch(index)
+
+    def _on_result(self, index, cmd_id, *args):
+        self._dispatch(index, *args)
+
+    def _dispatch(self, index, *args):
+        if self._finished:
+            return
+
+        coro = self.coroutines[index]
+        args = args or None
+        while True:
+            try:
+                cmd = self.splash.resume(coro, args)
+                args = None
+            except StopIteration:
+                self._running -= 1
+                if not self._running:
+                    self._finish(self.results, None)
+                return
+            except lupa.LuaError as e:
+                self._finish(None, str(e))
+                return
+
+            if isinstance(cmd, _AsyncBrowserCommand):
+                handler = functools.partial(self._on_result, index)
+                self.splash._result_handlers[cmd.id] = handler
+                self.splash.run_async_command(cmd)
+                return
+            elif isinstance(cmd, _ImmediateResult):
+                args = cmd.value
+            elif isinstance(cmd, tuple):
+                self._finish(None, "splash:parallel functions must return a single result")
+                return
+            else:
+                self.results[index] = cmd
+
+    def _finish(self, results, error):
+        self._finished = True
+        self._callback(results, error)
+
+
+class _AttributeFilter(object):
+    """
+    Lua attribute handlers are passed to LuaRuntime constructor, but
+    a pre-initialized runtime doesn't belong to any Splash object yet.
+    This class forwards attribute access to the current owner.
+    """
+    def __init__(self):
+        self.owner = None
+
+    def getter(self, obj, attr_name):
+        if self.owner is None:
+            raise AttributeError("Access to object %r is not allowed" % obj)
+        return self.owner._attr_getter(obj, attr_name)
+
+    def setter(self, obj, attr_name, value):
+        raise AttributeError("Direct writing to Python objects is not allowed")
+
+
+class _PreparedRuntime(object):
+    """
+    A restricted Lua runtime with package.path configured,
+    ``sandbox`` and ``splash`` Lua modules loaded and a table with
+    Splash commands metadata built.
+
+    Lua tables can't be shared between runtimes, so the commands table is
+    converted from ``Splash._commands`` (collected once per class) for
+    each runtime; with :class:`LuaRuntimePool` this happens during refill,
+    which moves the cost out of request handling but doesn't remove it.
+    """
+    def __init__(self, lua_package_path):
+        instance_counter.track(self, "LuaRuntime")
+        self.attribute_filter = _AttributeFilter()
+        self.lua = get_new_runtime(attribute_handlers=(
+            self.attribute_filter.getter,
+            self.attribute_filter.setter,
+        ))
+        self._setup_lua_paths(lua_package_path)
+        self.lua.execute("require('sandbox'); require('splash')")
+        self.sandbox = self.lua.eval("require('sandbox')")
+        self.converter = LuaConverter(self.lua)
+        self.commands = self.converter.python2lua(Splash._commands)
+
+    def _setup_lua_paths(self, lua_package_path):
+        default_path = os.path.abspath(
+            os.path.join(
+                os.path.dirname(__file__),
+                'lua_modules'
+            )
+        ) + "/?.lua"
+        if lua_package_path:
+            packages_path = ";".join([default_path, lua_package_path])
+        else:
+            packages_path = default_path
+
+        self.lua.execute("""
+        package.path = "{packages_path};" .. package.path
+        """.format(packages_path=packages_path))
+
+
+class LuaRuntimePool(object):
+    """
+    A pool of pre-initialized Lua runtimes.
+
+    Creating a runtime is not cheap: ``sandbox`` and ``splash`` Lua modules
+    are loaded from disk and compiled. The pool creates runtimes in advance,
+    when the event loop is idle, so that scripts don't pay this cost.
+
+    Scripts can change global state of a runtime, so runtimes are never
+    reused: a runtime taken from the pool belongs to a single script
+    and is discarded afterwards.
+
+    Runtimes are created in the event loop thread, so the pool doesn't
+    reduce CPU usage; it only moves the work out of request handling.
+    This improves latency only when the event loop has idle time
+    (e.g. while renders wait for network); when the loop is always busy
+    refills compete with renders and scripts gain nothing.
+    """
+    def __init__(self, size=defaults.LUA_RUNTIME_POOL_SIZE, lua_package_path="",
+                 call_later=None):
+        self.size = size
+        self.lua_package_path = lua_package_path
+        self._call_later = call_later
+        self._runtimes = []
+        self._refill_scheduled = False
+        self._schedule_refill()
+
+    def get(self):
+        """ Return a _PreparedRuntime object """
+        if self._runtimes:
+            runtime = self._runtimes.pop()
+        else:
+            runtime = _PreparedRuntime(self.lua_package_path)
+        self._schedule_refill()
+        return runtime
+
+    def _schedule_refill(self):
+        if self._refill_scheduled or len(self._runtimes) >= self.size:
+            return
+        if self._call_later is None:
+            from twisted.internet import reactor
+            self._call_later = reactor.callLater
+        self._refill_scheduled = True
+        self._call_later(0, self._refill)
+
+    def _refill(self):
+        # create a single runtime at time to keep the event loop responsive
+        self._refill_scheduled = False
+        if len(self._runtimes) < self.size:
+            self._runtimes.append(_PreparedRuntime(self.lua_package_path))
+        self._schedule_refill()
+
+
 class LuaRender(RenderScript):
 
     default_min_log_level = 2
     result = ''
+    sandboxed = False
+    splash = None
     _START_CMD = '__START__'
     _waiting_for_result_id = _START_CMD
 
     @stop_on_error
     def start(self, lua_source, sandboxed, lua_package_path,
-              lua_sandbox_allowed_modules):
+              lua_sandbox_allowed_modules, lua_runtime_pool=None,
+              lua_chunk_cache=None, lua_max_instructions=None,
+              lua_max_cpu_time=None):
         self.log(lua_source)
         self.sandboxed = sandboxed
         self.splash = Splash(
@@ -578,6 +1017,10 @@ class LuaRender(RenderScript):
             sandboxed=sandboxed,
             lua_package_path=lua_package_path,
             lua_sandbox_allowed_modules=lua_sandbox_allowed_modules,
+            lua_runtime_pool=lua_runtime_pool,
+            lua_chunk_cache=lua_chunk_cache,
+            lua_max_instructions=lua_max_instructions,
+            lua_max_cpu_time=lua_max_cpu_time,
         )
         try:
             self.main_coro = self.splash.start_main(lua_source)
@@ -607,7 +1050,7 @@ class LuaRender(RenderScript):
                 # Got arguments from an async command; send them to coroutine
                 # and wait for the next async command.
                 self.log("[lua] send %s" % args_repr)
-                cmd = self.main_coro.send(args)  # cmd is a next async command
+                cmd = self.splash.resume(self.main_coro, args)  # cmd is a next async command
 
                 args = None  # don't re-send the same value
                 cmd_repr = truncated(repr(cmd), max_length=400, msg='...[long result truncated]')
@@ -657,6 +1100,12 @@ class LuaRender(RenderScript):
 
                 self.result = cmd
 
+    def get_stats(self):
+        stats = super(LuaRender, self).get_stats()
+        if self.sandboxed and self.splash is not None:
+            stats["lua_instructions"] = self.splash.instruction_count()
+        return stats
+
     def _print_instructions_used(self):
         if self.sandboxed:
             self.log("[lua] instructions used: %d" % self.splash.instruction_count())
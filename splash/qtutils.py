@@ -4,6 +4,7 @@
 from __future__ import absolute_import
 import sys
 import time
+import posixpath
 import itertools
 import functools
 
@@ -13,6 +14,7 @@ from PyQt4.QtCore import (
     QAbstractEventDispatcher, QVariant, QString, QObject,
     QDateTime, QRegExp,
 )
+from PyQt4.QtWebKit import QWebFrame
 from PyQt4.QtCore import QUrl
 from PyQt4.QtNetwork import QNetworkAccessManager, QNetworkReply
 
@@ -143,6 +145,102 @@ def drop_request(request):
     request.setUrl(QUrl(''))
 
 
+RESOURCE_TYPES = [
+    'document', 'script', 'stylesheet', 'xhr', 'image', 'font', 'media', 'other'
+]
+BLOCKABLE_RESOURCE_TYPES = [t for t in RESOURCE_TYPES if t != 'document']
+
+_EXTENSION_RESOURCE_TYPES = {
+    'html': 'document', 'htm': 'document', 'xhtml': 'document',
+    'js': 'script',
+    'css': 'stylesheet',
+    'json': 'xhr',
+    'png': 'image', 'jpg': 'image', 'jpeg': 'image', 'gif': 'image',
+    'webp': 'image', 'svg': 'image', 'ico': 'image', 'bmp': 'image',
+    'woff': 'font', 'woff2': 'font', 'ttf': 'font', 'otf': 'font', 'eot': 'font',
+    'mp4': 'media', 'webm': 'media', 'ogg': 'media', 'ogv': 'media',
+    'mp3': 'media', 'wav': 'media', 'flv': 'media', 'avi': 'media',
+    'mov': 'media', 'm4a': 'media', 'm4v': 'media',
+}
+
+
+def get_resource_type(request):
+    """
+    Guess a type of the resource QNetworkRequest is made for.
+    The result is one of :data:`RESOURCE_TYPES`.
+
+    QWebKit doesn't tell which element initiated a request, so the type
+    is inferred from request headers and URL path extension.
+    """
+    if bytes(request.rawHeader('X-Requested-With')) == 'XMLHttpRequest':
+        return 'xhr'
+
+    path = unicode(request.url().path()).lower()
+    ext = posixpath.splitext(path)[1][1:]
+    if ext in _EXTENSION_RESOURCE_TYPES:
+        return _EXTENSION_RESOURCE_TYPES[ext]
+
+    accept = bytes(request.rawHeader('Accept')).lower()
+    if accept.startswith('text/css'):
+        return 'stylesheet'
+    if accept.startswith('image/'):
+        return 'image'
+    if accept.startswith(('text/html', 'application/xhtml+xml')):
+        return 'document'
+    return 'other'
+
+
+def get_content_type_resource_type(content_type):
+    """
+    Guess a resource type from a value of Content-Type header.
+    Return None if it is not possible.
+    """
+    mime_type = content_type.split(';')[0].strip().lower()
+    if not mime_type:
+        return None
+    if mime_type in ('text/html', 'application/xhtml+xml'):
+        return 'document'
+    if mime_type == 'text/css':
+        return 'stylesheet'
+    if 'javascript' in mime_type or 'ecmascript' in mime_type:
+        return 'script'
+    if mime_type.endswith('json'):
+        return 'xhr'
+    if mime_type.startswith('image/'):
+        return 'image'
+    if mime_type.startswith(('font/', 'application/font', 'application/x-font')) or 'woff' in mime_type:
+        return 'font'
+    if mime_type.startswith(('video/', 'audio/')):
+        return 'media'
+    return 'other'
+
+
+def is_navigation_request(request):
+    """
+    Return True if QNetworkRequest loads a document into a frame
+    (the main frame or an iframe), i.e. it is not a subresource request.
+
+    WebKit sends frame loads with HTML in Accept header; the URL requested
+    by the frame is also checked because custom headers can replace Accept.
+    """
+    if bytes(request.rawHeader('X-Requested-With')) == 'XMLHttpRequest':
+        return False
+    accept = bytes(request.rawHeader('Accept')).lower()
+    if accept.startswith(('text/html', 'application/xhtml+xml')):
+        return True
+    web_frame = request.originatingObject()
+    if isinstance(web_frame, QWebFrame):
+        return web_frame.requestedUrl() == request.url()
+    return False
+
+
+def get_request_webpage(request):
+    """ Return a QWebPage the request is made for, or None """
+    web_frame = request.originatingObject()
+    if isinstance(web_frame, QWebFrame):
+        return web_frame.page()
+
+
 def request_repr(request, operation=None):
     """ Return string representation of QNetworkRequest suitable for logging """
     method = OPERATION_NAMES.get(operation, '?')
@@ -4,10 +4,11 @@ import pprint
 from collections import namedtuple
 import sip
 from PyQt4.QtWebKit import QWebPage
-from PyQt4.QtCore import QByteArray
+from PyQt4.QtCore import QByteArray, pyqtSignal
 from twisted.python import log
 from splash.cookies import SplashCookieJar
 from splash.har.log import HarLog
+from splash.utils import instance_counter
 
 
 RenderErrorInfo = namedtuple('RenderErrorInfo', 'type code text url')
@@ -21,19 +22,34 @@ class SplashQWebPage(QWebPage):
     * logs JS console messages;
     * handles alert and confirm windows;
     * returns additional info about render errors;
-    * logs HAR events.
+    * logs HAR events;
+    * keeps track of active network requests.
     """
+    # emitted with a number of active requests when it changes
+    activeRequestsChanged = pyqtSignal(int)
+
     error_info = None
     custom_user_agent = None
     custom_headers = None
+    blocked_resources = None
+    deprioritized_resources = None
+    deprioritized_requests = None  # DeprioritizedRequests, created on demand
+    max_response_size = 0
+    max_render_bytes = 0
     skip_custom_headers = False
     navigation_locked = False
 
     def __init__(self, verbosity=0):
         super(QWebPage, self).__init__()
+        instance_counter.track(self)
         self.verbosity = verbosity
         self.har_log = HarLog()
         self.cookiejar = SplashCookieJar(self)
+        self.bytes_received = 0
+        self.request_count = 0
+        self.blocked_request_count = 0
+        self._bytes_received_by_request = {}
+        self._active_requests = set()
 
         self.mainFrame().urlChanged.connect(self.onUrlChanged)
         self.mainFrame().titleChanged.connect(self.onTitleChanged)
@@ -52,6 +68,34 @@ class SplashQWebPage(QWebPage):
     def onLayoutCompleted(self):
         self.har_log.store_timing("onContentLoad")
 
+    def on_request_started(self, request_id):
+        self.request_count += 1
+        self._active_requests.add(request_id)
+        self.activeRequestsChanged.emit(len(self._active_requests))
+
+    def on_request_finished(self, request_id):
+        if request_id in self._active_requests:
+            self._active_requests.remove(request_id)
+            self.activeRequestsChanged.emit(len(self._active_requests))
+
+    def on_request_blocked(self):
+        self.blocked_request_count += 1
+
+    def active_request_count(self):
+        """ Return a number of network requests which are not finished yet """
+        return len(self._active_requests)
+
+    def track_download_progress(self, request_id, received):
+        """
+        Update the number of bytes received by all responses of this page
+        and return it. ``received`` is a total number of bytes received
+        for a request with ``request_id`` so far.
+        """
+        previous = self._bytes_received_by_request.get(request_id, 0)
+        self._bytes_received_by_request[request_id] = received
+        self.bytes_received += received - previous
+        return self.bytes_received
+
     def acceptNavigationRequest(self, webFrame, networkRequest, navigationType):
         if self.navigation_locked:
             return False
@@ -3,6 +3,8 @@ from __future__ import absolute_import
 import os
 import json
 from splash import defaults
+from splash.js_profiles import js_profile_cache, BadJsProfile
+from splash.qtutils import RESOURCE_TYPES, BLOCKABLE_RESOURCE_TYPES
 
 
 class BadOption(Exception):
@@ -99,6 +101,19 @@ class RenderOptions(object):
     def get_timeout(self):
         return self.get("timeout", defaults.TIMEOUT, type=float, range=(0, defaults.MAX_TIMEOUT))
 
+    def get_wait_for(self):
+        wait_for = self.get("wait_for", None)
+        if wait_for not in {None, "network_idle"}:
+            raise BadOption("Invalid 'wait_for' value: %r" % wait_for)
+        return wait_for
+
+    def get_wait_for_selector(self):
+        return self.get("wait_for_selector", None, type=None)
+
+    def get_network_idle_time(self):
+        return self.get("network_idle_time", defaults.NETWORK_IDLE_TIME,
+                        type=float, range=(0, defaults.MAX_WAIT_TIME))
+
     def get_images(self):
         return self._get_bool("images", defaults.AUTOLOAD_IMAGES)
 
@@ -123,6 +138,28 @@ class RenderOptions(object):
     def get_lua_source(self):
         return self.get("lua_source")
 
+    def get_lua_script_name(self):
+        return self.get("script", None)
+
+    def get_lua_max_instructions(self, max_value=defaults.LUA_MAX_INSTRUCTIONS):
+        return self.get("lua_max_instructions", max_value, type=int, range=(1, max_value))
+
+    def get_lua_max_cpu_time(self, max_value=defaults.LUA_MAX_CPU_TIME):
+        """
+        Return CPU time limit for Lua scripts (in seconds) or None if
+        there is no limit. ``max_value`` is the server limit (0 or None
+        means "no limit"); requests can't raise or disable it.
+        """
+        value = self.get("lua_max_cpu_time", None, type=float)
+        if value is None:
+            return max_value or None
+        if max_value and not 0 < value <= max_value:
+            raise BadOption("Argument 'lua_max_cpu_time' out of range (must be "
+                            "greater than 0 and at most %s)" % max_value)
+        if value < 0:
+            raise BadOption("Argument 'lua_max_cpu_time' can't be negative")
+        return value or None
+
     def get_js_profile(self, js_profiles_path):
         js_profile = self.get("js", default=None)
         if not js_profile:
@@ -134,7 +171,11 @@ class RenderOptions(object):
         if not profile_dir.startswith(js_profiles_path + os.path.sep):
             # security check fails
             raise BadOption('Javascript profile does not exist')
-        if not os.path.isdir(profile_dir):
+        try:
+            js_profile_cache.get_scripts(profile_dir)
+        except BadJsProfile as e:
+            raise BadOption("Javascript profile can't be loaded: %s" % e)
+        except (IOError, OSError):
             raise BadOption('Javascript profile does not exist')
         return profile_dir
 
@@ -203,14 +244,63 @@ class RenderOptions(object):
         if allowed_domains is not None:
             return allowed_domains.split(',')
 
+    def _get_resource_types(self, name, default, allowed_types):
+        value = self.get(name, default=None, type=None)
+        if value is None:
+            return default
+
+        if isinstance(value, basestring):
+            resource_types = [t for t in value.split(',') if t]
+        elif isinstance(value, (list, tuple)):
+            resource_types = list(value)
+        else:
+            raise BadOption("'%s' must be a comma-separated string or a JSON array" % name)
+        if resource_types == ['none']:
+            return []
+
+        unknown_types = [t for t in resource_types if t not in allowed_types]
+        if unknown_types:
+            raise BadOption("Invalid resource types: %s" % unknown_types)
+        return resource_types
+
+    def get_deprioritized_resources(self):
+        return self._get_resource_types(
+            "deprioritize",
+            defaults.DEPRIORITIZED_RESOURCES,
+            RESOURCE_TYPES,
+        )
+
+    def get_blocked_resources(self):
+        return self._get_resource_types(
+            "block_resources",
+            defaults.BLOCKED_RESOURCES,
+            BLOCKABLE_RESOURCE_TYPES,
+        )
+
+    def _get_byte_limit(self, name, default):
+        limit = self.get(name, default, type=int)
+        if limit < 0:
+            raise BadOption("Argument %r must be non-negative" % name)
+        return limit
+
+    def get_max_response_size(self):
+        return self._get_byte_limit("max_response_size", defaults.MAX_RESPONSE_SIZE)
+
+    def get_max_render_bytes(self):
+        return self._get_byte_limit("max_render_bytes", defaults.MAX_RENDER_BYTES)
+
     def get_common_params(self, js_profiles_path):
         wait = self.get_wait()
         return {
             'url': self.get_url(),
             'baseurl': self.get_baseurl(),
             'wait': wait,
+            'wait_for': self.get_wait_for(),
+            'network_idle_time': self.get_network_idle_time(),
+            'wait_for_selector': self.get_wait_for_selector(),
             'viewport': self.get_viewport(wait),
             'images': self.get_images(),
+            'block_resources': self.get_blocked_resources(),
             'headers': self.get_headers(),
             'proxy': self.get_proxy(),
             'js_profile': self.get_js_profile(js_profiles_path),
@@ -232,4 +322,6 @@ class RenderOptions(object):
             console = self._get_bool("console", defaults.SHOW_CONSOLE),
             history = self._get_bool("history", defaults.SHOW_HISTORY),
             har = self._get_bool("har", defaults.SHOW_HAR),
+            timings = self._get_bool("timings", defaults.SHOW_TIMINGS),
+            stats = self._get_bool("stats", defaults.SHOW_STATS),
         )
@@ -8,8 +8,15 @@ from __future__ import absolute_import
 import re
 import os
 import urlparse
+from PyQt4.QtNetwork import QNetworkRequest
 from twisted.python import log
-from splash.qtutils import request_repr, drop_request
+from splash.qtutils import (
+    request_repr,
+    drop_request,
+    get_resource_type,
+    get_request_webpage,
+    is_navigation_request,
+)
 
 
 class AllowedDomainsMiddleware(object):
@@ -62,6 +69,75 @@ class AllowedSchemesMiddleware(object):
         return request
 
 
+class ResourceTypeMiddleware(object):
+    """
+    This request middleware drops requests to resources of blocked types
+    (see ``block_resources`` argument and ``splash:set_resource_filter``).
+    Resource type is inferred from request headers and URL extension;
+    responses are also checked by Content-Type in
+    :class:`splash.network_manager.ProxiedQNetworkAccessManager`.
+    """
+    def __init__(self, verbosity=0):
+        self.verbosity = verbosity
+
+    def process(self, request, render_options, operation, data):
+        web_page = get_request_webpage(request)
+        blocked_resources = getattr(web_page, 'blocked_resources', None)
+        if not blocked_resources or is_navigation_request(request):
+            return request
+
+        resource_type = get_resource_type(request)
+        if resource_type in blocked_resources:
+            if self.verbosity >= 2:
+                log.msg(
+                    "Dropped %s because of resource type (%s)" % (request_repr(request, operation), resource_type),
+                    system='request_middleware'
+                )
+            drop_request(request)
+        return request
+
+
+class ResourcePriorityMiddleware(object):
+    """
+    This request middleware sets request priority based on the resource type.
+
+    Qt sends queued requests to the same host in priority order, so
+    documents, scripts and stylesheets (which delay ``loadFinished``)
+    are not stuck behind images, fonts and trackers. Resource types listed
+    in ``deprioritize`` argument get the lowest priority. Qt queues normal
+    and low priority requests together, so low priority requests are
+    additionally held by the network manager until high priority requests
+    of the page are finished (see
+    :class:`splash.request_throttling.DeprioritizedRequests`).
+    """
+    HIGH_PRIORITY_TYPES = frozenset(['document', 'script', 'stylesheet'])
+
+    def __init__(self, verbosity=0):
+        self.verbosity = verbosity
+
+    def process(self, request, render_options, operation, data):
+        web_page = get_request_webpage(request)
+        deprioritized = getattr(web_page, 'deprioritized_resources', None)
+        if deprioritized is None:
+            deprioritized = render_options.get_deprioritized_resources()
+
+        resource_type = get_resource_type(request)
+        if resource_type in deprioritized:
+            priority = QNetworkRequest.LowPriority
+        elif resource_type in self.HIGH_PRIORITY_TYPES:
+            priority = QNetworkRequest.HighPriority
+        else:
+            priority = QNetworkRequest.NormalPriority
+        request.setPriority(priority)
+
+        if self.verbosity >= 3:
+            log.msg(
+                "Priority %s (%s) for %s" % (priority, resource_type, request_repr(request, operation)),
+                system='request_middleware'
+            )
+        return request
+
+
 class RequestLoggingMiddleware(object):
     """ Request middleware for logging requests """
     def process(self, request, render_options, operation, data):
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Limits for outgoing requests. They are used by
+:class:`splash.network_manager.ProxiedQNetworkAccessManager` to avoid
+hammering a single website (or a single proxy) from many browser tabs
+and to send deprioritized requests of a page after more important ones.
+"""
+from __future__ import absolute_import
+import time
+from collections import defaultdict, OrderedDict
+
+from splash import defaults, metrics
+
+
+class _Waiter(object):
+    """ A request waiting for its turn """
+    __slots__ = ['keys', 'callback', 'queued_at']
+
+    def __init__(self, keys, callback, queued_at):
+        self.keys = keys
+        self.callback = callback
+        self.queued_at = queued_at
+
+
+class RequestThrottler(object):
+    """
+    Concurrency limiter and rate limiter for requests.
+
+    Each request is described by a list of ``(kind, value)`` keys,
+    e.g. ``[('host', 'example.com'), ('proxy', '10.0.0.1:8080')]``.
+    A request is started only when all its keys have a free slot
+    (``limits[kind]`` is a maximum number of active requests per key,
+    0 means "unlimited") and at least ``delays[kind]`` seconds passed since
+    the previous request with the same key was started. Other requests are
+    queued and started in FIFO order.
+    """
+
+    MAX_STATS_KEYS = 1000
+
+    def __init__(self, limits=None, delays=None, clock=time.time,
+                 call_later=None):
+        self.limits = dict(limits or {})
+        self.delays = dict(delays or {})
+        self._clock = clock
+        self._call_later = call_later
+        self._active = defaultdict(int)  # key => number of active requests
+        self._next_start = {}  # key => the earliest time a request can start
+        self._waiting = []
+        self._timer = None
+        self._stats = OrderedDict()  # key => stats dict
+
+    def is_enabled(self):
+        """ Return True if there are any limits to enforce """
+        return any(self.limits.values()) or any(self.delays.values())
+
+    def acquire(self, keys, callback):
+        """
+        Call ``callback(wait_time)`` when a request with ``keys``
+        is allowed to start; ``wait_time`` is a time spent in queue.
+        The callback can be called immediately (before ``acquire`` returns).
+
+        Return an object which can be passed to :meth:`cancel`.
+        Call :meth:`release` with the same keys when the request is finished.
+        """
+        waiter = _Waiter(keys, callback, self._clock())
+        self._waiting.append(waiter)
+        self._process()
+        return waiter
+
+    def cancel(self, waiter):
+        """ Remove a request from the queue if it is not started yet """
+        try:
+            self._waiting.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, keys):
+        """ Call this method when a request is finished """
+        for key in keys:
+            self._active[key] -= 1
+            if self._active[key] <= 0:
+                del self._active[key]
+        self._process()
+
+    def get_stats(self):
+        """ Return per-key statistics for active and queued requests """
+        queued = defaultdict(int)
+        for waiter in self._waiting:
+            for key in waiter.keys:
+                queued[key] += 1
+
+        result = {}
+        for key, stats in self._stats.items():
+            stats = dict(stats)
+            stats['active'] = self._active.get(key, 0)
+            stats['queued'] = queued.get(key, 0)
+            if stats['delayed']:
+                stats['avg_wait'] = stats['total_wait'] / stats['delayed']
+            else:
+                stats['avg_wait'] = 0.0
+            result["%s:%s" % key] = stats
+        return result
+
+    def _process(self):
+        now = self._clock()
+        started, waiting = [], []
+        for waiter in self._waiting:
+            if self._can_start(waiter.keys, now):
+                self._start(waiter.keys, now)
+                started.append(waiter)
+            else:
+                waiting.append(waiter)
+        self._waiting = waiting
+
+        for waiter in started:
+            wait_time = now - waiter.queued_at
+            self._record_wait(waiter.keys, wait_time)
+            waiter.callback(wait_time)
+
+        self._schedule_timer(now)
+
+    def _can_start(self, keys, now):
+        for key in keys:
+            limit = self.limits.get(key[0])
+            if limit and self._active.get(key, 0) >= limit:
+                return False
+            if self._next_start.get(key, now) > now:
+                return False
+        return True
+
+    def _start(self, keys, now):
+        for key in keys:
+            self._active[key] += 1
+            delay = self.delays.get(key[0])
+            if delay:
+                self._next_start[key] = now + delay
+            else:
+                self._next_start.pop(key, None)
+
+        # cleanup: forget delays which are already passed
+        if len(self._next_start) > self.MAX_STATS_KEYS:
+            for key, next_start in list(self._next_start.items()):
+                if next_start <= now:
+                    del self._next_start[key]
+
+    def _schedule_timer(self, now):
+        if self._timer is not None and self._timer.active():
+            return
+        next_starts = [
+            self._next_start[key]
+            for waiter in self._waiting
+            for key in waiter.keys
+            if self._next_start.get(key, now) > now
+        ]
+        if not next_starts:
+            return
+        self._timer = self._get_call_later()(min(next_starts) - now, self._process)
+
+    def _get_call_later(self):
+        if self._call_later is None:
+            from twisted.internet import reactor
+            self._call_later = reactor.callLater
+        return self._call_later
+
+    def _record_wait(self, keys, wait_time):
+        for key in keys:
+            if key in self._stats:
+                stats = self._stats.pop(key)
+            else:
+                stats = {'started': 0, 'delayed': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+                if len(self._stats) >= self.MAX_STATS_KEYS:
+                    self._stats.popitem(last=False)
+            self._stats[key] = stats  # most recently used keys go last
+
+            stats['started'] += 1
+            metrics.observe_throttle_wait(key, wait_time)
+            if wait_time > 0:
+                stats['delayed'] += 1
+                stats['total_wait'] += wait_time
+                stats['max_wait'] = max(stats['max_wait'], wait_time)
+
+
+class DeprioritizedRequests(object):
+    """
+    Low-priority requests of a single web page (see ``deprioritize``
+    argument). They wait until all high-priority requests (documents,
+    scripts and stylesheets) in flight are finished, but not longer than
+    ``max_delay`` seconds, so a slow high-priority request can't hold
+    the rest of the page forever.
+    """
+    def __init__(self, max_delay=defaults.DEPRIORITIZED_MAX_DELAY, call_later=None):
+        self.max_delay = max_delay
+        self.active = 0  # number of high-priority requests in flight
+        self._call_later = call_later
+        self._waiting = []
+        self._timer = None
+
+    def should_wait(self):
+        return self.active > 0
+
+    def started(self):
+        """ A high-priority request is started """
+        self.active += 1
+
+    def finished(self):
+        """ A high-priority request is finished """
+        self.active = max(self.active - 1, 0)
+        if not self.active:
+            self.flush()
+
+    def add(self, callback):
+        """ Call ``callback()`` when the request can be sent """
+        self._waiting.append(callback)
+        if self._timer is None:
+            if self._call_later is None:
+                from twisted.internet import reactor
+                self._call_later = reactor.callLater
+            self._timer = self._call_later(self.max_delay, self.flush)
+
+    def remove(self, callback):
+        """ Forget a request which is cancelled while waiting """
+        if callback in self._waiting:
+            self._waiting.remove(callback)
+
+    def flush(self):
+        """ Start all waiting requests """
+        if self._timer is not None:
+            if self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+        waiting, self._waiting = self._waiting, []
+        for callback in waiting:
+            callback()
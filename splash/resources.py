@@ -4,6 +4,7 @@ exposed to the user).
 """
 from __future__ import absolute_import
 import os
+import hmac
 import time
 import json
 import types
@@ -19,15 +20,30 @@ import splash
 from splash.qtrender import (
     HtmlRender, PngRender, JsonRender, HarRender, RenderError
 )
-from splash.lua import is_supported as lua_is_supported
-from splash.utils import get_num_fds, get_leaks, BinaryCapsule, SplashJSONEncoder
-from splash import sentry
+from splash.lua import is_supported as lua_is_supported, LuaChunkCache
+from splash.utils import (
+    get_num_fds, get_leaks, process_stats, instance_counter, BinaryCapsule,
+    SplashJSONEncoder, Timings,
+)
+from splash import sentry, defaults, metrics
+from splash.profiler import SamplingProfiler, CProfileProfiler
 from splash.render_options import RenderOptions, BadOption
+from splash.lua_scripts import LuaScriptExists
 
 if lua_is_supported():
-    from splash.qtrender_lua import LuaRender
+    from splash.qtrender_lua import LuaRender, LuaRuntimePool
 else:
     LuaRender = None
+    LuaRuntimePool = None
+
+
+def _is_authorized(request, auth_token):
+    """ Check ``Authorization: Bearer <auth_token>`` request header """
+    header = request.getHeader("authorization") or ""
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(token.strip(), auth_token)
 
 
 class _ValidatingResource(Resource):
@@ -43,6 +59,9 @@ class RenderBase(_ValidatingResource):
 
     isLeaf = True
     content_type = "text/html; charset=utf-8"
+    endpoint = None  # endpoint name used in metrics
+
+    _TEXT_STATS_KEYS = ["path", "rendertime", "active", "qsize", "maxrss", "fds", "_id"]
 
     def __init__(self, pool, is_proxy_request=False):
         Resource.__init__(self)
@@ -50,12 +69,26 @@ class RenderBase(_ValidatingResource):
         self.js_profiles_path = self.pool.js_profiles_path
         self.is_proxy_request = is_proxy_request
 
+    def render(self, request):
+        request.starttime = time.time()
+        request.timings = Timings()
+        request.client_key = self._getClientKey(request)
+        result = _ValidatingResource.render(self, request)
+        if result is not NOT_DONE_YET:
+            # request is rejected before rendering is started
+            self._setServerTiming(request)
+            self._recordRenderTime(request, "bad_request")
+        return result
+
     def render_GET(self, request):
         #log.msg("%s %s %s %s" % (id(request), request.method, request.path, request.args))
 
-        request.starttime = time.time()
         render_options = RenderOptions.fromrequest(request)
         render_options.get_filters(self.pool)  # check filters earlier
+        render_options.get_deprioritized_resources()  # and resource types
+        render_options.get_blocked_resources()
+        render_options.get_max_response_size()  # and byte budgets
+        render_options.get_max_render_bytes()
 
         pool_d = self._getRender(request, render_options)
 
@@ -99,7 +132,8 @@ class RenderBase(_ValidatingResource):
             content_type = self.content_type
 
         if isinstance(data, (dict, list)):
-            data = json.dumps(data, cls=SplashJSONEncoder)
+            with request.timings.measure("json"):
+                data = json.dumps(data, cls=SplashJSONEncoder)
             return self._writeOutput(data, request, "application/json")
 
         if isinstance(data, tuple) and len(data) == 2:
@@ -113,139 +147,396 @@ class RenderBase(_ValidatingResource):
             return self._writeOutput(data.data, request, content_type)
 
         request.setHeader("content-type", content_type)
+        self._setServerTiming(request)
 
+        request.outcome = "ok"
+        # headers are sent before the body, so the write time is only logged
+        with request.timings.measure("write"):
+            request.write(data)
         self._logStats(request)
-        request.write(data)
+
+    def _setServerTiming(self, request):
+        request.setHeader("Server-Timing", request.timings.server_timing(
+            total=time.time() - request.starttime,
+        ))
 
     def _logStats(self, request):
+        log_format = self.pool.stats_log_format
+        if log_format == 'none':
+            return
         stats = {
             "path": request.path,
             "args": request.args,
             "rendertime": time.time() - request.starttime,
-            "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
-            "load": os.getloadavg(),
-            "fds": get_num_fds(),
             "active": len(self.pool.active),
             "qsize": len(self.pool.queue.pending),
+            "timings": request.timings.todict(),
             "_id": id(request),
         }
-        log.msg(json.dumps(stats), system="stats")
+        if request.client_key is not None:
+            stats["client"] = request.client_key
+        stats.update(process_stats.get())
+        if log_format == 'text':
+            msg = " ".join("%s=%s" % (key, stats[key]) for key in self._TEXT_STATS_KEYS)
+        else:
+            msg = json.dumps(stats)
+        log.msg(msg, system="stats")
 
     def _timeoutError(self, failure, request):
         failure.trap(defer.CancelledError)
+        request.outcome = "timeout"
         request.setResponseCode(504)
+        self._setServerTiming(request)
         request.write("Timeout exceeded rendering page\n")
         #log.msg("_timeoutError: %s" % id(request))
 
     def _renderError(self, failure, request):
         failure.trap(RenderError)
+        request.outcome = "render_error"
         request.setResponseCode(502)
+        self._setServerTiming(request)
         request.write("Error rendering page\n")
         #log.msg("_renderError: %s" % id(request))
 
     def _internalError(self, failure, request):
+        request.outcome = "internal_error"
         request.setResponseCode(500)
+        self._setServerTiming(request)
         request.write(failure.getErrorMessage())
         log.err()
         sentry.capture(failure)
 
     def _badRequest(self, failure, request):
         failure.trap(BadOption)
+        request.outcome = "bad_request"
         request.setResponseCode(400)
+        self._setServerTiming(request)
         request.write(str(failure.value) + "\n")
 
     def _finishRequest(self, _, request):
+        self._recordRenderTime(request, getattr(request, 'outcome', 'internal_error'))
         if not request._disconnected:
             request.finish()
         #log.msg("_finishRequest: %s" % id(request))
 
+    def _recordRenderTime(self, request, outcome):
+        metrics.RENDER_TIME.observe(
+            time.time() - request.starttime,
+            [self.endpoint, outcome],
+        )
+
+    def _getClientKey(self, request):
+        """ Return a client key used for per-client accounting or None """
+        header = self.pool.client_key_header
+        if header is None:
+            return None
+        return request.getHeader(header) or None
+
     def _getRender(self, request, options):
         raise NotImplementedError()
 
 
 class RenderHtml(RenderBase):
     content_type = "text/html; charset=utf-8"
+    endpoint = "render.html"
 
     def _getRender(self, request, options):
         params = options.get_common_params(self.js_profiles_path)
-        return self.pool.render(HtmlRender, options, **params)
+        return self.pool.render(HtmlRender, options, timings=request.timings,
+                                client_key=request.client_key, **params)
 
 
 class ExecuteLuaScript(RenderBase):
     content_type = "text/plain; charset=utf-8"
+    endpoint = "execute"
 
     def __init__(self, pool, is_proxy_request, sandboxed,
                  lua_package_path,
-                 lua_sandbox_allowed_modules):
+                 lua_sandbox_allowed_modules,
+                 lua_runtime_pool_size=defaults.LUA_RUNTIME_POOL_SIZE,
+                 lua_chunk_cache=None,
+                 lua_script_registry=None,
+                 lua_max_instructions=defaults.LUA_MAX_INSTRUCTIONS,
+                 lua_max_cpu_time=defaults.LUA_MAX_CPU_TIME):
         RenderBase.__init__(self, pool, is_proxy_request)
         self.sandboxed = sandboxed
         self.lua_package_path = lua_package_path
         self.lua_sandbox_allowed_modules = lua_sandbox_allowed_modules
+        self.lua_runtime_pool = LuaRuntimePool(
+            size=lua_runtime_pool_size,
+            lua_package_path=lua_package_path,
+        )
+        if lua_chunk_cache is None:
+            lua_chunk_cache = LuaChunkCache()
+        self.lua_chunk_cache = lua_chunk_cache
+        self.lua_script_registry = lua_script_registry
+        self.lua_max_instructions = lua_max_instructions
+        self.lua_max_cpu_time = lua_max_cpu_time
+
+    def _getLuaSource(self, options):
+        """ Return (lua_source, lua_chunk_cache) tuple """
+        script_name = options.get_lua_script_name()
+        if script_name is None:
+            return options.get_lua_source(), self.lua_chunk_cache
+        if options.get("lua_source", None) is not None:
+            raise BadOption("Arguments 'script' and 'lua_source' can't be used together")
+        if self.lua_script_registry is None:
+            raise BadOption("Named Lua scripts are not enabled; use --lua-scripts-path")
+        registry = self.lua_script_registry
+        return registry.get(script_name), registry.chunk_cache
 
     def _getRender(self, request, options):
+        lua_source, lua_chunk_cache = self._getLuaSource(options)
         params = dict(
             proxy = options.get_proxy(),
-            lua_source = options.get_lua_source(),
+            lua_source = lua_source,
             sandboxed = self.sandboxed,
             lua_package_path = self.lua_package_path,
             lua_sandbox_allowed_modules = self.lua_sandbox_allowed_modules,
+            lua_runtime_pool = self.lua_runtime_pool,
+            lua_chunk_cache = lua_chunk_cache,
+            lua_max_instructions = options.get_lua_max_instructions(self.lua_max_instructions),
+            lua_max_cpu_time = options.get_lua_max_cpu_time(self.lua_max_cpu_time),
         )
-        return self.pool.render(LuaRender, options, **params)
+        return self.pool.render(LuaRender, options, timings=request.timings,
+                                client_key=request.client_key, **params)
 
 
 class RenderPng(RenderBase):
 
     content_type = "image/png"
+    endpoint = "render.png"
 
     def _getRender(self, request, options):
         params = options.get_common_params(self.js_profiles_path)
         params.update(options.get_png_params())
-        return self.pool.render(PngRender, options, **params)
+        return self.pool.render(PngRender, options, timings=request.timings,
+                                client_key=request.client_key, **params)
 
 
 class RenderJson(RenderBase):
 
     content_type = "application/json"
+    endpoint = "render.json"
 
     def _getRender(self, request, options):
         params = options.get_common_params(self.js_profiles_path)
         params.update(options.get_png_params())
         params.update(options.get_include_params())
-        return self.pool.render(JsonRender, options, **params)
+        return self.pool.render(JsonRender, options, timings=request.timings,
+                                client_key=request.client_key, **params)
 
 
 class RenderHar(RenderBase):
 
     content_type = "application/json"
+    endpoint = "render.har"
 
     def _getRender(self, request, options):
         params = options.get_common_params(self.js_profiles_path)
-        return self.pool.render(HarRender, options, **params)
+        return self.pool.render(HarRender, options, timings=request.timings,
+                                client_key=request.client_key, **params)
 
 
-class Debug(Resource):
+class LuaScripts(_ValidatingResource):
+    """
+    Named Lua scripts:
 
+    * GET /scripts - list script names;
+    * GET /scripts/<name> - get script source code;
+    * POST /scripts/<name> - compile a script (request body) and save it;
+      an existing script is replaced only if ``overwrite=1`` argument
+      is passed.
+
+    POST requests must have ``Authorization: Bearer <token>`` header, where
+    token is set by ``--lua-scripts-auth-token`` option; registering scripts
+    is disabled if the option is not set.
+    """
     isLeaf = True
 
-    def __init__(self, pool):
+    def __init__(self, registry, auth_token=None):
+        Resource.__init__(self)
+        self.registry = registry
+        self.auth_token = auth_token
+
+    def _getName(self, request):
+        return "/".join(request.postpath).strip("/") or None
+
+    def render_GET(self, request):
+        name = self._getName(request)
+        if name is None:
+            request.setHeader("content-type", "application/json")
+            return json.dumps({"scripts": self.registry.names()})
+
+        try:
+            source = self.registry.get(name)
+        except BadOption as e:
+            request.setResponseCode(404)
+            return str(e) + "\n"
+        request.setHeader("content-type", "text/plain; charset=utf-8")
+        return source
+
+    def render_POST(self, request):
+        if not self.auth_token:
+            request.setResponseCode(403)
+            return ("Registering Lua scripts is disabled; use "
+                    "--lua-scripts-auth-token option to enable it\n")
+        if not _is_authorized(request, self.auth_token):
+            request.setResponseCode(401)
+            request.setHeader("www-authenticate", 'Bearer realm="splash"')
+            return "Authorization required\n"
+
+        name = self._getName(request)
+        if name is None:
+            raise BadOption("Lua script name is required: POST /scripts/<name>")
+        overwrite = request.args.get("overwrite") == ["1"]
+        try:
+            self.registry.register(name, request.content.read(), overwrite)
+        except LuaScriptExists as e:
+            request.setResponseCode(409)
+            return str(e) + "\n"
+        request.setHeader("content-type", "application/json")
+        return json.dumps({"name": name})
+
+
+class Debug(Resource):
+
+    def __init__(self, pool, lua_chunk_cache=None, loop_monitor=None,
+                 auth_token=None):
         Resource.__init__(self)
         self.pool = pool
+        self.lua_chunk_cache = lua_chunk_cache
+        self.loop_monitor = loop_monitor
+        self.putChild("profile", DebugProfile(auth_token))
+
+    def getChild(self, name, request):
+        if name == "":
+            return self
+        return Resource.getChild(self, name, request)
 
     def render_GET(self, request):
         request.setHeader("content-type", "application/json")
-        return json.dumps({
-            "leaks": get_leaks(),
+        info = {
+            "instances": instance_counter.get_counts(),
             "active": [self.get_repr(r) for r in self.pool.active],
             "qsize": len(self.pool.queue.pending),
             "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
             "fds": get_num_fds(),
-        })
+        }
+        throttler = getattr(self.pool.network_manager, 'throttler', None)
+        if throttler is not None:
+            info["throttling"] = throttler.get_stats()
+        if self.lua_chunk_cache is not None:
+            info["lua_chunk_cache"] = self.lua_chunk_cache.get_stats()
+        if self.loop_monitor is not None:
+            info["event_loop"] = self.loop_monitor.get_stats()
+        if request.args.get("full") == ["1"]:
+            # this is slow: all objects are checked
+            info["leaks"] = get_leaks()
+        return json.dumps(info)
 
     def get_repr(self, render):
         if hasattr(render, 'url'):
             return render.url
         return render.tab.url
 
+
+class DebugProfile(_ValidatingResource):
+    """
+    Profile the running Splash process:
+
+    * GET /debug/profile?seconds=N - sample the event loop thread stack
+      for N seconds and return collapsed stacks;
+    * GET /debug/profile?seconds=N&mode=cprofile - run cProfile
+      for N seconds and return pstats report.
+
+    Requests must have ``Authorization: Bearer <token>`` header, where
+    token is set by ``--debug-auth-token`` option; the endpoint
+    is disabled if the option is not set.
+    """
+    isLeaf = True
+    PROFILERS = {
+        'sample': SamplingProfiler,
+        'cprofile': CProfileProfiler,
+    }
+
+    def __init__(self, auth_token=None):
+        Resource.__init__(self)
+        self.auth_token = auth_token
+        self.active = False
+
+    def render_GET(self, request):
+        if not self.auth_token:
+            request.setResponseCode(403)
+            return "Profiling is disabled; use --debug-auth-token option to enable it\n"
+        if not _is_authorized(request, self.auth_token):
+            request.setResponseCode(401)
+            request.setHeader("www-authenticate", 'Bearer realm="splash"')
+            return "Authorization required\n"
+
+        options = RenderOptions.fromrequest(request)
+        try:
+            seconds = options.get("seconds", defaults.PROFILE_SECONDS, type=float,
+                                  range=(0, defaults.MAX_PROFILE_SECONDS))
+        except ValueError:
+            raise BadOption("Invalid 'seconds' argument")
+        mode = options.get("mode", "sample")
+        if mode not in self.PROFILERS:
+            raise BadOption("Invalid 'mode' argument: %r" % mode)
+
+        if self.active:
+            request.setResponseCode(409)
+            return "Profiler is already running\n"
+
+        self.active = True
+        profiler = self.PROFILERS[mode]()
+        profiler.start()
+        call = reactor.callLater(seconds, self._finish, request, profiler)
+        request.notifyFinish().addErrback(self._cancel, call, profiler)
+        return NOT_DONE_YET
+
+    def _finish(self, request, profiler):
+        profiler.stop()
+        self.active = False
+        request.setHeader("content-type", "text/plain; charset=utf-8")
+        request.write(profiler.get_result())
+        request.finish()
+
+    def _cancel(self, failure, call, profiler):
+        # client disconnected before profiling is finished
+        if call.active():
+            call.cancel()
+            profiler.stop()
+            self.active = False
+
+
+class Metrics(Resource):
+    """ Server metrics in Prometheus text format """
+
+    isLeaf = True
+
+    def __init__(self, pool, caches=None):
+        Resource.__init__(self)
+        self.pool = pool
+        self.caches = caches or {}  # name => object with get_stats() method
+
+    def render_GET(self, request):
+        self._collect()
+        request.setHeader("content-type", "text/plain; version=0.0.4")
+        return metrics.registry.render()
+
+    def _collect(self):
+        """ Update metrics which are computed from the current state """
+        metrics.SLOTS.set(value=self.pool.slots)
+        metrics.ACTIVE_SLOTS.set(value=len(self.pool.active))
+        metrics.QUEUE_DEPTH.set(value=len(self.pool.queue.pending))
+        for name, count in instance_counter.get_counts().items():
+            metrics.INSTANCES.set([name], count)
+        for name, cache in self.caches.items():
+            stats = cache.get_stats()
+            metrics.CACHE_REQUESTS.set([name, "hit"], stats["hits"])
+            metrics.CACHE_REQUESTS.set([name, "miss"], stats["misses"])
+
 BOOTSTRAP_THEME = 'simplex'
 CODEMIRROR_OPTIONS = """{
     mode: 'lua',
@@ -544,7 +835,14 @@ class Root(Resource):
 
     def __init__(self, pool, ui_enabled, lua_enabled, lua_sandbox_enabled,
                  lua_package_path,
-                 lua_sandbox_allowed_modules):
+                 lua_sandbox_allowed_modules,
+                 lua_runtime_pool_size=defaults.LUA_RUNTIME_POOL_SIZE,
+                 lua_script_registry=None,
+                 lua_scripts_auth_token=None,
+                 lua_max_instructions=defaults.LUA_MAX_INSTRUCTIONS,
+                 lua_max_cpu_time=defaults.LUA_MAX_CPU_TIME,
+                 loop_monitor=None,
+                 debug_auth_token=None):
         Resource.__init__(self)
         self.ui_enabled = ui_enabled
         self.lua_enabled = lua_enabled
@@ -552,16 +850,39 @@ class Root(Resource):
         self.putChild("render.png", RenderPng(pool))
         self.putChild("render.json", RenderJson(pool))
         self.putChild("render.har", RenderHar(pool))
-        self.putChild("debug", Debug(pool))
 
+        lua_chunk_cache = None
         if self.lua_enabled and ExecuteLuaScript is not None:
+            lua_chunk_cache = LuaChunkCache()
             self.putChild("execute", ExecuteLuaScript(
                 pool=pool,
                 is_proxy_request=False,
                 sandboxed=lua_sandbox_enabled,
                 lua_package_path=lua_package_path,
                 lua_sandbox_allowed_modules=lua_sandbox_allowed_modules,
+                lua_runtime_pool_size=lua_runtime_pool_size,
+                lua_chunk_cache=lua_chunk_cache,
+                lua_script_registry=lua_script_registry,
+                lua_max_instructions=lua_max_instructions,
+                lua_max_cpu_time=lua_max_cpu_time,
             ))
+            if lua_script_registry is not None:
+                self.putChild("scripts", LuaScripts(lua_script_registry,
+                                                    lua_scripts_auth_token))
+
+        self.putChild("debug", Debug(
+            pool,
+            lua_chunk_cache=lua_chunk_cache,
+            loop_monitor=loop_monitor,
+            auth_token=debug_auth_token,
+        ))
+
+        caches = {}
+        if lua_chunk_cache is not None:
+            caches["lua_chunks"] = lua_chunk_cache
+            if lua_script_registry is not None:
+                caches["lua_scripts"] = lua_script_registry.chunk_cache
+        self.putChild("metrics", Metrics(pool, caches=caches))
 
         if self.ui_enabled:
             self.putChild("_harviewer", File(self.HARVIEWER_PATH))
@@ -29,6 +29,14 @@ def parse_opts():
         help="port to listen to (default: %default)")
     op.add_option("-s", "--slots", type="int", default=defaults.SLOTS,
         help="number of render slots (default: %default)")
+    op.add_option("--max-requests-per-host", type="int", default=defaults.MAX_REQUESTS_PER_HOST,
+        help="maximum number of concurrent requests to a single host from all slots; "
+             "0 means no limit (default: %default)")
+    op.add_option("--max-requests-per-proxy", type="int", default=defaults.MAX_REQUESTS_PER_PROXY,
+        help="maximum number of concurrent requests sent via a single proxy from all slots; "
+             "0 means no limit (default: %default)")
+    op.add_option("--host-request-delay", type="float", default=defaults.HOST_REQUEST_DELAY,
+        help="minimum delay (in seconds) between requests to the same host (default: %default)")
     op.add_option("--proxy-profiles-path",
         help="path to a folder with proxy profiles")
     op.add_option("--js-profiles-path",
@@ -74,8 +82,37 @@ def parse_opts():
              "Each place can have a ? in it that's replaced with the module name.")
     op.add_option("--lua-sandbox-allowed-modules", default="",
         help="semicolon-separated list of Lua module names allowed to be required from a sandbox.")
+    op.add_option("--lua-scripts-path",
+        help="path to a folder with named Lua scripts (<name>.lua files) "
+             "which can be executed using /execute?script=<name>")
+    op.add_option("--lua-scripts-auth-token",
+        help="secret token for registering Lua scripts using "
+             "POST /scripts/<name>; registering is disabled if this option "
+             "is not set")
+    op.add_option("--lua-runtime-pool-size", type="int", default=defaults.LUA_RUNTIME_POOL_SIZE,
+        help="number of pre-initialized Lua runtimes to keep ready (default: %default)")
+    op.add_option("--lua-max-instructions", type="int", default=defaults.LUA_MAX_INSTRUCTIONS,
+        help="maximum number of instructions a sandboxed Lua script can execute; "
+             "requests can set a lower limit (default: %default)")
+    op.add_option("--lua-max-cpu-time", type="float", default=defaults.LUA_MAX_CPU_TIME,
+        help="maximum CPU time (in seconds) a sandboxed Lua script can use; "
+             "requests can set a lower limit; 0 means no limit (default: no limit)")
     op.add_option("-v", "--verbosity", type=int, default=defaults.VERBOSITY,
         help="verbosity level; valid values are integers from 0 to 5")
+    op.add_option("--slow-callback-threshold", type="float", default=defaults.SLOW_CALLBACK_THRESHOLD,
+        help="log a stack trace when the event loop is blocked for longer "
+             "than this number of seconds; 0 disables the check "
+             "(default: %default)")
+    op.add_option("--debug-auth-token",
+        help="secret token for /debug/profile endpoint; the endpoint "
+             "is disabled if this option is not set")
+    op.add_option("--client-key-header", default=defaults.CLIENT_KEY_HEADER,
+        help="name of a request header with a client key; if it is set "
+             "resource usage of renders is aggregated per client in /metrics")
+    op.add_option("--stats-log-format", type="choice", choices=["json", "text", "none"],
+        default=defaults.STATS_LOG_FORMAT,
+        help="format of per-request stats log records: json, text or none "
+             "(default: %default)")
     op.add_option("--version", action="store_true",
         help="print Splash version number and exit")
 
@@ -160,11 +197,22 @@ def splash_server(portnum, slots, network_manager, splash_proxy_factory_cls=None
                   lua_sandbox_enabled=True,
                   lua_package_path="",
                   lua_sandbox_allowed_modules=(),
-                  verbosity=None):
+                  lua_runtime_pool_size=None,
+                  lua_scripts_path=None,
+                  lua_scripts_auth_token=None,
+                  lua_max_instructions=None,
+                  lua_max_cpu_time=None,
+                  verbosity=None,
+                  stats_log_format=None,
+                  client_key_header=None,
+                  slow_callback_threshold=None,
+                  debug_auth_token=None):
     from twisted.internet import reactor
     from twisted.web.server import Site
     from splash.resources import Root
     from splash.pool import RenderPool
+    from splash.loop_monitor import EventLoopMonitor
+    from splash.utils import process_stats
     from twisted.python import log
 
     verbosity = defaults.VERBOSITY if verbosity is None else verbosity
@@ -173,13 +221,30 @@ def splash_server(portnum, slots, network_manager, splash_proxy_factory_cls=None
     slots = defaults.SLOTS if slots is None else slots
     log.msg("slots=%s" % slots)
 
+    if lua_runtime_pool_size is None:
+        lua_runtime_pool_size = defaults.LUA_RUNTIME_POOL_SIZE
+    if lua_max_instructions is None:
+        lua_max_instructions = defaults.LUA_MAX_INSTRUCTIONS
+    if lua_max_cpu_time is None:
+        lua_max_cpu_time = defaults.LUA_MAX_CPU_TIME
+    if stats_log_format is None:
+        stats_log_format = defaults.STATS_LOG_FORMAT
+    if slow_callback_threshold is None:
+        slow_callback_threshold = defaults.SLOW_CALLBACK_THRESHOLD
+
     pool = RenderPool(
         slots=slots,
         network_manager=network_manager,
         splash_proxy_factory_cls=splash_proxy_factory_cls,
         js_profiles_path=js_profiles_path,
         verbosity=verbosity,
+        stats_log_format=stats_log_format,
+        client_key_header=client_key_header,
     )
+    loop_monitor = EventLoopMonitor(slow_callback_threshold=slow_callback_threshold)
+    loop_monitor.start()
+    if stats_log_format != 'none':
+        process_stats.start(defaults.PROCESS_STATS_INTERVAL)
 
     # HTTP API
     onoff = {True: "enabled", False: "disabled"}
@@ -199,7 +264,15 @@ def splash_server(portnum, slots, network_manager, splash_proxy_factory_cls=None
         lua_sandbox_enabled=lua_sandbox_enabled,
         lua_package_path=lua_package_path,
         lua_sandbox_allowed_modules=lua_sandbox_allowed_modules,
-
+        lua_runtime_pool_size=lua_runtime_pool_size,
+        lua_script_registry=_lua_script_registry(
+            lua_enabled, lua_sandbox_enabled, lua_scripts_path
+        ),
+        lua_scripts_auth_token=lua_scripts_auth_token,
+        lua_max_instructions=lua_max_instructions,
+        lua_max_cpu_time=lua_max_cpu_time,
+        loop_monitor=loop_monitor,
+        debug_auth_token=debug_auth_token,
     )
     factory = Site(root)
     reactor.listenTCP(portnum, factory)
@@ -238,23 +311,45 @@ def default_splash_server(portnum, slots=None,
                           js_disable_cross_domain_access=False,
                           disable_proxy=False, proxy_portnum=None,
                           filters_path=None, allowed_schemes=None,
+                          max_requests_per_host=None,
+                          max_requests_per_proxy=None,
+                          host_request_delay=None,
                           ui_enabled=True,
                           lua_enabled=True,
                           lua_sandbox_enabled=True,
                           lua_package_path="",
                           lua_sandbox_allowed_modules=(),
-                          verbosity=None):
+                          lua_runtime_pool_size=None,
+                          lua_scripts_path=None,
+                          lua_scripts_auth_token=None,
+                          lua_max_instructions=None,
+                          lua_max_cpu_time=None,
+                          verbosity=None,
+                          stats_log_format=None,
+                          client_key_header=None,
+                          slow_callback_threshold=None,
+                          debug_auth_token=None):
     from splash import network_manager
     verbosity = defaults.VERBOSITY if verbosity is None else verbosity
     if allowed_schemes is None:
         allowed_schemes = defaults.ALLOWED_SCHEMES
     else:
         allowed_schemes = allowed_schemes.split(',')
+    if max_requests_per_host is None:
+        max_requests_per_host = defaults.MAX_REQUESTS_PER_HOST
+    if max_requests_per_proxy is None:
+        max_requests_per_proxy = defaults.MAX_REQUESTS_PER_PROXY
+    if host_request_delay is None:
+        host_request_delay = defaults.HOST_REQUEST_DELAY
     manager = network_manager.SplashQNetworkAccessManager(
         filters_path=filters_path,
         allowed_schemes=allowed_schemes,
-        verbosity=verbosity
+        verbosity=verbosity,
+        max_requests_per_host=max_requests_per_host,
+        max_requests_per_proxy=max_requests_per_proxy,
+        host_request_delay=host_request_delay,
     )
+    _log_request_limits(manager)
     manager.setCache(_default_cache(cache_enabled, cache_path, cache_size))
 
     splash_proxy_factory_cls = _default_proxy_factory(proxy_profiles_path)
@@ -273,10 +368,31 @@ def default_splash_server(portnum, slots=None,
         lua_sandbox_enabled=lua_sandbox_enabled,
         lua_package_path=lua_package_path,
         lua_sandbox_allowed_modules=lua_sandbox_allowed_modules,
-        verbosity=verbosity
+        lua_runtime_pool_size=lua_runtime_pool_size,
+        lua_scripts_path=lua_scripts_path,
+        lua_scripts_auth_token=lua_scripts_auth_token,
+        lua_max_instructions=lua_max_instructions,
+        lua_max_cpu_time=lua_max_cpu_time,
+        verbosity=verbosity,
+        stats_log_format=stats_log_format,
+        client_key_header=client_key_header,
+        slow_callback_threshold=slow_callback_threshold,
+        debug_auth_token=debug_auth_token,
     )
 
 
+def _log_request_limits(manager):
+    from twisted.python import log
+
+    if manager.throttler is not None:
+        log.msg("max_requests_per_host=%(host)s, max_requests_per_proxy=%(proxy)s, "
+                "host_request_delay=%(delay)ss" % dict(
+            host=manager.throttler.limits['host'],
+            proxy=manager.throttler.limits['proxy'],
+            delay=manager.throttler.delays['host'],
+        ))
+
+
 def _default_cache(cache_enabled, cache_path, cache_size):
     from twisted.python import log
     from splash import cache
@@ -319,6 +435,24 @@ def _check_js_profiles_path(js_profiles_path):
     return js_profiles_path
 
 
+def _lua_script_registry(lua_enabled, lua_sandbox_enabled, lua_scripts_path):
+    from twisted.python import log
+    from splash import lua
+
+    if not lua_scripts_path or not lua_enabled or not lua.is_supported():
+        return None
+
+    if not os.path.isdir(lua_scripts_path):
+        log.msg("--lua-scripts-path does not exist or it is not a folder; "
+                "named Lua scripts won't be used")
+        return None
+
+    from splash.lua_scripts import LuaScriptRegistry
+    registry = LuaScriptRegistry(lua_scripts_path, sandboxed=lua_sandbox_enabled)
+    registry.load()
+    return registry
+
+
 def _set_global_render_settings(js_disable_cross_domain_access):
     from PyQt4.QtWebKit import QWebSecurityOrigin
     if js_disable_cross_domain_access is False:
@@ -361,12 +495,24 @@ def main():
             proxy_portnum=opts.proxy_portnum,
             filters_path=opts.filters_path,
             allowed_schemes=opts.allowed_schemes,
+            max_requests_per_host=opts.max_requests_per_host,
+            max_requests_per_proxy=opts.max_requests_per_proxy,
+            host_request_delay=opts.host_request_delay,
             ui_enabled=not opts.disable_ui,
             lua_enabled=not opts.disable_lua,
             lua_sandbox_enabled=not opts.disable_lua_sandbox,
             lua_package_path=opts.lua_package_path.strip(";"),
             lua_sandbox_allowed_modules=opts.lua_sandbox_allowed_modules.split(";"),
-            verbosity=opts.verbosity
+            lua_runtime_pool_size=opts.lua_runtime_pool_size,
+            lua_scripts_path=opts.lua_scripts_path,
+            lua_scripts_auth_token=opts.lua_scripts_auth_token,
+            lua_max_instructions=opts.lua_max_instructions,
+            lua_max_cpu_time=opts.lua_max_cpu_time,
+            verbosity=opts.verbosity,
+            stats_log_format=opts.stats_log_format,
+            client_key_header=opts.client_key_header,
+            slow_callback_threshold=opts.slow_callback_threshold,
+            debug_auth_token=opts.debug_auth_token,
         )
         signal.signal(signal.SIGUSR1, lambda s, f: traceback.print_stack(f))
 
@@ -0,0 +1,3 @@
+function main(splash)
+  return {
+end
@@ -0,0 +1,3 @@
+function main(splash)
+  return {hello=splash.args.name}
+end
@@ -186,6 +186,57 @@ class GetCookie(Resource):
         return value
 
 
+JsXhrAfterLoad = _html_resource("""
+<html><body>
+<div id='result'>not loaded</div>
+<script>
+window.onload = function(){
+    var xhr = new XMLHttpRequest();
+    xhr.onload = function(){
+        document.getElementById('result').innerHTML = xhr.responseText;
+    };
+    xhr.open("GET", "/delay?n=0.3", true);
+    xhr.send();
+};
+</script>
+</body></html>
+""")
+
+
+JsXhrLoop = _html_resource("""
+<html><body>
+<div id='result'>not loaded</div>
+<script>
+function load(){
+    var xhr = new XMLHttpRequest();
+    xhr.onload = function(){
+        document.getElementById('result').innerHTML = xhr.responseText;
+        load();
+    };
+    xhr.open("GET", "/delay?n=0.1&rnd=" + Math.random(), true);
+    xhr.send();
+}
+window.onload = load;
+</script>
+</body></html>
+""")
+
+
+JsDelayedElement = _html_resource("""
+<html><body>
+<div id='result'>not loaded</div>
+<script>
+setTimeout(function(){
+    var el = document.createElement("div");
+    el.setAttribute("class", "delayed");
+    el.innerHTML = "delayed element";
+    document.body.appendChild(el);
+}, 300);
+</script>
+</body></html>
+""")
+
+
 class Delay(Resource):
     """ Accept the connection; write the response after ``n`` seconds. """
     isLeaf = True
@@ -223,6 +274,43 @@ class SlowImage(Resource):
             request.finish()
 
 
+class SlowScript(Resource):
+    """ An empty script that loads n seconds """
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "application/javascript")
+        n = getarg(request, "n", 1, type=float)
+        d = deferLater(reactor, n, lambda: request)
+        d.addCallback(self._delayedRender)
+        return NOT_DONE_YET
+
+    def _delayedRender(self, request):
+        request.write("var slowScriptLoaded = true;\n")
+        if not request._disconnected:
+            request.finish()
+
+
+class HtmlWithSlowScript(Resource):
+    """ A page which requests a slow script and then a fast image """
+    isLeaf = True
+
+    def render_GET(self, request):
+        token = random.random()  # prevent caching
+        return """<html><body>
+        <script>
+        var script = document.createElement("script");
+        script.src = "/slow.js?n=0.5&rnd=%s";
+        document.body.appendChild(script);
+        var img = document.createElement("img");
+        img.src = "/slow.gif?n=0&rnd=%s";
+        document.body.appendChild(img);
+        </script>
+        </body></html>
+        """ % (token, token)
+
+
 class HtmlWithImage(Resource):
     isLeaf = True
 
@@ -234,6 +322,99 @@ class HtmlWithImage(Resource):
         """ % token
 
 
+class LargeFile(Resource):
+    """
+    A response with ``size`` bytes of data, sent in chunks
+    with ``delay`` seconds between them.
+    """
+
+    isLeaf = True
+    CHUNK_SIZE = 16*1024
+
+    def render_GET(self, request):
+        size = getarg(request, "size", 1024*1024, type=int)
+        delay = getarg(request, "delay", 0.01, type=float)
+        request.setHeader("Content-Type", "application/octet-stream")
+        self._writeChunk(request, size, delay)
+        return NOT_DONE_YET
+
+    def _writeChunk(self, request, size, delay):
+        if request._disconnected:
+            return
+        if size <= 0:
+            request.finish()
+            return
+        request.write(b"x" * min(size, self.CHUNK_SIZE))
+        deferLater(reactor, delay, self._writeChunk,
+                   request, size - self.CHUNK_SIZE, delay)
+
+
+class HtmlWithLargeFile(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        return """<html><body>
+        <img width=50 height=50 src="/large-file?size=500000">
+        </body></html>
+        """
+
+
+class SyntheticPage(Resource):
+    """
+    A configurable page used by benchmarks. GET arguments:
+
+    * ``subresources`` - number of images on the page;
+    * ``resource_delay`` - how long each image loads, seconds;
+    * ``js`` - how long a busy JS loop runs on page load, milliseconds;
+    * ``dom`` - number of extra DOM elements;
+    * ``delay`` - response delay, seconds;
+    * ``redirects`` - number of HTTP redirects before the page is returned.
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        redirects = getarg(request, "redirects", 0, type=int)
+        if redirects > 0:
+            args = {name: values[0] for name, values in request.args.items()}
+            args["redirects"] = redirects - 1
+            request.setResponseCode(302)
+            request.setHeader(b"location", "synthetic?" + urllib.urlencode(args))
+            return ""
+
+        delay = getarg(request, "delay", 0, type=float)
+        if not delay:
+            return self._getPage(request)
+        d = deferLater(reactor, delay, self._getPage, request)
+        d.addCallback(self._delayedRender, request)
+        return NOT_DONE_YET
+
+    def _delayedRender(self, html, request):
+        request.write(html)
+        if not request._disconnected:
+            request.finish()
+
+    def _getPage(self, request):
+        token = random.random()  # prevent caching
+        resource_delay = getarg(request, "resource_delay", 0, type=float)
+        images = "".join(
+            '<img width=1 height=1 src="/slow.gif?n=%s&rnd=%s-%d">' % (resource_delay, token, i)
+            for i in range(getarg(request, "subresources", 0, type=int))
+        )
+        items = "".join(
+            '<div class="item"><span>Item %d</span></div>' % i
+            for i in range(getarg(request, "dom", 0, type=int))
+        )
+        return """<html><body>
+        %s
+        %s
+        <script>
+        var end = Date.now() + %d;
+        while (Date.now() < end) {}
+        </script>
+        </body></html>
+        """ % (images, items, getarg(request, "js", 0, type=int))
+
+
 class IframeResource(Resource):
 
     def __init__(self, http_port):
@@ -527,6 +708,15 @@ class CP1251Resource(Resource):
                 '''.strip().encode('cp1251')
 
 
+class ContentTypeResource(Resource):
+    """ A response with Content-Type passed in "type" GET argument """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", getarg(request, "type"))
+        return "content of type %s" % getarg(request, "type")
+
+
 class InvalidContentTypeResource(Resource):
     def render_GET(self, request):
         request.setHeader("Content-Type", "ABRACADABRA: text/html; charset=windows-1251")
@@ -581,17 +771,26 @@ class Root(Resource):
         self.putChild("jsalert", JsAlert())
         self.putChild("jsconfirm", JsConfirm())
         self.putChild("jsinterval", JsInterval())
+        self.putChild("jsxhr-after-load", JsXhrAfterLoad())
+        self.putChild("jsxhr-loop", JsXhrLoop())
+        self.putChild("jsdelayed-element", JsDelayedElement())
         self.putChild("jsviewport", JsViewport())
         self.putChild("tall", TallPage())
         self.putChild("baseurl", BaseUrl())
         self.putChild("delay", Delay())
         self.putChild("slow.gif", SlowImage())
+        self.putChild("slow.js", SlowScript())
         self.putChild("show-image", HtmlWithImage())
+        self.putChild("show-slow-script", HtmlWithSlowScript())
+        self.putChild("show-large-file", HtmlWithLargeFile())
+        self.putChild("large-file", LargeFile())
+        self.putChild("synthetic", SyntheticPage())
         self.putChild("iframes", IframeResource(http_port))
         self.putChild("externaliframe", ExternalIFrameResource(https_port=https_port))
         self.putChild("external", ExternalResource())
         self.putChild("cp1251", CP1251Resource())
         self.putChild("cp1251-invalid", InvalidContentTypeResource())
+        self.putChild("content-type", ContentTypeResource())
         self.putChild("bad-related", BadRelatedResource())
         self.putChild("set-cookie", SetCookie()),
         self.putChild("get-cookie", GetCookie()),
@@ -128,6 +128,131 @@ class MainFunctionTest(BaseLuaRenderTest):
         self.assertStatusCode(resp, 400)
         self.assertIn("is not a function", resp.text)
 
+    def test_globals_are_not_shared(self):
+        code = """
+        function main(splash)
+          local previous = counter
+          counter = 1
+          return {previous=previous, counter=counter}
+        end
+        """
+        for i in range(3):
+            resp = self.request_lua(code)
+            self.assertStatusCode(resp, 200)
+            self.assertEqual(resp.json(), {"counter": 1})
+
+    def test_commands_are_not_shared(self):
+        code = """
+        function main(splash)
+          local previous = type(splash.foo)
+          splash.foo = splash.wait
+          splash.wait = nil
+          return {previous=previous, wait=type(splash.wait)}
+        end
+        """
+        for i in range(3):
+            resp = self.request_lua(code)
+            self.assertStatusCode(resp, 200)
+            self.assertEqual(resp.json(), {"previous": "nil", "wait": "nil"})
+
+
+class NamedScriptsTest(BaseLuaRenderTest):
+
+    def test_execute_named_script(self):
+        resp = self.request({"script": "hello", "name": "world"})
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"hello": "world"})
+
+    def test_not_found(self):
+        resp = self.request({"script": "non-existing"})
+        self.assertStatusCode(resp, 400)
+        self.assertIn("not found", resp.text)
+
+    def test_broken_script_is_not_loaded(self):
+        resp = self.request({"script": "broken"})
+        self.assertStatusCode(resp, 400)
+
+    def test_script_and_lua_source(self):
+        resp = self.request({
+            "script": "hello",
+            "lua_source": "function main(splash) return 'source' end",
+        })
+        self.assertStatusCode(resp, 400)
+        self.assertIn("can't be used together", resp.text)
+
+    def register(self, name, source, **params):
+        return requests.post(
+            self.ts.splashserver.url("scripts/" + name),
+            params=params,
+            data=source,
+            headers={
+                "Authorization": "Bearer %s" % self.ts.lua_scripts_auth_token,
+            },
+        )
+
+    def test_register(self):
+        resp = self.register("registered", """
+        function main(splash)
+          return {x=splash.args.x}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+
+        resp = self.request({"script": "registered", "x": "55"})
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"x": "55"})
+
+        resp = requests.get(self.ts.splashserver.url("scripts"))
+        self.assertIn("registered", resp.json()["scripts"])
+        self.assertIn("hello", resp.json()["scripts"])
+
+    def test_register_invalid(self):
+        resp = self.register("invalid", "function main(")
+        self.assertStatusCode(resp, 400)
+
+        resp = self.register("bad.name", "x=1")
+        self.assertStatusCode(resp, 400)
+
+        resp = self.register("newline%0A", "x=1")
+        self.assertStatusCode(resp, 400)
+
+    def test_register_requires_auth(self):
+        url = self.ts.splashserver.url("scripts/unauthorized")
+        resp = requests.post(url, data="function main(splash) end")
+        self.assertStatusCode(resp, 401)
+
+        resp = requests.post(url, data="function main(splash) end",
+                             headers={"Authorization": "Bearer wrong"})
+        self.assertStatusCode(resp, 401)
+
+        resp = self.request({"script": "unauthorized"})
+        self.assertStatusCode(resp, 400)
+
+    def test_register_disabled(self):
+        extra_args = ['--lua-scripts-path', self.ts.lua_scripts_path]
+        with SplashServer(extra_args=extra_args) as splash:
+            resp = requests.post(splash.url("scripts/disabled"),
+                                 data="function main(splash) end")
+            self.assertStatusCode(resp, 403)
+
+    def test_overwrite(self):
+        resp = self.register("overwritten", """
+        function main(splash) return "v1" end
+        """)
+        self.assertStatusCode(resp, 200)
+
+        resp = self.register("overwritten", """
+        function main(splash) return "v2" end
+        """)
+        self.assertStatusCode(resp, 409)
+        self.assertEqual(self.request({"script": "overwritten"}).text, "v1")
+
+        resp = self.register("overwritten", """
+        function main(splash) return "v2" end
+        """, overwrite=1)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(self.request({"script": "overwritten"}).text, "v2")
+
 
 class ResultContentTypeTest(BaseLuaRenderTest):
     def test_content_type(self):
@@ -643,6 +768,73 @@ class JsfuncTest(BaseLuaRenderTest):
         self.assertNotIn("str()", resp.text)
         self.assertIn("AttributeError", resp.text)
 
+    def test_many_calls(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local add = splash:jsfunc("function(a, b){return a + b}")
+            local total = 0
+            for i = 1, 1000 do
+                total = add(total, i)
+            end
+            return total
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.text, "500500")
+
+    def test_call_after_navigation(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local get_url = splash:jsfunc("function(){return document.URL}")
+            assert(splash:go(splash.args.url1))
+            local url1 = get_url()
+            assert(splash:go(splash.args.url2))
+            local url2 = get_url()
+            return {url1=url1, url2=url2}
+        end
+        """, {
+            "url1": self.mockurl("jsrender"),
+            "url2": self.mockurl("jsalert"),
+        })
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {
+            "url1": self.mockurl("jsrender"),
+            "url2": self.mockurl("jsalert"),
+        })
+
+    def test_function_removed_by_page(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local func = splash:jsfunc("function(){return 123}")
+            local res1 = func()
+            splash:runjs("window.__splash_js_functions = undefined")
+            return {res1=res1, res2=func()}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"res1": 123, "res2": 123})
+
+    def test_this_is_window(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local func = splash:jsfunc("function(){return this === window}")
+            return {res=func()}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"res": True})
+
+    def test_not_a_function(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local func = splash:jsfunc("5")
+            return func()
+        end
+        """)
+        self.assertStatusCode(resp, 400)
+        self.assertIn("error during JS function call", resp.text)
+        self.assertIn("is not a function", resp.text)
+
 
 class WaitTest(BaseLuaRenderTest):
 
@@ -757,6 +949,189 @@ class WaitTest(BaseLuaRenderTest):
         self.assertStatusCode(resp, 400)
 
 
+class WaitForNetworkIdleTest(BaseLuaRenderTest):
+
+    def go_and_wait(self, wait_args):
+        code = """
+        function main(splash)
+          assert(splash:go(splash.args.url))
+          local ok, reason = splash:wait_for_network_idle%s
+          return {ok=ok, reason=reason, html=splash:html()}
+        end
+        """ % wait_args
+        return self.request_lua(code, {'url': self.mockurl("jsxhr-after-load")})
+
+    def test_idle(self):
+        resp = self.go_and_wait("{idle_time=0.1}")
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["ok"], True)
+        self.assertIn("Response delayed", data["html"])
+
+    def test_timeout(self):
+        resp = self.go_and_wait("{idle_time=0.1, timeout=0.05}")
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["reason"], "timeout")
+        self.assertIn("not loaded", data["html"])
+
+    def test_badarg(self):
+        resp = self.go_and_wait("{idle_time=-1}")
+        self.assertStatusCode(resp, 400)
+
+
+class WaitForSelectorTest(BaseLuaRenderTest):
+
+    def go_and_wait(self, wait_args):
+        code = """
+        function main(splash)
+          assert(splash:go(splash.args.url))
+          local ok, reason = splash:wait_for_selector%s
+          return {ok=ok, reason=reason, html=splash:html()}
+        end
+        """ % wait_args
+        return self.request_lua(code, {'url': self.mockurl("jsdelayed-element")})
+
+    def test_found(self):
+        resp = self.go_and_wait("('div.delayed', 5)")
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["ok"], True)
+        self.assertIn("delayed element", data["html"])
+
+    def test_already_exists(self):
+        resp = self.go_and_wait("{selector='#result'}")
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json()["ok"], True)
+
+    def test_timeout(self):
+        resp = self.go_and_wait("{selector='div.delayed', timeout=0.05}")
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["reason"], "timeout")
+        self.assertNotIn("delayed element", data["html"])
+
+    def test_invalid_selector(self):
+        resp = self.go_and_wait("('div[')")
+        self.assertStatusCode(resp, 400)
+
+    def test_navigation(self):
+        resp = self.request_lua("""
+        function main(splash)
+          assert(splash:go(splash.args.url))
+          splash:runjs([[
+            setTimeout(function(){
+              window.location = "/jsdelayed-element";
+            }, 100);
+          ]])
+          local ok, reason = splash:wait_for_selector("div.delayed", 5)
+          return {ok=ok, reason=reason, html=splash:html()}
+        end
+        """, {'url': self.mockurl("jsrender")})
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["ok"], True)
+        self.assertIn("delayed element", data["html"])
+
+
+class ParallelTest(BaseLuaRenderTest):
+
+    def test_parallel_tabs(self):
+        resp = self.request_lua("""
+        function main(splash)
+          local funcs = {}
+          for i = 1, 3 do
+            funcs[i] = function()
+              local tab = splash:new_tab()
+              assert(tab:go(splash.args.url))
+              return tab:html()
+            end
+          end
+          local results = assert(splash:parallel(funcs))
+          return {results=results, main=splash:html()}
+        end
+        """, {"url": self.mockurl("delay?n=1"), "timeout": 2.5})
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(len(data["results"]), 3)
+        for html in data["results"]:
+            self.assertIn("Response delayed for 1.000 seconds", html)
+        self.assertNotIn("Response delayed", data["main"])
+
+    def test_parallel_keys(self):
+        resp = self.request_lua("""
+        function main(splash)
+          return assert(splash:parallel{
+            foo=function() splash:wait(0.1); return 1 end,
+            bar=function() return "bar" end,
+          })
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"foo": 1, "bar": "bar"})
+
+    def test_parallel_empty(self):
+        resp = self.request_lua("""
+        function main(splash)
+          return {results=splash:parallel{}}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"results": []})
+
+    def test_parallel_error(self):
+        resp = self.request_lua("""
+        function main(splash)
+          local results, err = splash:parallel{
+            function() splash:wait(0.1); return 1 end,
+            function() error("oops") end,
+          }
+          return {results=results, err=err}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertNotIn("results", data)
+        self.assertIn("oops", data["err"])
+
+    def test_parallel_bad_argument(self):
+        resp = self.request_lua("""
+        function main(splash)
+          return splash:parallel{1, 2}
+        end
+        """)
+        self.assertStatusCode(resp, 400)
+
+    def test_share_cookies(self):
+        resp = self.request_lua("""
+        function main(splash)
+          assert(splash:go(splash.args.set_url))
+          local shared = splash:new_tab{share_cookies=true}
+          local other = splash:new_tab()
+          assert(shared:go(splash.args.get_url))
+          assert(other:go(splash.args.get_url))
+          return {shared=shared:html(), other=other:html()}
+        end
+        """, {
+            "set_url": self.mockurl("set-cookie?key=foo&value=bar"),
+            "get_url": self.mockurl("get-cookie?key=foo"),
+        })
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertIn("bar", data["shared"])
+        self.assertNotIn("bar", data["other"])
+
+    def test_too_many_tabs(self):
+        resp = self.request_lua("""
+        function main(splash)
+          for i = 1, 20 do
+            splash:new_tab()
+          end
+        end
+        """)
+        self.assertStatusCode(resp, 400)
+
+
 class ArgsTest(BaseLuaRenderTest):
     def args_request(self, query):
         func = """
@@ -1263,6 +1638,95 @@ class SandboxTest(BaseLuaRenderTest):
         """)
         self.assertTooMuchCPU(resp)
 
+    def test_instruction_limit_per_request(self):
+        code = """
+        function main(self)
+            local x = 0
+            for i = 1, 100000 do
+                x = x + 1
+            end
+            return x
+        end
+        """
+        resp = self.request_lua(code)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.text, "100000")
+
+        resp = self.request_lua(code, {"lua_max_instructions": 10000})
+        self.assertTooMuchCPU(resp)
+        self.assertIn("10000 instructions", resp.text)
+
+    def test_instruction_limit_above_maximum(self):
+        resp = self.request_lua("function main(self) return 1 end", {
+            "lua_max_instructions": 10 ** 9,
+        })
+        self.assertStatusCode(resp, 400)
+        self.assertIn("lua_max_instructions", resp.text)
+
+    def test_cpu_time_limit(self):
+        script = """
+        function main(self)
+            local x = 0
+            while true do
+                x = x + 1
+            end
+        end
+        """
+        with SplashServer(extra_args=['--lua-max-instructions=1000000000']) as splash:
+            resp = requests.get(
+                url=splash.url("execute"),
+                params={'lua_source': script, 'lua_max_cpu_time': 0.1},
+            )
+            self.assertTooMuchCPU(resp)
+            self.assertIn("CPU time", resp.text)
+
+    def test_cpu_time_limit_above_maximum(self):
+        with SplashServer(extra_args=['--lua-max-cpu-time=2']) as splash:
+            resp = requests.get(
+                url=splash.url("execute"),
+                params={'lua_source': "function main(self) return 1 end",
+                        'lua_max_cpu_time': 1000},
+            )
+            self.assertStatusCode(resp, 400)
+            self.assertIn("lua_max_cpu_time", resp.text)
+
+    def test_cpu_time_limit_negative(self):
+        resp = self.request_lua("function main(self) return 1 end", {
+            "lua_max_cpu_time": -1,
+        })
+        self.assertStatusCode(resp, 400)
+        self.assertIn("lua_max_cpu_time", resp.text)
+
+    def test_cpu_time_limit_zero(self):
+        resp = self.request_lua("function main(self) return 'ok' end", {
+            "lua_max_cpu_time": 0,
+        })
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.text, "ok")
+
+    def test_cpu_time_commands_are_not_counted(self):
+        resp = self.request_lua("""
+        function main(splash)
+            splash:runjs([[
+                var stop = Date.now() + 300;
+                while (Date.now() < stop) {}
+            ]])
+            return "ok"
+        end
+        """, {"lua_max_cpu_time": 0.1})
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.text, "ok")
+
+    def test_cpu_time_waiting_is_not_counted(self):
+        resp = self.request_lua("""
+        function main(splash)
+            splash:wait(0.3)
+            return "ok"
+        end
+        """, {"lua_max_cpu_time": 0.2})
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.text, "ok")
+
     def test_infinite_loop_toplevel(self):
         resp = self.request_lua("""
         x = 0
@@ -1592,6 +2056,60 @@ class HttpGetTest(BaseLuaRenderTest):
         self.assertStatusCode(resp, 400)
 
 
+class HttpGetManyTest(BaseLuaRenderTest):
+
+    def test_get_many(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local urls = {}
+            for i = 1, 4 do
+                urls[i] = splash.args.url
+            end
+            local replies = splash:http_get_many(urls, {concurrency=4})
+            local statuses = {}
+            for i, reply in ipairs(replies) do
+                statuses[i] = reply.status
+            end
+            return {statuses=statuses, text=replies[1].content.text}
+        end
+        """, {"url": self.mockurl("delay?n=1"), "timeout": 2.5})
+        self.assertStatusCode(resp, 200)
+        data = resp.json()
+        self.assertEqual(data["statuses"], [200, 200, 200, 200])
+        self.assertIn("Response delayed", data["text"])
+
+    def test_keys(self):
+        resp = self.request_lua("""
+        function main(splash)
+            local replies = splash:http_get_many{
+                ok=splash.args.url,
+                bad=splash.args.bad_url,
+            }
+            return {ok=replies.ok.status, bad=replies.bad.status}
+        end
+        """, {"url": self.mockurl("jsrender"), "bad_url": self.mockurl("--bad-url--")})
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"ok": 200, "bad": 404})
+
+    def test_empty(self):
+        resp = self.request_lua("""
+        function main(splash)
+            return {replies=splash:http_get_many({})}
+        end
+        """)
+        self.assertStatusCode(resp, 200)
+        self.assertEqual(resp.json(), {"replies": []})
+
+    def test_bad_options(self):
+        for options in ["{concurrency=0}", "{foo=1}", "5"]:
+            resp = self.request_lua("""
+            function main(splash)
+                splash:http_get_many({splash.args.url}, %s)
+            end
+            """ % options, {"url": self.mockurl("jsrender")})
+            self.assertStatusCode(resp, 400)
+
+
 class NavigationLockingTest(BaseLuaRenderTest):
     def test_lock_navigation(self):
         url = self.mockurl("jsredirect")
@@ -1631,6 +2149,39 @@ class NavigationLockingTest(BaseLuaRenderTest):
         self.assertEqual(resp.json(), {"reason": "navigation_locked"})
 
 
+class ResourceFilterTest(BaseLuaRenderTest):
+    def _png_pixel(self, resource_filter):
+        resp = self.request_lua("""
+        function main(splash)
+            splash:set_viewport("100x100")
+            splash:set_resource_filter(%s)
+            assert(splash:go(splash.args.url))
+            return splash:png()
+        end
+        """ % resource_filter, {"url": self.mockurl("show-image")})
+        self.assertStatusCode(resp, 200)
+        img = Image.open(StringIO(resp.content))
+        return img.getpixel((30, 30))
+
+    def test_table(self):
+        self.assertEqual(self._png_pixel('{"image", "font"}'), (255,255,255,255))
+        self.assertEqual(self._png_pixel('{"font"}'), (0,0,0,255))
+
+    def test_string(self):
+        self.assertEqual(self._png_pixel('"image,media"'), (255,255,255,255))
+
+    def test_reset(self):
+        self.assertEqual(self._png_pixel('{}'), (0,0,0,255))
+
+    def test_invalid_type(self):
+        resp = self.request_lua("""
+        function main(splash)
+            splash:set_resource_filter{"image", "document"}
+        end
+        """)
+        self.assertStatusCode(resp, 400)
+        self.assertIn("document", resp.text)
+
 
 class SetContentTest(BaseLuaRenderTest):
     def test_set_content(self):
@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 import unittest
 import warnings
+from datetime import datetime, timedelta
 
 from splash.har import schema
 from splash.har.utils import entries2pages
@@ -109,6 +110,71 @@ class HarRenderTest(BaseHarRenderTest):
         self.assertValidHar(self.mockurl("jsinterval"))
         self.assertValidHar(self.mockurl("jsinterval"), wait=0.2)
 
+    def test_deprioritize(self):
+        # the page requests a script which loads 0.5s and then a fast image
+        url = self.mockurl("show-slow-script")
+
+        def get_entries(deprioritize):
+            data = self.assertValidHar(url, deprioritize=deprioritize)
+            entries = data["log"]["entries"]
+            self.assertEqual(len(entries), 3)
+            script, image = entries[1], entries[2]
+            self.assertIn("slow.js", script["request"]["url"])
+            self.assertIn("slow.gif", image["request"]["url"])
+            return script, image
+
+        def started_at(entry):
+            started = entry["startedDateTime"].rstrip("Z")
+            if "." not in started:
+                started += ".0"
+            return datetime.strptime(started, "%Y-%m-%dT%H:%M:%S.%f")
+
+        def sent_at(entry):
+            blocked = max(entry["timings"]["blocked"], 0)
+            return started_at(entry) + timedelta(milliseconds=blocked)
+
+        def finished_at(entry):
+            return started_at(entry) + timedelta(milliseconds=entry["time"])
+
+        # image is sent only after the script is downloaded
+        script, image = get_entries("image")
+        self.assertGreaterEqual(image["timings"]["blocked"], 300)
+        self.assertGreaterEqual(
+            sent_at(image),
+            finished_at(script) - timedelta(milliseconds=50)
+        )
+
+        # image is sent right away
+        script, image = get_entries("none")
+        self.assertLess(image["timings"]["blocked"], 300)
+        self.assertLess(sent_at(image), finished_at(script))
+
+    def test_max_response_size(self):
+        url = self.mockurl("show-large-file")
+        data = self.assertValidHar(url, max_response_size=100000)
+        entries = data["log"]["entries"]
+        self.assertEqual(len(entries), 2)
+        self.assertNotIn("comment", entries[0])
+        self.assertIn("max_response_size", entries[1]["comment"])
+        # the file is streamed in 16KB chunks; the download is aborted
+        # after the first chunk above the limit, long before its end
+        self.assertLess(entries[1]["response"]["bodySize"], 100000 + 3*16*1024)
+
+        data = self.assertValidHar(url, max_response_size=1000000)
+        self.assertNotIn("comment", data["log"]["entries"][1])
+
+    def test_max_render_bytes(self):
+        url = self.mockurl("show-large-file")
+        data = self.assertValidHar(url, max_render_bytes=100000)
+        entries = data["log"]["entries"]
+        self.assertEqual(len(entries), 2)
+        self.assertIn("max_render_bytes", entries[1]["comment"])
+
+    def test_byte_limits_invalid(self):
+        for name in ["max_response_size", "max_render_bytes"]:
+            r = self.request({"url": self.mockurl("jsrender"), name: -1})
+            self.assertStatusCode(r, 400)
+
     def test_meta_redirect_nowait(self):
         data = self.assertValidHar(self.mockurl('meta-redirect0'))
         self.assertRequestedUrlsStatuses(data, [
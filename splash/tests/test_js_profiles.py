@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from splash.js_profiles import JsProfileCache, BadJsProfile
+
+
+class JsProfileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.folder = tempfile.mkdtemp()
+        self.cache = JsProfileCache(check_interval=1.0, clock=lambda: self.now)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, text, mtime=None):
+        filename = os.path.join(self.folder, name)
+        with open(filename, 'wb') as f:
+            f.write(text.encode('utf8'))
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def test_scripts(self):
+        self.write('lib2.js', u'var b = 2;')
+        self.write('lib1.js', u'var a = "\xae";')
+        self.write('readme.txt', u'not a script')
+        self.assertEqual(self.cache.get_scripts(self.folder),
+                         (u'var a = "\xae";', u'var b = 2;'))
+
+    def test_cached(self):
+        self.write('lib1.js', u'var a = 1;', mtime=1000)
+        self.assertEqual(self.cache.get_scripts(self.folder), (u'var a = 1;',))
+
+        # file is not checked until check_interval passes
+        self.write('lib1.js', u'var a = 2;', mtime=2000)
+        self.now = 0.5
+        self.assertEqual(self.cache.get_scripts(self.folder), (u'var a = 1;',))
+
+        self.now = 1.5
+        self.assertEqual(self.cache.get_scripts(self.folder), (u'var a = 2;',))
+
+    def test_new_file(self):
+        self.write('lib1.js', u'var a = 1;')
+        self.assertEqual(len(self.cache.get_scripts(self.folder)), 1)
+        self.write('lib2.js', u'var b = 2;')
+        self.now = 1.5
+        self.assertEqual(len(self.cache.get_scripts(self.folder)), 2)
+
+    def test_exists(self):
+        self.assertTrue(self.cache.exists(self.folder))
+        self.assertFalse(self.cache.exists(os.path.join(self.folder, 'foo')))
+
+    def test_invalid_utf8(self):
+        with open(os.path.join(self.folder, 'lib1.js'), 'wb') as f:
+            f.write(b'var a = "\xff";')
+        self.assertRaises(BadJsProfile, self.cache.get_scripts, self.folder)
+        self.assertFalse(self.cache.exists(self.folder))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+
+from splash.loop_monitor import EventLoopMonitor
+
+
+class _FakeReactor(object):
+    def __init__(self):
+        self.calls = []
+
+    def callLater(self, delay, func):
+        self.calls.append(func)
+
+    def callFromThread(self, func, *args, **kwargs):
+        self.calls.append(func)
+
+
+class EventLoopMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.reactor = _FakeReactor()
+        self.monitor = EventLoopMonitor(
+            interval=0.5,
+            slow_callback_threshold=1.0,
+            clock=lambda: self.now,
+        )
+        self.monitor._reactor = self.reactor
+        self.monitor._running = True
+        self.monitor._last_tick = self.now
+        self.monitor._schedule()
+
+    def test_lag(self):
+        for now in [0.5, 1.2, 1.7, 5.0]:
+            self.now = now
+            self.monitor._tick()
+
+        stats = self.monitor.get_stats()
+        self.assertEqual(stats["lag"]["samples"], 4)
+        self.assertAlmostEqual(stats["lag"]["max"], 2.8)
+        self.assertAlmostEqual(stats["lag"]["p50"], 0.2)
+        self.assertEqual(stats["slow_callbacks"], 0)
+
+    def test_no_samples(self):
+        stats = self.monitor.get_stats()
+        self.assertEqual(stats["lag"]["p99"], 0.0)
+        self.assertEqual(stats["lag"]["samples"], 0)
+
+    def test_slow_callback(self):
+        self.now = 1.0
+        self.monitor._check_blocked()
+        self.assertEqual(self.monitor.slow_callbacks, 0)
+
+        # loop is blocked: the timer should have fired at 0.5
+        self.now = 2.0
+        self.monitor._check_blocked()
+        self.assertEqual(self.monitor.slow_callbacks, 1)
+        info = self.monitor.last_slow_callback
+        self.assertAlmostEqual(info["blocked"], 1.5)
+        self.assertIn("test_slow_callback", info["stack"])
+
+        # the same block is reported once
+        self.now = 3.0
+        self.monitor._check_blocked()
+        self.assertEqual(self.monitor.slow_callbacks, 1)
+
+        self.now = 3.1
+        self.monitor._tick()
+        self.now = 5.0
+        self.monitor._check_blocked()
+        self.assertEqual(self.monitor.slow_callbacks, 2)
@@ -2,8 +2,11 @@
 from __future__ import absolute_import
 import unittest
 import pytest
+import lupa
 
-from splash.lua import lua2python, python2lua
+from splash.lua import (
+    lua2python, python2lua, get_main, LuaChunkCache, LuaConverter
+)
 
 
 @pytest.mark.usefixtures("lua")
@@ -153,3 +156,74 @@ class LuaPythonConversionTest(unittest.TestCase):
         arr = python2lua(self.lua, [3, 4])
         arr2 = func(arr)
         self.assertEqual(lua2python(self.lua, arr2), [3, 4, "bar"])
+
+
+@pytest.mark.usefixtures("lua")
+class LuaConverterTest(unittest.TestCase):
+
+    def test_reused_converter(self):
+        converter = LuaConverter(self.lua)
+        for obj in [[1, 2], {"foo": [3, {"bar": []}]}, [[], [5]]]:
+            lua_obj = converter.python2lua(obj)
+            self.assertEqual(converter.lua2python(lua_obj), obj)
+
+    def test_large_list(self):
+        converter = LuaConverter(self.lua)
+        rows = [{"id": i, "tags": ["a", "b"]} for i in range(5000)]
+        self.assertEqual(converter.lua2python(converter.python2lua(rows)), rows)
+
+    def test_list_metatable_is_hidden(self):
+        converter = LuaConverter(self.lua)
+        getmetatable = self.lua.eval("getmetatable")
+        self.assertEqual(getmetatable(converter.python2lua([1])), "list")
+
+    def test_non_binary(self):
+        converter = LuaConverter(self.lua)
+        value = converter.lua2python(self.lua.eval("'foo'"), binary=False)
+        self.assertIsInstance(value, unicode)
+
+    def test_strict(self):
+        converter = LuaConverter(self.lua)
+        func = self.lua.eval("function() end")
+        with pytest.raises(ValueError):
+            converter.lua2python(func)
+        self.assertIs(converter.lua2python(func, strict=False), func)
+
+
+@pytest.mark.usefixtures("lua")
+class LuaChunkCacheTest(unittest.TestCase):
+    script = """
+    x = 5
+    function main() return x * 2 end
+    """
+
+    def test_cached_main(self):
+        cache = LuaChunkCache(max_size=10)
+        for i in range(3):
+            lua = lupa.LuaRuntime()
+            main, env = get_main(lua, self.script, cache)
+            self.assertEqual(main(), 10)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+        self.assertEqual(cache.get_stats()["hits"], 2)
+
+    def test_sandbox_mode_is_a_part_of_key(self):
+        cache = LuaChunkCache(max_size=10)
+        cache.get(self.lua, self.script, sandboxed=False)
+        cache.get(self.lua, self.script, sandboxed=True)
+        self.assertEqual(cache.get_stats()["misses"], 2)
+        self.assertEqual(cache.get_stats()["size"], 2)
+
+    def test_eviction(self):
+        cache = LuaChunkCache(max_size=2)
+        for script in ["x=1", "x=2", "x=1", "x=3", "x=2"]:
+            cache.get(self.lua, script, sandboxed=False)
+        stats = cache.get_stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["evictions"], 2)
+
+    def test_syntax_error(self):
+        cache = LuaChunkCache(max_size=10)
+        with pytest.raises(lupa.LuaSyntaxError):
+            cache.get(self.lua, "function main(", sandboxed=False)
+        self.assertEqual(cache.get_stats()["size"], 0)
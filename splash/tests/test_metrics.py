@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import json
+import unittest
+
+import pytest
+import requests
+
+from splash import metrics, defaults
+from splash.metrics import MetricsRegistry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter('requests_total', 'Requests', ['status'])
+        counter.inc(['ok'])
+        counter.inc(['ok'], 2)
+        counter.inc(['error'])
+        self.assertEqual(counter.get(['ok']), 3)
+        self.assertEqual(self.registry.render(), "\n".join([
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{status="error"} 1',
+            'requests_total{status="ok"} 3',
+        ]) + "\n")
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('queue_depth', 'Queue depth')
+        gauge.set(value=5)
+        gauge.set(value=2.5)
+        self.assertIn('\nqueue_depth 2.5\n', self.registry.render())
+
+    def test_histogram(self):
+        hist = self.registry.histogram('latency', 'Latency', ['endpoint'], [0.1, 1])
+        for value in [0.05, 0.1, 0.5, 2]:
+            hist.observe(value, ['render.html'])
+        self.assertEqual(hist.get(['render.html']), (4, 2.65))
+        self.assertEqual(self.registry.render(), "\n".join([
+            '# HELP latency Latency',
+            '# TYPE latency histogram',
+            'latency_bucket{endpoint="render.html",le="0.1"} 2',
+            'latency_bucket{endpoint="render.html",le="1.0"} 3',
+            'latency_bucket{endpoint="render.html",le="+Inf"} 4',
+            'latency_sum{endpoint="render.html"} 2.65',
+            'latency_count{endpoint="render.html"} 4',
+        ]) + "\n")
+
+    def test_labels_escaping(self):
+        counter = self.registry.counter('foo', 'Foo', ['name'])
+        counter.inc([u'a"b\\c\n\xae'])
+        self.assertIn('foo{name="a\\"b\\\\c\\n\xc2\xae"} 1', self.registry.render())
+
+    def test_bad_labels(self):
+        counter = self.registry.counter('foo', 'Foo', ['name'])
+        self.assertRaises(ValueError, counter.inc, [])
+        self.assertRaises(ValueError, counter.inc, ['a', 'b'])
+
+
+class ClientMetricsTest(unittest.TestCase):
+
+    stats = {
+        'network_requests': 3,
+        'network_bytes': 1000,
+        'blocked_requests': 1,
+        'js_time': 0.5,
+        'wall_time': 2.0,
+    }
+
+    def tearDown(self):
+        metrics._client_keys.clear()
+
+    def test_per_client(self):
+        metrics.observe_render_stats(self.stats, 'test-client-a')
+        metrics.observe_render_stats(dict(self.stats, lua_instructions=10), 'test-client-a')
+        self.assertEqual(metrics.CLIENT_RENDERS.get(['test-client-a']), 2)
+        self.assertEqual(metrics.CLIENT_NETWORK_BYTES.get(['test-client-a']), 2000)
+        self.assertEqual(metrics.CLIENT_BLOCKED_REQUESTS.get(['test-client-a']), 2)
+        self.assertEqual(metrics.CLIENT_RENDER_TIME.get(['test-client-a']), 4.0)
+        self.assertEqual(metrics.CLIENT_LUA_INSTRUCTIONS.get(['test-client-a']), 10)
+
+    def test_max_client_keys(self):
+        other = metrics.CLIENT_RENDERS.get(['other'])
+        for key in ['test-client-b', 'test-client-c', 'test-client-d']:
+            metrics.observe_render_stats(self.stats, key, max_client_keys=2)
+        self.assertEqual(metrics.CLIENT_RENDERS.get(['test-client-c']), 1)
+        self.assertEqual(metrics.CLIENT_RENDERS.get(['test-client-d']), 0)
+        self.assertEqual(metrics.CLIENT_RENDERS.get(['other']), other + 1)
+
+
+class ThrottleMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        # throttler tests record waits too
+        metrics._throttle_keys.clear()
+
+    def tearDown(self):
+        metrics._throttle_keys.clear()
+
+    def test_max_keys(self):
+        hist = metrics.THROTTLE_QUEUE_WAIT_TIME
+        other = hist.get(['host', 'other'])
+        for host in ['test-a.example', 'test-b.example', 'test-c.example']:
+            metrics.observe_throttle_wait(('host', host), 0.5, max_keys=2)
+        self.assertEqual(hist.get(['host', 'test-b.example'])[0], 1)
+        self.assertEqual(hist.get(['host', 'test-c.example']), (0, 0.0))
+        self.assertEqual(hist.get(['host', 'other'])[0], other[0] + 1)
+
+
+@pytest.mark.usefixtures("class_ts")
+@pytest.mark.usefixtures("print_ts_output")
+class MetricsEndpointTest(unittest.TestCase):
+
+    def splash_url(self, path):
+        return 'http://localhost:%s/%s' % (self.ts.splashserver.portnum, path)
+
+    def test_metrics(self):
+        resp = requests.get(self.splash_url('render.html'), params={
+            'url': self.ts.mockserver.url("jsrender"),
+        })
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(self.splash_url('render.html'))  # no url
+        self.assertEqual(resp.status_code, 400)
+
+        resp = requests.get(self.splash_url('metrics'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('text/plain', resp.headers['content-type'])
+        text = resp.text
+        self.assertIn('splash_render_duration_seconds_count{endpoint="render.html",outcome="ok"}', text)
+        self.assertIn('splash_render_duration_seconds_count{endpoint="render.html",outcome="bad_request"}', text)
+        self.assertIn('splash_queue_wait_seconds_count', text)
+        self.assertIn('splash_render_network_requests_count', text)
+        self.assertIn('splash_slots ', text)
+        self.assertIn('splash_active_slots 0', text)
+        self.assertIn('splash_queue_depth 0', text)
+
+
+@pytest.mark.usefixtures("class_ts")
+@pytest.mark.usefixtures("print_ts_output")
+class DebugEndpointTest(unittest.TestCase):
+
+    def splash_url(self, path):
+        return 'http://localhost:%s/%s' % (self.ts.splashserver.portnum, path)
+
+    def test_instances(self):
+        resp = requests.get(self.splash_url('render.html'), params={
+            'url': self.ts.mockserver.url("jsrender"),
+        })
+        self.assertEqual(resp.status_code, 200)
+
+        info = requests.get(self.splash_url('debug')).json()
+        self.assertIn('BrowserTab', info['instances'])
+        self.assertIn('HtmlRender', info['instances'])
+        self.assertNotIn('leaks', info)
+
+    def test_lua_runtimes_in_use(self):
+        # runtimes of running scripts are counted, not only idle pooled ones
+        resp = requests.get(self.splash_url('execute'), params={
+            'lua_source': """
+            function main(splash)
+                splash:wait(0.2)  -- let the runtime pool refill
+                return splash:http_get(splash.args.debug_url).content.text
+            end
+            """,
+            'debug_url': self.splash_url('debug'),
+        })
+        self.assertEqual(resp.status_code, 200)
+        info = json.loads(resp.text)
+        self.assertGreaterEqual(info['instances']['LuaRuntime'],
+                                defaults.LUA_RUNTIME_POOL_SIZE + 1)
+
+    def test_full(self):
+        info = requests.get(self.splash_url('debug'), params={'full': 1}).json()
+        self.assertIn('leaks', info)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import sys
+import unittest
+
+import requests
+
+from splash.profiler import collapse_stack, SamplingProfiler, CProfileProfiler
+from .utils import SplashServer
+
+
+def _busy_function(n):
+    return sum(i * i for i in range(n))
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_collapse_stack(self):
+        stack = collapse_stack(sys._getframe())
+        names = stack.split(";")
+        self.assertTrue(names[-1].startswith("test_collapse_stack (test_profiler.py:"))
+        self.assertGreater(len(names), 1)
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler()
+        profiler.sample()
+        profiler.sample()
+        result = profiler.get_result()
+        self.assertEqual(len(result.splitlines()), 1)
+        stack, count = result.strip().rsplit(" ", 1)
+        self.assertEqual(count, "2")
+        self.assertIn("test_sampling_profiler", stack)
+
+    def test_cprofile_profiler(self):
+        profiler = CProfileProfiler()
+        profiler.start()
+        _busy_function(1000)
+        profiler.stop()
+        self.assertIn("_busy_function", profiler.get_result())
+
+
+class ProfileEndpointTest(unittest.TestCase):
+
+    def test_disabled(self):
+        with SplashServer() as splash:
+            resp = requests.get(splash.url("debug/profile"), params={"seconds": 0.1})
+            self.assertEqual(resp.status_code, 403)
+
+            # /debug still works
+            resp = requests.get(splash.url("debug"))
+            self.assertEqual(resp.status_code, 200)
+
+    def test_profile(self):
+        with SplashServer(extra_args=['--debug-auth-token=secret']) as splash:
+            url = splash.url("debug/profile")
+            resp = requests.get(url, params={"seconds": 0.1})
+            self.assertEqual(resp.status_code, 401)
+
+            resp = requests.get(url, params={"seconds": 0.1},
+                                headers={"Authorization": "Bearer wrong"})
+            self.assertEqual(resp.status_code, 401)
+
+            headers = {"Authorization": "Bearer secret"}
+            resp = requests.get(url, params={"seconds": 1000}, headers=headers)
+            self.assertEqual(resp.status_code, 400)
+
+            resp = requests.get(url, params={"seconds": 0.5}, headers=headers)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("reactor", resp.text)
+
+            resp = requests.get(url, params={"seconds": 0.5, "mode": "cprofile"},
+                                headers=headers)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("function calls", resp.text)
@@ -190,6 +190,65 @@ class RenderHtmlTest(Base.RenderTest):
         self.assertIn('SAME_DOMAIN', r.text)
         self.assertNotIn('OTHER_DOMAIN', r.text)
 
+    def test_deprioritize(self):
+        for value in ['image,font', 'none', '']:
+            r = self.request({'url': self.mockurl('iframes'), 'deprioritize': value})
+            self.assertStatusCode(r, 200)
+            self.assertIn('SAME_DOMAIN', r.text)
+            self.assertIn('OTHER_DOMAIN', r.text)
+
+    def test_deprioritize_invalid(self):
+        r = self.request({'url': self.mockurl('iframes'), 'deprioritize': 'image,foo'})
+        self.assertStatusCode(r, 400)
+        self.assertIn('foo', r.text)
+
+    def test_wait_for_network_idle(self):
+        url = self.mockurl('jsxhr-after-load')
+        r = self.request({'url': url})
+        self.assertStatusCode(r, 200)
+        self.assertIn('not loaded', r.text)
+
+        r = self.request({'url': url, 'wait_for': 'network_idle', 'wait': 5})
+        self.assertStatusCode(r, 200)
+        self.assertIn('Response delayed', r.text)
+
+    def test_wait_for_network_idle_max_wait(self):
+        r = self.request({'url': self.mockurl('jsxhr-after-load'), 'wait': 0.1,
+                          'wait_for': 'network_idle', 'network_idle_time': 0.05})
+        self.assertStatusCode(r, 200)
+        self.assertIn('not loaded', r.text)
+
+    def test_wait_for_network_idle_default_max_wait(self):
+        # the network is never idle; wait=0 means "wait at most 10s"
+        r = self.request({'url': self.mockurl('jsxhr-loop'), 'timeout': 20,
+                          'wait_for': 'network_idle'})
+        self.assertStatusCode(r, 200)
+        self.assertIn('Response delayed', r.text)
+
+    def test_wait_for_invalid(self):
+        r = self.request({'url': self.mockurl('jsrender'), 'wait_for': 'foo'})
+        self.assertStatusCode(r, 400)
+
+    def test_wait_for_selector(self):
+        url = self.mockurl('jsdelayed-element')
+        r = self.request({'url': url, 'wait_for_selector': 'div.delayed', 'wait': 5})
+        self.assertStatusCode(r, 200)
+        self.assertIn('delayed element', r.text)
+
+        r = self.request({'url': url, 'wait_for_selector': 'div.delayed', 'wait': 0.1})
+        self.assertStatusCode(r, 200)
+        self.assertNotIn('delayed element', r.text)
+
+    def test_wait_for_selector_default_max_wait(self):
+        # the element never appears; wait=0 means "wait at most 10s"
+        r = self.request({'url': self.mockurl('jsrender'), 'timeout': 20,
+                          'wait_for_selector': 'div.missing'})
+        self.assertStatusCode(r, 200)
+
+    def test_wait_for_selector_invalid(self):
+        r = self.request({'url': self.mockurl('jsrender'), 'wait_for_selector': 'div['})
+        self.assertStatusCode(r, 400)
+
     def test_viewport(self):
         r = self.request({'url': self.mockurl('jsviewport'), 'viewport': '300x400'})
         self.assertStatusCode(r, 200)
@@ -316,6 +375,28 @@ class RenderPngTest(Base.RenderTest):
         r = self.request({'url': self.mockurl("show-image"), 'viewport': '100x100', 'images': 0})
         self.assertPixelColor(r, 30, 30, (255,255,255,255))
 
+    def test_block_resources(self):
+        r = self.request({'url': self.mockurl("show-image"), 'viewport': '100x100',
+                          'block_resources': 'image,font'})
+        self.assertPixelColor(r, 30, 30, (255,255,255,255))
+
+        r = self.request({'url': self.mockurl("show-image"), 'viewport': '100x100',
+                          'block_resources': 'font'})
+        self.assertPixelColor(r, 30, 30, (0,0,0,255))
+
+    def test_block_resources_main_document(self):
+        for content_type, resource_type in [('text/plain', 'other'),
+                                            ('application/json', 'xhr'),
+                                            ('image/png', 'image')]:
+            url = self.mockurl("content-type?type=%s" % content_type)
+            r = self.request({'url': url, 'block_resources': resource_type})
+            self.assertStatusCode(r, 200)
+
+    def test_block_resources_invalid(self):
+        for value in ['image,foo', 'document']:
+            r = self.request({'url': self.mockurl("show-image"), 'block_resources': value})
+            self.assertStatusCode(r, 400)
+
     def assertPng(self, response, width=None, height=None):
         self.assertStatusCode(response, 200)
         self.assertEqual(response.headers["content-type"], "image/png")
@@ -472,6 +553,47 @@ class RenderJsonTest(Base.RenderTest):
         self.assertTrue(u'проверка' in html)
         self.assertTrue(u'1251' in html)
 
+    def test_timings(self):
+        r = self.request({'url': self.mockurl('jsrender'), 'html': 1, 'timings': 1})
+        self.assertStatusCode(r, 200)
+        timings = r.json()['timings']
+        for phase in ['queue', 'tab', 'navigation', 'wait', 'js', 'html']:
+            self.assertIn(phase, timings)
+            self.assertGreaterEqual(timings[phase], 0)
+
+        r = self.request({'url': self.mockurl('jsrender')})
+        self.assertNotIn('timings', r.json())
+
+    def test_stats(self):
+        r = self.request({'url': self.mockurl('show-image'), 'stats': 1,
+                          'block_resources': 'image', 'js_source': 'document.title'})
+        self.assertStatusCode(r, 200)
+        stats = r.json()['stats']
+        self.assertGreaterEqual(stats['network_requests'], 2)
+        self.assertGreater(stats['network_bytes'], 0)
+        self.assertEqual(stats['blocked_requests'], 1)
+        self.assertGreater(stats['js_time'], 0)
+        self.assertGreater(stats['wall_time'], stats['js_time'])
+
+        r = self.request({'url': self.mockurl('jsrender')})
+        self.assertNotIn('stats', r.json())
+
+    def test_server_timing_header(self):
+        r = self.request({'url': self.mockurl('jsrender'), 'png': 1})
+        self.assertStatusCode(r, 200)
+        names = [item.strip().split(';')[0]
+                 for item in r.headers['Server-Timing'].split(',')]
+        for phase in ['queue', 'navigation', 'png', 'json', 'total']:
+            self.assertIn(phase, names)
+
+    def test_server_timing_header_error(self):
+        r = self.request({'url': self.mockurl('jsrender'), 'viewport': 'foo'})
+        self.assertStatusCode(r, 400)
+        self.assertIn('total;dur=', r.headers['Server-Timing'])
+
+        r = self.request({'url': self.mockurl('delay?n=10'), 'timeout': 0.5})
+        self.assertStatusCode(r, 504)
+        self.assertIn('queue;dur=', r.headers['Server-Timing'])
 
     def assertFieldsInResponse(self, res, fields):
         for key in fields:
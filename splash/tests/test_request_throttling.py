@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+
+import pytest
+import requests
+
+from splash.request_throttling import RequestThrottler, DeprioritizedRequests
+from .utils import SplashServer
+
+
+class _FakeDelayedCall(object):
+    def __init__(self, when, func):
+        self.when = when
+        self.func = func
+        self.called = False
+
+    def active(self):
+        return not self.called
+
+    def cancel(self):
+        self.called = True
+
+
+class RequestThrottlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.calls = []
+        self.started = []
+
+    def clock(self):
+        return self.now
+
+    def call_later(self, delay, func):
+        call = _FakeDelayedCall(self.now + delay, func)
+        self.calls.append(call)
+        return call
+
+    def advance(self, seconds):
+        self.now += seconds
+        for call in list(self.calls):
+            if call.active() and call.when <= self.now:
+                call.called = True
+                call.func()
+
+    def get_throttler(self, **kwargs):
+        return RequestThrottler(clock=self.clock, call_later=self.call_later, **kwargs)
+
+    def acquire(self, throttler, name, keys):
+        return throttler.acquire(keys, lambda wait: self.started.append((name, wait)))
+
+    def test_disabled(self):
+        self.assertFalse(self.get_throttler().is_enabled())
+        self.assertFalse(self.get_throttler(limits={'host': 0}).is_enabled())
+        self.assertTrue(self.get_throttler(limits={'host': 2}).is_enabled())
+        self.assertTrue(self.get_throttler(delays={'host': 0.5}).is_enabled())
+
+    def test_concurrency_limit(self):
+        throttler = self.get_throttler(limits={'host': 2})
+        keys = [('host', 'example.com')]
+        for name in 'abc':
+            self.acquire(throttler, name, keys)
+        self.assertEqual(self.started, [('a', 0.0), ('b', 0.0)])
+
+        self.now = 1.5
+        throttler.release(keys)
+        self.assertEqual(self.started[-1], ('c', 1.5))
+
+    def test_hosts_are_independent(self):
+        throttler = self.get_throttler(limits={'host': 1})
+        self.acquire(throttler, 'a', [('host', 'example.com')])
+        self.acquire(throttler, 'b', [('host', 'example.com')])
+        self.acquire(throttler, 'c', [('host', 'example.org')])
+        self.assertEqual([name for name, wait in self.started], ['a', 'c'])
+
+    def test_proxy_limit(self):
+        throttler = self.get_throttler(limits={'host': 0, 'proxy': 1})
+        proxy = ('proxy', '127.0.0.1:8080')
+        self.acquire(throttler, 'a', [('host', 'example.com'), proxy])
+        self.acquire(throttler, 'b', [('host', 'example.org'), proxy])
+        self.acquire(throttler, 'c', [('host', 'example.org')])
+        self.assertEqual([name for name, wait in self.started], ['a', 'c'])
+
+        throttler.release([('host', 'example.com'), proxy])
+        self.assertEqual([name for name, wait in self.started], ['a', 'c', 'b'])
+
+    def test_delay(self):
+        throttler = self.get_throttler(delays={'host': 1.0})
+        keys = [('host', 'example.com')]
+        for name in 'abc':
+            self.acquire(throttler, name, keys)
+        self.assertEqual(self.started, [('a', 0.0)])
+
+        self.advance(0.5)
+        self.assertEqual(len(self.started), 1)
+        self.advance(0.5)
+        self.assertEqual(self.started[-1], ('b', 1.0))
+        self.advance(1.0)
+        self.assertEqual(self.started[-1], ('c', 2.0))
+
+    def test_cancel(self):
+        throttler = self.get_throttler(limits={'host': 1})
+        keys = [('host', 'example.com')]
+        self.acquire(throttler, 'a', keys)
+        waiter = self.acquire(throttler, 'b', keys)
+        self.acquire(throttler, 'c', keys)
+        throttler.cancel(waiter)
+        throttler.release(keys)
+        self.assertEqual([name for name, wait in self.started], ['a', 'c'])
+
+    def test_stats(self):
+        throttler = self.get_throttler(limits={'host': 1})
+        keys = [('host', 'example.com')]
+        self.acquire(throttler, 'a', keys)
+        self.acquire(throttler, 'b', keys)
+        self.acquire(throttler, 'c', keys)
+
+        stats = throttler.get_stats()['host:example.com']
+        self.assertEqual(stats['active'], 1)
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['started'], 1)
+
+        self.now = 2.0
+        throttler.release(keys)
+        stats = throttler.get_stats()['host:example.com']
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['started'], 2)
+        self.assertEqual(stats['delayed'], 1)
+        self.assertEqual(stats['max_wait'], 2.0)
+        self.assertEqual(stats['avg_wait'], 2.0)
+
+
+class DeprioritizedRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.started = []
+
+    def call_later(self, delay, func):
+        call = _FakeDelayedCall(delay, func)
+        self.calls.append(call)
+        return call
+
+    def add(self, deprioritized, name):
+        callback = lambda: self.started.append(name)
+        deprioritized.add(callback)
+        return callback
+
+    def test_wait_for_high_priority(self):
+        deprioritized = DeprioritizedRequests(call_later=self.call_later)
+        self.assertFalse(deprioritized.should_wait())
+        deprioritized.started()
+        deprioritized.started()
+        self.assertTrue(deprioritized.should_wait())
+        self.add(deprioritized, 'a')
+        self.add(deprioritized, 'b')
+        deprioritized.finished()
+        self.assertEqual(self.started, [])
+        deprioritized.finished()
+        self.assertEqual(self.started, ['a', 'b'])
+        self.assertFalse(deprioritized.should_wait())
+        self.assertFalse(self.calls[0].active())
+
+    def test_max_delay(self):
+        deprioritized = DeprioritizedRequests(max_delay=2, call_later=self.call_later)
+        deprioritized.started()
+        self.add(deprioritized, 'a')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0].when, 2)
+        self.calls[0].func()
+        self.assertEqual(self.started, ['a'])
+        deprioritized.finished()
+        self.assertEqual(self.started, ['a'])
+
+    def test_remove(self):
+        deprioritized = DeprioritizedRequests(call_later=self.call_later)
+        deprioritized.started()
+        self.add(deprioritized, 'a')
+        callback = self.add(deprioritized, 'b')
+        deprioritized.remove(callback)
+        deprioritized.finished()
+        self.assertEqual(self.started, ['a'])
+
+
+@pytest.mark.usefixtures("class_ts")
+@pytest.mark.usefixtures("print_ts_output")
+class ThrottledRepliesTest(unittest.TestCase):
+
+    def test_large_body_slow_reader(self):
+        # With a limit of 1 request per host XHRs are queued and get
+        # placeholder replies; the page reads response bodies slowly,
+        # so data is read after the real replies are finished.
+        script = """
+        function main(splash)
+          assert(splash:go(splash.args.url))
+          splash:runjs([[
+            window.sizes = [];
+            for (var i = 0; i < 3; i++) {
+              var xhr = new XMLHttpRequest();
+              xhr.open("GET", "/large-file?size=2000000&delay=0&n=" + i);
+              xhr.onprogress = function () {
+                var stop = Date.now() + 20;
+                while (Date.now() < stop) {}
+              };
+              xhr.onload = function () {
+                window.sizes.push(this.responseText.length);
+              };
+              xhr.send();
+            }
+          ]])
+          local get_sizes = splash:jsfunc("function () { return window.sizes; }")
+          for i = 1, 100 do
+            if #get_sizes() == 3 then
+              break
+            end
+            splash:wait(0.1)
+          end
+          return get_sizes()
+        end
+        """
+        extra_args = ['--max-requests-per-host=1']
+        with SplashServer(extra_args=extra_args) as splash:
+            resp = requests.get(splash.url("execute"), params={
+                'lua_source': script,
+                'url': self.ts.mockserver.url("jsrender", gzip=False),
+            })
+            self.assertEqual(resp.status_code, 200, resp.text)
+            self.assertEqual(resp.json(), [2000000, 2000000, 2000000])
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import gc
+import unittest
+
+from splash.utils import InstanceCounter
+
+
+class _Tracked(object):
+    pass
+
+
+class InstanceCounterTest(unittest.TestCase):
+
+    def test_track(self):
+        counter = InstanceCounter()
+        obj1, obj2 = _Tracked(), _Tracked()
+        counter.track(obj1)
+        counter.track(obj2, "Foo")
+        self.assertEqual(counter.get_counts(), {"_Tracked": 1, "Foo": 1})
+
+        del obj1
+        gc.collect()
+        self.assertEqual(counter.get_counts(), {"_Tracked": 0, "Foo": 1})
+
+    def test_cycles(self):
+        counter = InstanceCounter()
+        obj = _Tracked()
+        obj.ref = obj
+        counter.track(obj)
+        del obj
+        gc.collect()
+        self.assertEqual(counter.get_counts(), {"_Tracked": 0})
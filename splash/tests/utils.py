@@ -157,7 +157,9 @@ class TestServers(object):
         self.filters_path = self._copy_test_folder('filters')
 
         self.lua_modules = self._copy_test_folder('lua_modules')
+        self.lua_scripts_path = self._copy_test_folder('lua_scripts')
         self.lua_sandbox_allowed_modules = ['emulation', 'utils', 'utils_patch', 'non_existing']
+        self.lua_scripts_auth_token = 'lua-scripts-token'
 
         self.mock_http_port = get_ephemeral_port()
         self.mock_https_port = get_ephemeral_port()
@@ -198,6 +200,8 @@ class TestServers(object):
             extra_args = [
                 '--lua-package-path', '%s/?.lua' % self.lua_modules.rstrip('/'),
                 '--lua-sandbox-allowed-modules', ';'.join(self.lua_sandbox_allowed_modules),
+                '--lua-scripts-path', self.lua_scripts_path,
+                '--lua-scripts-auth-token', self.lua_scripts_auth_token,
             ]
         )
         self.splashserver.__enter__()
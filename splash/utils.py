@@ -4,10 +4,13 @@ import os
 import gc
 import sys
 import json
+import time
 import base64
 import inspect
+import weakref
 import resource
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 import psutil
 
 
@@ -31,12 +34,138 @@ class SplashJSONEncoder(json.JSONEncoder):
         return super(SplashJSONEncoder, self).default(o)
 
 
+class Timings(object):
+    """
+    Durations of render phases. Phases are kept in the order they
+    are first recorded; if a phase is recorded several times
+    its durations are summed.
+    """
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._durations = OrderedDict()  # phase name => duration, seconds
+        self._started = {}
+
+    def start(self, name):
+        self._started[name] = self._clock()
+
+    def stop(self, name):
+        """ Finish a phase; do nothing if the phase is not started """
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.add(name, self._clock() - started)
+
+    def add(self, name, duration):
+        self._durations[name] = self._durations.get(name, 0.0) + duration
+
+    def get(self, name):
+        """ Return a duration of a phase, in seconds """
+        return self._durations.get(name, 0.0)
+
+    @contextmanager
+    def measure(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def todict(self):
+        """ Return an ordered dict with phase durations in milliseconds """
+        return OrderedDict(
+            (name, round(duration * 1000, 1))
+            for name, duration in self._durations.items()
+        )
+
+    def server_timing(self, **extra):
+        """
+        Return a value for Server-Timing HTTP header.
+        ``extra`` are additional durations in seconds.
+        """
+        durations = list(self._durations.items()) + sorted(extra.items())
+        return ", ".join(
+            "%s;dur=%.1f" % (name, duration * 1000)
+            for name, duration in durations
+        )
+
+
 PID = os.getpid()
 def get_num_fds():
     proc = psutil.Process(PID)
     return proc.get_num_fds()
 
 
+class ProcessStats(object):
+    """
+    Process-wide stats (memory usage, load average, number of open files).
+    They are not cheap to get, so they are sampled periodically
+    (see :meth:`start`) and cached values are used in per-request logs.
+    """
+    def __init__(self):
+        self._stats = None
+
+    def sample(self):
+        self._stats = {
+            "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "load": os.getloadavg(),
+            "fds": get_num_fds(),
+        }
+
+    def get(self):
+        """ Return a dict with the last sampled stats """
+        if self._stats is None:
+            self.sample()
+        return self._stats
+
+    def start(self, interval):
+        """ Sample stats every ``interval`` seconds """
+        from twisted.internet import task
+        task.LoopingCall(self.sample).start(interval, now=True)
+
+
+process_stats = ProcessStats()
+
+
+class InstanceCounter(object):
+    """
+    Counters of live instances of tracked classes. Objects are counted
+    when they are created, so getting the counts is much cheaper than
+    scanning all objects with the garbage collector (see :func:`get_leaks`).
+    """
+    def __init__(self):
+        self.counts = defaultdict(int)  # name => number of live instances
+        self._refs = set()
+
+    def track(self, obj, name=None):
+        """ Count ``obj`` until it is garbage collected """
+        name = name or type(obj).__name__
+        self.counts[name] += 1
+
+        def on_deleted(ref):
+            self._refs.discard(ref)
+            self.counts[name] -= 1
+
+        self._refs.add(weakref.ref(obj, on_deleted))
+
+    def track_qobject(self, obj, name=None):
+        """
+        Count a Qt object until its C++ object is destroyed. Use it for
+        objects owned by Qt: Python wrappers of such objects can be
+        garbage collected earlier.
+        """
+        name = name or type(obj).__name__
+        self.counts[name] += 1
+        obj.destroyed.connect(lambda *args: self._decrement(name))
+
+    def get_counts(self):
+        return dict(self.counts)
+
+    def _decrement(self, name):
+        self.counts[name] -= 1
+
+
+instance_counter = InstanceCounter()
+
+
 def get_leaks():
     relevant_types = frozenset(('SplashQWebPage', 'SplashQNetworkAccessManager',
         'HtmlRender', 'PngRender', 'JsonRender', 'HarRender', 'LuaRender',